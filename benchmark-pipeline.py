@@ -0,0 +1,389 @@
+#!/usr/bin/env python3
+"""
+Offline end-to-end pipeline benchmark
+
+Runs upload-execution -> document-splitter -> image-converter -> polly-invoker
+with the real handler code against the fakes in local_aws.py. Bedrock, Polly,
+S3 and DynamoDB get configurable latency and throttling, so the numbers
+reflect the handlers' own overhead plus the modelled service time.
+
+Reports per document size: p50/p95 latency per stage and end to end,
+pages/sec, characters/sec and peak Python memory (tracemalloc, measured in a
+separate pass so it does not skew timings).
+
+Usage:
+  python3 benchmark-pipeline.py
+  python3 benchmark-pipeline.py --pdf-pages 1 10 50 --text-chars 1000 20000 --repeat 5
+  python3 benchmark-pipeline.py --bedrock-latency 2.0 --bedrock-throttle-rate 0.1 --output bench.json
+  python3 benchmark-pipeline.py --baseline old-bench.json --tolerance 0.2
+
+Burst mode submits many jobs at once with Bedrock and Polly concurrency
+limits, once pushing every event straight into a handler (the old
+stream/SNS/S3 wiring) and once through the SQS stage queues from
+template.yaml, and compares finished and failed jobs:
+  python3 benchmark-pipeline.py --burst 200 --bedrock-concurrency 4 --polly-concurrency 4 --bedrock-latency 0.05
+"""
+
+import argparse
+import base64
+import json
+import platform
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+
+import local_aws
+
+STAGES = ['upload-execution', 'document-splitter', 'image-converter', 'polly-invoker']
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def make_aws(args):
+    return local_aws.LocalAWS(
+        bedrock=local_aws.FakeBedrock(
+            local_aws.Behavior(args.bedrock_latency, args.jitter, args.bedrock_throttle_rate, args.bedrock_concurrency, seed=1),
+            latency_per_output_token=args.bedrock_latency_per_token
+        ),
+        polly=local_aws.FakePolly(
+            local_aws.Behavior(args.polly_latency, args.jitter, args.polly_throttle_rate, args.polly_concurrency, seed=2),
+            latency_per_char=args.polly_latency_per_char
+        ),
+        s3=local_aws.FakeS3(local_aws.Behavior(args.s3_latency, seed=3)),
+        dynamodb=local_aws.FakeDynamoDB(local_aws.Behavior(args.dynamodb_latency, seed=4))
+    ).install()
+
+
+class Pipeline:
+    """The four handlers wired together through the fakes' stream, SNS and S3 notifications"""
+
+    def __init__(self, args):
+        self.aws = make_aws(args)
+        self.handlers = {stage: local_aws.load_handler(stage) for stage in STAGES}
+        self.pending = {'stream': [], 'sns': [], 's3': []}
+        self.aws.table.stream_listeners.append(self.on_stream_record)
+        self.aws.sns.subscribe_callback(self.aws.TOPIC, self.pending['sns'].append)
+        self.aws.s3.add_notification(self.pending['s3'].append, prefix='download/', suffix='.txt')
+
+    def on_stream_record(self, record):
+        if record['eventName'] == 'INSERT':
+            self.pending['stream'].append(record)
+
+    def invoke(self, stage, event, timings):
+        start = time.perf_counter()
+        try:
+            return self.handlers[stage].lambda_handler(event, local_aws.LambdaContext(stage))
+        finally:
+            timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - start
+
+    def take(self, source):
+        records = list(self.pending[source])
+        del self.pending[source][:]
+        return records
+
+    def run_job(self, body):
+        timings = {}
+        start = time.perf_counter()
+        response = self.invoke('upload-execution', local_aws.api_event(body), timings)
+        if response['statusCode'] != 200:
+            raise RuntimeError(f"upload failed: {response['body']}")
+        reference_key = json.loads(response['body'])['reference_key']
+
+        # Same triggers as template.yaml, delivered one record per invocation
+        for record in self.take('stream'):
+            self.invoke('document-splitter', {'Records': [record]}, timings)
+        for record in self.take('sns'):
+            self.invoke('image-converter', {'Records': [record]}, timings)
+        for record in self.take('s3'):
+            self.invoke('polly-invoker', {'Records': [record]}, timings)
+        timings['end-to-end'] = time.perf_counter() - start
+
+        item = self.aws.table.get_item(Key={'reference_key': reference_key})['Item']
+        if item['TaskStatus'] != 'Voice-is-Ready':
+            raise RuntimeError(f"job {reference_key} ended in status {item['TaskStatus']}")
+        return reference_key, timings
+
+
+def make_pdf_submission(pages, chars_per_page, fake_renderer):
+    texts = [local_aws.filler_text(chars_per_page, seed=page) for page in range(pages)]
+    document = local_aws.make_fake_pdf(texts) if fake_renderer else local_aws.make_pdf(texts)
+    return {
+        'fileName': 'benchmark.pdf',
+        'language': 'english',
+        'startPage': 1,
+        'endPage': pages,
+        'fileContent': base64.b64encode(document).decode('ascii')
+    }
+
+
+def make_text_submission(chars):
+    return {'text': local_aws.filler_text(chars, seed=chars), 'language': 'english', 'voice_id': 'Joanna'}
+
+
+def run_case(pipeline, name, body, pages, repeat):
+    samples = []
+    polly_chars_before = pipeline.aws.polly.characters
+    failures = 0
+    for _ in range(repeat):
+        try:
+            samples.append(pipeline.run_job(body)[1])
+        except Exception as e:
+            failures += 1
+            print(f'  ⚠️  {name}: {e}')
+    characters = (pipeline.aws.polly.characters - polly_chars_before) / max(1, len(samples) + failures)
+
+    tracemalloc.start()
+    try:
+        pipeline.run_job(body)
+    except Exception:
+        pass
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    result = {'case': name, 'pages': pages, 'characters': characters, 'runs': len(samples), 'failures': failures,
+              'peak_memory_bytes': peak_memory, 'stages': {}}
+    for stage in STAGES + ['end-to-end']:
+        values = [sample[stage] * 1000 for sample in samples if stage in sample]
+        if values:
+            result['stages'][stage] = {
+                'p50_ms': percentile(values, 0.5),
+                'p95_ms': percentile(values, 0.95),
+                'mean_ms': statistics.mean(values)
+            }
+    if samples:
+        ocr_seconds = statistics.median(sample.get('document-splitter', 0) + sample.get('image-converter', 0) for sample in samples)
+        polly_seconds = statistics.median(sample['polly-invoker'] for sample in samples)
+        end_to_end = statistics.median(sample['end-to-end'] for sample in samples)
+        result['pages_per_sec'] = pages / ocr_seconds if pages and ocr_seconds else None
+        result['chars_per_sec'] = characters / polly_seconds if polly_seconds else None
+        result['end_to_end_chars_per_sec'] = characters / end_to_end if end_to_end else None
+    return result
+
+
+FINAL_STATUSES = {'Voice-is-Ready', 'failed', 'images-to-text conversion is failed', 'pdf-to-images conversion is failed'}
+
+
+def run_burst(args, mode, fake_renderer):
+    """Submit args.burst jobs at once and run them to a final status, 'direct' or 'queued'"""
+    from tts_common import queues
+    aws = make_aws(args)
+    handlers = {stage: local_aws.load_handler(stage) for stage in STAGES}
+    # Throttled records come back after seconds rather than the production 30 s and up
+    queues.BASE_BACKOFF_SECONDS, queues.MAX_BACKOFF_SECONDS = 1, 4
+    inserts = []
+    aws.table.stream_listeners.append(lambda record: record['eventName'] == 'INSERT' and inserts.append(record))
+    threads = []
+
+    def invoke_async(stage, event):
+        # Lambda scales out for every pushed event, nothing limits concurrency
+        def invoke():
+            try:
+                handlers[stage].lambda_handler(event, local_aws.LambdaContext(stage))
+            except Exception:
+                pass
+        thread = threading.Thread(target=invoke, daemon=True)
+        threads.append(thread)
+        thread.start()
+
+    event_sources = []
+    if mode == 'direct':
+        aws.sns.subscribe_callback(aws.TOPIC, lambda record: invoke_async('image-converter', {'Records': [record]}))
+        aws.s3.add_notification(lambda record: invoke_async('polly-invoker', {'Records': [record]}), prefix='download/', suffix='.txt')
+    else:
+        urls = aws.connect_stage_queues(visibility_timeout=args.visibility_timeout)
+        event_sources = [
+            local_aws.SQSEventSource(aws.sqs, urls[aws.OCR_QUEUE], handlers['image-converter'], 'image-converter',
+                                     batch_size=1, max_concurrency=args.ocr_concurrency).start(),
+            local_aws.SQSEventSource(aws.sqs, urls[aws.SYNTHESIS_QUEUE], handlers['polly-invoker'], 'polly-invoker',
+                                     batch_size=args.synthesis_batch_size, max_concurrency=args.synthesis_concurrency).start()
+        ]
+
+    bodies = [make_pdf_submission(2, args.chars_per_page, fake_renderer) if n % 2 else make_text_submission(args.burst_chars)
+              for n in range(args.burst)]
+    start = time.perf_counter()
+    for body in bodies:
+        handlers['upload-execution'].lambda_handler(local_aws.api_event(body), local_aws.LambdaContext('upload-execution'))
+    for record in inserts:
+        invoke_async('document-splitter', {'Records': [record]})
+
+    deadline = time.time() + args.burst_timeout
+    while time.time() < deadline:
+        statuses = [item['TaskStatus'] for item in aws.table.scan()['Items']]
+        if all(status in FINAL_STATUSES for status in statuses):
+            break
+        time.sleep(0.1)
+    makespan = time.perf_counter() - start
+    for event_source in event_sources:
+        event_source.stop()
+
+    items = aws.table.scan()['Items']
+    latencies = []
+    for item in items:
+        timeline = item.get('Timeline') or []
+        if item['TaskStatus'] == 'Voice-is-Ready' and timeline:
+            started, finished = timeline[0]['started_at'], timeline[-1]['finished_at']
+            latencies.append((parse_timestamp(finished) - parse_timestamp(started)) * 1000)
+    dead_lettered = sum(
+        int(aws.sqs.get_queue_attributes(QueueUrl=url)['Attributes']['ApproximateNumberOfMessages'])
+        for name, url in (urls.items() if mode == 'queued' else []) if '-dlq-' in name
+    )
+    return {
+        'mode': mode,
+        'jobs': len(items),
+        'completed': sum(1 for item in items if item['TaskStatus'] == 'Voice-is-Ready'),
+        'failed': sum(1 for item in items if item['TaskStatus'] in FINAL_STATUSES - {'Voice-is-Ready'}),
+        'unfinished': sum(1 for item in items if item['TaskStatus'] not in FINAL_STATUSES),
+        'dead_lettered': dead_lettered,
+        'makespan_s': makespan,
+        'p50_ms': percentile(latencies, 0.5),
+        'p95_ms': percentile(latencies, 0.95),
+        'bedrock_throttled': aws.bedrock.behavior.throttled,
+        'polly_throttled': aws.polly.behavior.throttled
+    }
+
+
+def parse_timestamp(timestamp):
+    from datetime import datetime
+    return datetime.fromisoformat(timestamp.replace('Z', '+00:00')).timestamp()
+
+
+def check_baseline(results, baseline, tolerance, min_delta_ms):
+    failures = [f"{result['case']}: {result['failures']} failed runs" for result in results if result['failures']]
+    previous = {result['case']: result for result in (baseline or {}).get('results', [])}
+    for result in results:
+        before = previous.get(result['case'])
+        if not before or 'end-to-end' not in result['stages'] or 'end-to-end' not in before['stages']:
+            continue
+        for field in ('p50_ms', 'p95_ms'):
+            old, new = before['stages']['end-to-end'][field], result['stages']['end-to-end'][field]
+            if new > max(old * (1 + tolerance), old + min_delta_ms):
+                failures.append(f"{result['case']}: end-to-end {field} {new:.1f} ms vs baseline {old:.1f} ms")
+    return failures
+
+
+def print_table(results):
+    print(f"\n{'case':18} {'stage':18} {'p50 ms':>10} {'p95 ms':>10}")
+    for result in results:
+        for stage, values in result['stages'].items():
+            print(f"{result['case']:18} {stage:18} {values['p50_ms']:10.1f} {values['p95_ms']:10.1f}")
+        pages_per_sec = f"{result['pages_per_sec']:.1f}" if result.get('pages_per_sec') else '-'
+        chars_per_sec = f"{result['chars_per_sec']:.0f}" if result.get('chars_per_sec') else '-'
+        print(f"{result['case']:18} pages/sec {pages_per_sec} | chars/sec {chars_per_sec} | "
+              f"peak memory {result['peak_memory_bytes'] / 1024 / 1024:.1f} MiB\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline upload-to-audio benchmark with latency-injecting fakes')
+    parser.add_argument('--pdf-pages', type=int, nargs='*', default=[1, 10, 50], help='PDF document sizes in pages')
+    parser.add_argument('--text-chars', type=int, nargs='*', default=[500, 5000, 50000], help='TEXT document sizes in characters')
+    parser.add_argument('--chars-per-page', type=int, default=1800)
+    parser.add_argument('--image-kb', type=int, default=200, help='size of each rendered page image')
+    parser.add_argument('--render-latency', type=float, default=0.0, help='seconds per page for the fake renderer')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--bedrock-latency', type=float, default=0.0, help='seconds per InvokeModel call')
+    parser.add_argument('--bedrock-latency-per-token', type=float, default=0.0, help='seconds per output token')
+    parser.add_argument('--bedrock-throttle-rate', type=float, default=0.0)
+    parser.add_argument('--bedrock-concurrency', type=int, help='concurrent calls above this are throttled')
+    parser.add_argument('--polly-latency', type=float, default=0.0, help='seconds per SynthesizeSpeech call')
+    parser.add_argument('--polly-latency-per-char', type=float, default=0.0)
+    parser.add_argument('--polly-throttle-rate', type=float, default=0.0)
+    parser.add_argument('--polly-concurrency', type=int)
+    parser.add_argument('--s3-latency', type=float, default=0.0)
+    parser.add_argument('--dynamodb-latency', type=float, default=0.0)
+    parser.add_argument('--jitter', type=float, default=0.0, help='uniform extra latency added to each modelled call')
+    parser.add_argument('--fake-renderer', action='store_true', help='use the fake pdf2image even when poppler is installed')
+    parser.add_argument('--burst', type=int, help='submit this many jobs at once instead of the size cases')
+    parser.add_argument('--burst-mode', choices=['direct', 'queued', 'both'], default='both')
+    parser.add_argument('--burst-chars', type=int, default=6000, help='characters per TEXT job in a burst')
+    parser.add_argument('--burst-timeout', type=float, default=300)
+    parser.add_argument('--ocr-concurrency', type=int, default=5, help='MaximumConcurrency of the OCR queue consumer')
+    parser.add_argument('--synthesis-concurrency', type=int, default=4)
+    parser.add_argument('--synthesis-batch-size', type=int, default=5)
+    parser.add_argument('--visibility-timeout', type=int, default=5, help='stage queue visibility timeout in seconds')
+    parser.add_argument('--output', default='benchmark-report.json')
+    parser.add_argument('--baseline', help='earlier report, fail when end-to-end latency regresses')
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    parser.add_argument('--min-delta-ms', type=float, default=5.0)
+    args = parser.parse_args()
+
+    import importlib.util
+    fake_renderer = args.fake_renderer or importlib.util.find_spec('pdf2image') is None
+    if fake_renderer:
+        local_aws.install_fake_pdf2image(args.render_latency, args.image_kb * 1024)
+
+    if args.burst:
+        modes = ['direct', 'queued'] if args.burst_mode == 'both' else [args.burst_mode]
+        print(f'🏁 Burst of {args.burst} jobs' + (' (fake page renderer)' if fake_renderer else ''))
+        bursts = []
+        for mode in modes:
+            result = run_burst(args, mode, fake_renderer)
+            bursts.append(result)
+            p95 = f"{result['p95_ms']:.0f} ms" if result['p95_ms'] is not None else '-'
+            print(f"  {mode:7} completed {result['completed']}/{result['jobs']} | failed {result['failed']} | "
+                  f"unfinished {result['unfinished']} | dead-lettered {result['dead_lettered']} | "
+                  f"makespan {result['makespan_s']:.1f}s | p95 {p95} | "
+                  f"throttled bedrock {result['bedrock_throttled']} polly {result['polly_throttled']}")
+        with open(args.output, 'w') as f:
+            json.dump({'generated_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+                       'settings': vars(args), 'bursts': bursts}, f, indent=2)
+        print(f'📄 Report written to {args.output}')
+        return 0 if all(result['completed'] == result['jobs'] for result in bursts if result['mode'] == 'queued') else 1
+
+    print('🏁 Running offline pipeline benchmark' + (' (fake page renderer)' if fake_renderer else ''))
+    pipeline = Pipeline(args)
+
+    cases = [(f'pdf-{pages}p', make_pdf_submission(pages, args.chars_per_page, fake_renderer), pages) for pages in args.pdf_pages]
+    cases += [(f'text-{chars}c', make_text_submission(chars), 0) for chars in args.text_chars]
+
+    results = []
+    for name, body, pages in cases:
+        print(f'  ▶️  {name}')
+        results.append(run_case(pipeline, name, body, pages, args.repeat))
+    print_table(results)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    failures = check_baseline(results, baseline, args.tolerance, args.min_delta_ms)
+
+    report = {
+        'generated_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'fake_renderer': fake_renderer,
+        'settings': {key: value for key, value in vars(args).items() if key not in ('output', 'baseline')},
+        'service_calls': {
+            'bedrock': {'calls': pipeline.aws.bedrock.behavior.calls, 'throttled': pipeline.aws.bedrock.behavior.throttled,
+                        'retries': pipeline.aws.bedrock.behavior.retries,
+                        'input_tokens': pipeline.aws.bedrock.input_tokens, 'output_tokens': pipeline.aws.bedrock.output_tokens},
+            'polly': {'calls': pipeline.aws.polly.behavior.calls, 'throttled': pipeline.aws.polly.behavior.throttled,
+                      'retries': pipeline.aws.polly.behavior.retries,
+                      'characters': pipeline.aws.polly.characters},
+            's3': {'calls': pipeline.aws.s3.behavior.calls, 'bytes_in': pipeline.aws.s3.bytes_in, 'bytes_out': pipeline.aws.s3.bytes_out},
+            'dynamodb': {'calls': pipeline.aws.dynamodb.behavior.calls}
+        },
+        'results': results,
+        'failures': failures
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'📄 Report written to {args.output}')
+
+    if failures:
+        print('❌ Benchmark check failed:')
+        for failure in failures:
+            print(f'  - {failure}')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,7 +1,33 @@
 #!/usr/bin/env python3
+"""
+Delete every tts resource in the account: Cognito pools, DynamoDB tables,
+S3 buckets with all their objects, SNS topics and local test files.
+
+Independent services are cleaned up in parallel. Buckets are emptied by
+listing every object version and delete marker, one lister per top-level
+prefix (upload/, images/, ocr/, audio/, download/), and sending DeleteObjects
+batches of 1,000 keys from a thread pool while listing continues.
+
+Usage:
+  python3 cleanup-all.py --dry-run          # list what would be deleted
+  python3 cleanup-all.py
+  python3 cleanup-all.py --workers 64       # concurrent DeleteObjects calls
+"""
+
+import argparse
 import boto3
+import glob
 import os
+import threading
+import time
+from botocore.config import Config
 from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
+
+REGION = 'us-east-1'
+# DeleteObjects limit
+DELETE_BATCH_SIZE = 1000
+DELETE_ATTEMPTS = 5
 
 def load_env_credentials():
     try:
@@ -13,122 +39,263 @@ def load_env_credentials():
                     os.environ[key] = value
         return True
     except Exception as e:
-        print(f"Error loading .env: {e}")
+        log(f"Error loading .env: {e}")
         return False
 
-def cleanup_all_aws_resources():
-    print("🧹 Starting complete AWS cleanup...")
-    
-    if not load_env_credentials():
-        return
-    
-    # AWS clients
-    cognito = boto3.client('cognito-idp', region_name='us-east-1')
-    cognito_identity = boto3.client('cognito-identity', region_name='us-east-1')
-    dynamodb = boto3.client('dynamodb', region_name='us-east-1')
-    s3 = boto3.client('s3', region_name='us-east-1')
-    sns = boto3.client('sns', region_name='us-east-1')
-    
-    # 1. Cleanup Cognito
-    print("\n1️⃣ Cleaning up Cognito...")
+print_lock = threading.Lock()
+
+def log(message):
+    # Services are cleaned up on separate threads, keep their lines whole
+    with print_lock:
+        print(message, flush=True)
+
+def is_tts(name):
+    return 'tts' in name.lower()
+
+def paginate(client, operation, result_key, **kwargs):
+    for page in client.get_paginator(operation).paginate(**kwargs):
+        yield from page.get(result_key, [])
+
+def cleanup_cognito(dry_run):
+    cognito = boto3.client('cognito-idp', region_name=REGION)
+    cognito_identity = boto3.client('cognito-identity', region_name=REGION)
+
     try:
         # Find and delete Identity Pools
-        pools = cognito_identity.list_identity_pools(MaxResults=60)['IdentityPools']
-        for pool in pools:
-            if 'tts' in pool['IdentityPoolName'].lower():
+        for pool in paginate(cognito_identity, 'list_identity_pools', 'IdentityPools', MaxResults=60):
+            if is_tts(pool['IdentityPoolName']):
+                if dry_run:
+                    log(f"🔎 Would delete Identity Pool: {pool['IdentityPoolId']}")
+                    continue
                 cognito_identity.delete_identity_pool(IdentityPoolId=pool['IdentityPoolId'])
-                print(f"✅ Deleted Identity Pool: {pool['IdentityPoolId']}")
+                log(f"✅ Deleted Identity Pool: {pool['IdentityPoolId']}")
     except Exception as e:
-        print(f"❌ Identity Pool: {e}")
-    
+        log(f"❌ Identity Pool: {e}")
+
     try:
         # Find and delete User Pool domains first
-        pools = cognito.list_user_pools(MaxResults=60)['UserPools']
-        for pool in pools:
-            if 'tts' in pool['Name'].lower():
-                pool_id = pool['Id']
-                # Try to get domain info from the User Pool
-                try:
-                    pool_details = cognito.describe_user_pool(UserPoolId=pool_id)
-                    domain = pool_details.get('UserPool', {}).get('Domain')
-                    if domain:
-                        cognito.delete_user_pool_domain(Domain=domain, UserPoolId=pool_id)
-                        print(f"✅ Deleted User Pool Domain: {domain}")
-                        import time
-                        time.sleep(3)  # Wait for domain deletion
-                except Exception as domain_e:
-                    print(f"⚠️ Domain deletion: {domain_e}")
-                
-                # Now delete the User Pool
-                try:
-                    cognito.delete_user_pool(UserPoolId=pool_id)
-                    print(f"✅ Deleted User Pool: {pool_id}")
-                except Exception as pool_e:
-                    print(f"❌ User Pool deletion: {pool_e}")
+        for pool in paginate(cognito, 'list_user_pools', 'UserPools', MaxResults=60):
+            if not is_tts(pool['Name']):
+                continue
+            pool_id = pool['Id']
+            if dry_run:
+                log(f"🔎 Would delete User Pool and its domain: {pool_id}")
+                continue
+            # Try to get domain info from the User Pool
+            try:
+                pool_details = cognito.describe_user_pool(UserPoolId=pool_id)
+                domain = pool_details.get('UserPool', {}).get('Domain')
+                if domain:
+                    cognito.delete_user_pool_domain(Domain=domain, UserPoolId=pool_id)
+                    log(f"✅ Deleted User Pool Domain: {domain}")
+                    time.sleep(3)  # Wait for domain deletion
+            except Exception as domain_e:
+                log(f"⚠️ Domain deletion: {domain_e}")
+
+            # Now delete the User Pool
+            try:
+                cognito.delete_user_pool(UserPoolId=pool_id)
+                log(f"✅ Deleted User Pool: {pool_id}")
+            except Exception as pool_e:
+                log(f"❌ User Pool deletion: {pool_e}")
     except Exception as e:
-        print(f"❌ User Pool: {e}")
-    
-    # 2. Cleanup DynamoDB
-    print("\n2️⃣ Cleaning up DynamoDB...")
+        log(f"❌ User Pool: {e}")
+
+def cleanup_dynamodb(dry_run):
+    dynamodb = boto3.client('dynamodb', region_name=REGION)
     try:
-        tables = dynamodb.list_tables()['TableNames']
-        for table_name in tables:
-            if 'tts' in table_name.lower():
+        for table_name in paginate(dynamodb, 'list_tables', 'TableNames'):
+            if is_tts(table_name):
+                if dry_run:
+                    log(f"🔎 Would delete DynamoDB table: {table_name}")
+                    continue
                 dynamodb.delete_table(TableName=table_name)
-                print(f"✅ Deleted DynamoDB table: {table_name}")
-    except Exception as e:
-        print(f"❌ DynamoDB: {e}")
-    
-    # 3. Cleanup S3
-    print("\n3️⃣ Cleaning up S3...")
-    try:
-        buckets = s3.list_buckets()['Buckets']
-        for bucket in buckets:
-            if 'tts' in bucket['Name'].lower():
-                bucket_name = bucket['Name']
-                # Delete all objects first
-                try:
-                    response = s3.list_objects_v2(Bucket=bucket_name)
-                    if 'Contents' in response:
-                        objects = [{'Key': obj['Key']} for obj in response['Contents']]
-                        s3.delete_objects(Bucket=bucket_name, Delete={'Objects': objects})
-                        print(f"✅ Deleted {len(objects)} objects from S3")
-                    
-                    s3.delete_bucket(Bucket=bucket_name)
-                    print(f"✅ Deleted S3 bucket: {bucket_name}")
-                except Exception as e:
-                    print(f"❌ S3 bucket {bucket_name}: {e}")
+                log(f"✅ Deleted DynamoDB table: {table_name}")
     except Exception as e:
-        print(f"❌ S3: {e}")
-    
-    # 4. Cleanup SNS
-    print("\n4️⃣ Cleaning up SNS...")
+        log(f"❌ DynamoDB: {e}")
+
+def cleanup_sns(dry_run):
+    sns = boto3.client('sns', region_name=REGION)
     try:
-        topics = sns.list_topics()['Topics']
-        for topic in topics:
+        for topic in paginate(sns, 'list_topics', 'Topics'):
             topic_arn = topic['TopicArn']
-            if 'tts' in topic_arn.lower():
-                sns.delete_topic(TopicArn=topic_arn)
+            if is_tts(topic_arn):
                 topic_name = topic_arn.split(':')[-1]
-                print(f"✅ Deleted SNS topic: {topic_name}")
+                if dry_run:
+                    log(f"🔎 Would delete SNS topic: {topic_name}")
+                    continue
+                sns.delete_topic(TopicArn=topic_arn)
+                log(f"✅ Deleted SNS topic: {topic_name}")
     except Exception as e:
-        print(f"❌ SNS: {e}")
-    
-    # 5. Cleanup local files
-    print("\n5️⃣ Cleaning up local files...")
+        log(f"❌ SNS: {e}")
+
+class BucketEmptier:
+    """
+    Lists every version and delete marker of a bucket and deletes them in
+    DeleteObjects batches on a shared thread pool. Keys S3 reports as failed
+    in a batch are retried, the rest of the batch is not sent again.
+    """
+
+    def __init__(self, s3, bucket_name, delete_pool, max_in_flight, dry_run):
+        self.s3 = s3
+        self.bucket_name = bucket_name
+        self.delete_pool = delete_pool
+        self.dry_run = dry_run
+        self.lock = threading.Lock()
+        self.listed = 0
+        self.listed_bytes = 0
+        self.deleted = 0
+        self.failed = 0
+        self.batches = []
+        # Listing blocks once this many batches wait for a delete worker
+        self.in_flight = threading.BoundedSemaphore(max_in_flight)
+
+    def prefixes(self):
+        """Top-level prefixes, each listed by its own thread. Keys at the root fall back to one listing of everything."""
+        response = self.s3.list_object_versions(Bucket=self.bucket_name, Delimiter='/')
+        prefixes = [p['Prefix'] for p in response.get('CommonPrefixes', [])]
+        if response.get('IsTruncated') or response.get('Versions') or response.get('DeleteMarkers') or not prefixes:
+            return ['']
+        return prefixes
+
+    def delete_batch(self, objects):
+        for attempt in range(DELETE_ATTEMPTS):
+            response = self.s3.delete_objects(Bucket=self.bucket_name, Delete={'Objects': objects, 'Quiet': True})
+            errors = response.get('Errors', [])
+            with self.lock:
+                self.deleted += len(objects) - len(errors)
+            if not errors:
+                return
+            # Retrying a version that did get deleted is a no-op, so matching on the key is enough
+            failed = {error['Key'] for error in errors}
+            objects = [obj for obj in objects if obj['Key'] in failed]
+            time.sleep(2 ** attempt * 0.1)
+        with self.lock:
+            self.failed += len(objects)
+        log(f"⚠️ {len(objects)} objects in {self.bucket_name} could not be deleted, first error: {errors[0].get('Code')}")
+
+    def submit(self, objects):
+        if not objects:
+            return
+        with self.lock:
+            self.listed += len(objects)
+        if self.dry_run:
+            return
+        self.in_flight.acquire()
+        future = self.delete_pool.submit(self.delete_batch, objects)
+        future.add_done_callback(lambda _: self.in_flight.release())
+        with self.lock:
+            self.batches.append(future)
+
+    def list_prefix(self, prefix):
+        batch = []
+        for page in self.s3.get_paginator('list_object_versions').paginate(Bucket=self.bucket_name, Prefix=prefix):
+            for version in page.get('Versions', []) + page.get('DeleteMarkers', []):
+                batch.append({'Key': version['Key'], 'VersionId': version['VersionId']})
+                with self.lock:
+                    self.listed_bytes += version.get('Size', 0)
+                if len(batch) == DELETE_BATCH_SIZE:
+                    self.submit(batch)
+                    batch = []
+        self.submit(batch)
+
+    def empty_pass(self, list_workers):
+        prefixes = self.prefixes()
+        with ThreadPoolExecutor(max_workers=max(1, min(list_workers, len(prefixes)))) as listers:
+            list(listers.map(self.list_prefix, prefixes))
+        for future in list(self.batches):
+            future.result()
+        self.batches = []
+
+    def empty(self, list_workers):
+        """
+        Passes until a listing finds nothing: keys written while the bucket
+        was being emptied (a job still running) are picked up by the next pass.
+        """
+        while True:
+            listed = self.listed
+            self.empty_pass(list_workers)
+            if self.dry_run or self.failed or self.listed == listed:
+                return
+
+def cleanup_bucket(s3, bucket_name, delete_pool, args):
+    start = time.perf_counter()
+    try:
+        emptier = BucketEmptier(s3, bucket_name, delete_pool, args.workers * 2, args.dry_run)
+        emptier.empty(args.list_workers)
+        elapsed = time.perf_counter() - start
+        if args.dry_run:
+            log(f"🔎 Would delete {emptier.listed} objects and versions "
+                  f"({emptier.listed_bytes / 1024 / 1024:.1f} MB) and S3 bucket: {bucket_name}")
+            return
+        log(f"✅ Deleted {emptier.deleted} objects and versions from {bucket_name} in {elapsed:.1f}s")
+        if emptier.failed:
+            log(f"❌ S3 bucket {bucket_name}: {emptier.failed} objects left, not deleting the bucket")
+            return
+        s3.delete_bucket(Bucket=bucket_name)
+        log(f"✅ Deleted S3 bucket: {bucket_name}")
+    except Exception as e:
+        log(f"❌ S3 bucket {bucket_name}: {e}")
+
+def cleanup_s3(args):
+    s3 = boto3.client('s3', region_name=REGION, config=Config(
+        max_pool_connections=args.workers + args.list_workers,
+        retries={'max_attempts': 10, 'mode': 'adaptive'}
+    ))
     try:
-        import glob
-        test_files = glob.glob('test-*.mp3') + glob.glob('test-*.txt') + glob.glob('*.mp3')
+        buckets = [bucket['Name'] for bucket in s3.list_buckets()['Buckets'] if is_tts(bucket['Name'])]
+        with ThreadPoolExecutor(max_workers=args.workers) as delete_pool:
+            with ThreadPoolExecutor(max_workers=max(1, len(buckets))) as bucket_pool:
+                list(bucket_pool.map(lambda name: cleanup_bucket(s3, name, delete_pool, args), buckets))
+    except Exception as e:
+        log(f"❌ S3: {e}")
+
+def cleanup_local_files(dry_run):
+    try:
+        test_files = sorted(set(glob.glob('test-*.mp3') + glob.glob('test-*.txt') + glob.glob('*.mp3')))
         for file in test_files:
+            if dry_run:
+                log(f"🔎 Would delete local file: {file}")
+                continue
             os.remove(file)
-            print(f"✅ Deleted local file: {file}")
+            log(f"✅ Deleted local file: {file}")
         if not test_files:
-            print("✅ No local test files to clean")
+            log("✅ No local test files to clean")
     except Exception as e:
-        print(f"❌ Local files: {e}")
-    
-    print("\n🎉 Complete AWS cleanup finished!")
-    print("All resources have been removed to avoid charges.")
+        log(f"❌ Local files: {e}")
+
+def cleanup_all_aws_resources(args):
+    log(f"🧹 Starting complete AWS cleanup{' (dry run, nothing is deleted)' if args.dry_run else ''}...")
+
+    if not load_env_credentials():
+        return
+
+    # The services do not depend on each other
+    start = time.perf_counter()
+    tasks = [
+        ('Cognito', lambda: cleanup_cognito(args.dry_run)),
+        ('DynamoDB', lambda: cleanup_dynamodb(args.dry_run)),
+        ('S3', lambda: cleanup_s3(args)),
+        ('SNS', lambda: cleanup_sns(args.dry_run)),
+        ('local files', lambda: cleanup_local_files(args.dry_run))
+    ]
+    with ThreadPoolExecutor(max_workers=len(tasks)) as executor:
+        futures = [(name, executor.submit(task)) for name, task in tasks]
+        for name, future in futures:
+            try:
+                future.result()
+            except ClientError as e:
+                log(f"❌ {name}: {e}")
+
+    if args.dry_run:
+        log(f"\n🔎 Dry run finished in {time.perf_counter() - start:.1f}s, run without --dry-run to delete.")
+        return
+    log(f"\n🎉 Complete AWS cleanup finished in {time.perf_counter() - start:.1f}s!")
+    log("All resources have been removed to avoid charges.")
 
 if __name__ == "__main__":
-    cleanup_all_aws_resources()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Delete every tts resource in the account')
+    parser.add_argument('--dry-run', action='store_true', help='list what would be deleted and delete nothing')
+    parser.add_argument('--workers', type=int, default=32, help='concurrent DeleteObjects calls across all buckets')
+    parser.add_argument('--list-workers', type=int, default=8, help='prefixes of a bucket listed at once')
+    cleanup_all_aws_resources(parser.parse_args())
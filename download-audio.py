@@ -1,10 +1,34 @@
 #!/usr/bin/env python3
 """
-Download the generated audio file
+Bulk download of generated audio files
+
+Downloads download/<reference_key>/Audio.mp3 for every finished job of a user,
+for reference keys listed in a file, or for keys given on the command line.
+Files are fetched concurrently. Files larger than --part-size are split into
+byte ranges fetched in parallel and written in place into <file>.part, with
+the finished ranges recorded in <file>.part.json, so an interrupted download
+resumes where it stopped. Smaller files resume from the end of their .part
+file. Files already on disk are skipped when they match the object's ETag.
+
+Usage:
+  python3 download-audio.py --user someone@example.com
+  python3 download-audio.py --keys-file keys.txt --output-dir audio --workers 16
+  python3 download-audio.py a35655df-166e-48e9-aca9-bd8abf56e413 --play
+  python3 download-audio.py --local 20                  # offline run against local_aws fakes
 """
 
-import boto3
+import argparse
+import hashlib
+import json
 import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+FINAL_STATUS = 'Voice-is-Ready'
+CHUNK_SIZE = 1024 * 1024
+MANIFEST = '.etags.json'
 
 # Load credentials
 def load_env():
@@ -18,34 +42,269 @@ def load_env():
     except FileNotFoundError:
         pass
 
-load_env()
 
-def download_audio():
-    s3 = boto3.client('s3')
-    bucket = 'tts-bucket-1758058711'
-    reference_key = 'a35655df-166e-48e9-aca9-bd8abf56e413'
-    
-    audio_key = f'download/{reference_key}/Audio.mp3'
-    local_file = 'generated-audio.mp3'
-    
+def audio_key(reference_key):
+    return f'download/{reference_key}/Audio.mp3'
+
+
+def user_reference_keys(table, username):
+    """reference keys of the user's finished jobs, paginated like timeline-report.py"""
+    keys = []
+    kwargs = {
+        'FilterExpression': 'Username = :username AND TaskStatus = :status',
+        'ProjectionExpression': 'reference_key',
+        'ExpressionAttributeValues': {':username': username, ':status': FINAL_STATUS}
+    }
+    while True:
+        response = table.scan(**kwargs)
+        keys.extend(item['reference_key'] for item in response['Items'])
+        if 'LastEvaluatedKey' not in response:
+            return keys
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def file_reference_keys(path):
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith('#')]
+
+
+def md5_of(path):
+    digest = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def read_json(path):
     try:
-        s3.download_file(bucket, audio_key, local_file)
-        print(f"✅ Audio downloaded: {local_file}")
-        print(f"🎧 Play the file to hear your TTS conversion!")
-        
-        # Try to open with default audio player
-        import subprocess
-        import platform
-        
-        if platform.system() == 'Darwin':  # macOS
-            subprocess.run(['open', local_file])
-        elif platform.system() == 'Windows':
-            subprocess.run(['start', local_file], shell=True)
-        else:  # Linux
-            subprocess.run(['xdg-open', local_file])
-            
-    except Exception as e:
-        print(f"❌ Download error: {e}")
-
-if __name__ == "__main__":
-    download_audio()
\ No newline at end of file
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def write_json(path, data):
+    tmp = f'{path}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+class Downloader:
+    def __init__(self, s3, bucket, output_dir, part_size, range_workers):
+        self.s3 = s3
+        self.bucket = bucket
+        self.output_dir = output_dir
+        self.part_size = part_size
+        # Shared by all files, separate from the file pool so a file waiting on its ranges never starves them
+        self.ranges = ThreadPoolExecutor(max_workers=range_workers)
+        self.lock = threading.Lock()
+        self.manifest_path = os.path.join(output_dir, MANIFEST)
+        self.manifest = read_json(self.manifest_path) or {}
+        self.stats = {'downloaded': 0, 'skipped': 0, 'resumed': 0, 'missing': 0, 'failed': 0, 'bytes': 0}
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.stats[name] += value
+
+    def up_to_date(self, reference_key, path, etag, size):
+        if not os.path.exists(path) or os.path.getsize(path) != size:
+            return False
+        if self.manifest.get(reference_key) == etag:
+            return True
+        # Single-part uploads (polly-invoker uses put_object) have the MD5 as ETag
+        if '-' not in etag and md5_of(path) == etag:
+            self.record(reference_key, etag)
+            return True
+        return False
+
+    def record(self, reference_key, etag):
+        with self.lock:
+            self.manifest[reference_key] = etag
+            write_json(self.manifest_path, self.manifest)
+
+    def fetch_range(self, key, etag, path, start, end):
+        response = self.s3.get_object(Bucket=self.bucket, Key=key, Range=f'bytes={start}-{end}', IfMatch=etag)
+        with open(path, 'r+b') as f:
+            f.seek(start)
+            for chunk in response['Body'].iter_chunks(CHUNK_SIZE):
+                f.write(chunk)
+                self.count('bytes', len(chunk))
+
+    def download_ranges(self, key, etag, size, part_path):
+        """Parallel byte ranges, finished ranges are recorded in <part>.json"""
+        state_path = f'{part_path}.json'
+        state = read_json(state_path)
+        if not state or state.get('etag') != etag or state.get('part_size') != self.part_size or not os.path.exists(part_path):
+            state = {'etag': etag, 'part_size': self.part_size, 'done': []}
+            with open(part_path, 'wb') as f:
+                f.truncate(size)
+            write_json(state_path, state)
+        elif state['done']:
+            self.count('resumed')
+
+        state_lock = threading.Lock()
+        done = set(state['done'])
+
+        def fetch_part(index):
+            start = index * self.part_size
+            self.fetch_range(key, etag, part_path, start, min(size, start + self.part_size) - 1)
+            with state_lock:
+                done.add(index)
+                write_json(state_path, dict(state, done=sorted(done)))
+
+        parts = [index for index in range((size + self.part_size - 1) // self.part_size) if index not in done]
+        for future in [self.ranges.submit(fetch_part, index) for index in parts]:
+            future.result()
+        os.unlink(state_path)
+
+    def download_stream(self, key, etag, size, part_path):
+        """One request, resumed from the end of the .part file"""
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        state = read_json(f'{part_path}.json')
+        if offset and (not state or state.get('etag') != etag or offset > size):
+            offset = 0
+        if offset == size:
+            return
+        write_json(f'{part_path}.json', {'etag': etag})
+        if offset:
+            self.count('resumed')
+        response = self.s3.get_object(Bucket=self.bucket, Key=key, Range=f'bytes={offset}-', IfMatch=etag)
+        with open(part_path, 'ab' if offset else 'wb') as f:
+            for chunk in response['Body'].iter_chunks(CHUNK_SIZE):
+                f.write(chunk)
+                self.count('bytes', len(chunk))
+        os.unlink(f'{part_path}.json')
+
+    def download(self, reference_key):
+        key = audio_key(reference_key)
+        path = os.path.join(self.output_dir, f'{reference_key}.mp3')
+        try:
+            try:
+                head = self.s3.head_object(Bucket=self.bucket, Key=key)
+            except Exception as e:
+                if getattr(e, 'response', {}).get('Error', {}).get('Code') in ('404', 'NoSuchKey'):
+                    print(f'⚠️  {reference_key}: no audio')
+                    self.count('missing')
+                    return None
+                raise
+            etag = head['ETag'].strip('"')
+            size = head['ContentLength']
+            if self.up_to_date(reference_key, path, etag, size):
+                self.count('skipped')
+                return path
+
+            part_path = f'{path}.part'
+            if size > self.part_size:
+                self.download_ranges(key, head['ETag'], size, part_path)
+            else:
+                self.download_stream(key, head['ETag'], size, part_path)
+            if os.path.getsize(part_path) != size:
+                raise IOError(f'got {os.path.getsize(part_path)} of {size} bytes')
+            if '-' not in etag and md5_of(part_path) != etag:
+                os.unlink(part_path)
+                raise IOError('checksum does not match the ETag')
+            os.replace(part_path, path)
+            self.record(reference_key, etag)
+            self.count('downloaded')
+            print(f'✅ {reference_key}: {size / 1024 / 1024:.1f} MB')
+            return path
+        except Exception as e:
+            print(f'❌ {reference_key}: {e}')
+            self.count('failed')
+            return None
+
+
+def play(path):
+    import subprocess
+    import platform
+
+    if platform.system() == 'Darwin':  # macOS
+        subprocess.run(['open', path])
+    elif platform.system() == 'Windows':
+        subprocess.run(['start', path], shell=True)
+    else:  # Linux
+        subprocess.run(['xdg-open', path])
+
+
+def local_setup(count, part_size):
+    """Fake bucket with count finished jobs, every third one larger than a part"""
+    import random
+    import local_aws
+
+    aws = local_aws.LocalAWS()
+    for n in range(count):
+        reference_key = f'local-audio-{n}'
+        size = part_size * 3 + 12345 if n % 3 == 0 else 200 * 1024 + n
+        # Same bytes on every run, so a second run finds the files up to date
+        body = random.Random(n).randbytes(size)
+        aws.s3.put_object(Bucket=aws.BUCKET, Key=audio_key(reference_key), Body=body, ContentType='audio/mpeg')
+        aws.table.put_item(Item={'reference_key': reference_key, 'Username': 'local@example.com', 'TaskStatus': FINAL_STATUS})
+    return aws
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Download finished audio files concurrently, resuming interrupted downloads')
+    parser.add_argument('reference_keys', nargs='*', help='reference keys to download')
+    parser.add_argument('--user', help="download every finished job of this user (the job's Username, an email)")
+    parser.add_argument('--keys-file', help='file with one reference key per line')
+    parser.add_argument('--bucket', help='default S3_BUCKET')
+    parser.add_argument('--table', help='default DYNAMODB_TABLE or tts-requests')
+    parser.add_argument('--region', default='us-east-1')
+    parser.add_argument('--output-dir', default='audio')
+    parser.add_argument('--workers', type=int, default=8, help='files downloaded at once')
+    parser.add_argument('--range-workers', type=int, default=8, help='byte ranges fetched at once across all files')
+    parser.add_argument('--part-size', type=int, default=8, help='MB per byte range, smaller files are fetched in one request')
+    parser.add_argument('--play', action='store_true', help='open the file in the default player when downloading a single key')
+    parser.add_argument('--local', type=int, metavar='N', help='download N fake jobs from the in-process local_aws fakes')
+    args = parser.parse_args()
+
+    load_env()
+    part_size = args.part_size * 1024 * 1024
+    if args.local:
+        aws = local_setup(args.local, part_size)
+        s3, table, bucket, args.user = aws.s3, aws.table, aws.BUCKET, 'local@example.com'
+    else:
+        import boto3
+        from botocore.config import Config
+
+        bucket = args.bucket or os.environ.get('S3_BUCKET')
+        if not bucket:
+            parser.error('--bucket or S3_BUCKET is required')
+        s3 = boto3.client('s3', region_name=args.region,
+                          config=Config(max_pool_connections=args.workers + args.range_workers, retries={'max_attempts': 10, 'mode': 'adaptive'}))
+        table = boto3.resource('dynamodb', region_name=args.region).Table(args.table or os.environ.get('DYNAMODB_TABLE', 'tts-requests'))
+
+    reference_keys = list(args.reference_keys)
+    if args.keys_file:
+        reference_keys += file_reference_keys(args.keys_file)
+    if args.user:
+        reference_keys += user_reference_keys(table, args.user)
+    reference_keys = list(dict.fromkeys(reference_keys))
+    if not reference_keys:
+        parser.error('nothing to download, give reference keys, --keys-file or --user')
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    downloader = Downloader(s3, bucket, args.output_dir, part_size, args.range_workers)
+    print(f'⬇️  {len(reference_keys)} files from {bucket} to {args.output_dir}/')
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        paths = list(executor.map(downloader.download, reference_keys))
+    downloader.ranges.shutdown()
+    elapsed = time.perf_counter() - start
+
+    stats = downloader.stats
+    megabytes = stats['bytes'] / 1024 / 1024
+    print(f"\n📊 {stats['downloaded']} downloaded ({stats['resumed']} resumed), {stats['skipped']} up to date, "
+          f"{stats['missing']} without audio, {stats['failed']} failed; {megabytes:.1f} MB in {elapsed:.1f}s "
+          f"({megabytes / elapsed if elapsed else 0:.1f} MB/s)")
+
+    if args.play and len(reference_keys) == 1 and paths[0]:
+        play(paths[0])
+    return 1 if stats['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""
+In-process event-bus emulator for the pipeline
+
+Loads every function of template.yaml as its own module (two functions
+sharing a CodeUri get separate copies, like separate Lambdas) and wires them
+to the fakes in local_aws.py with the template's own event sources:
+
+  DynamoDB stream -> stream-router (INSERT, TTL REMOVE), status-notifier (MODIFY)
+  stream-router -> tts-render queue -> document-splitter (PDF)
+                -> tts-text queue -> text passthrough (TEXT)
+                -> tts-sweep queue -> artifact-sweeper
+  SNS -> tts-ocr queue -> image-converter
+  S3 download/*.txt -> tts-synthesis queue -> polly-invoker
+
+BatchSize, MaximumBatchingWindowInSeconds, FilterCriteria and the queues'
+MaximumConcurrency are read from the template. Stream records are delivered
+per shard in order, queue batches concurrently, so races between stages and
+throughput limits show up the way they do in AWS, without an account.
+
+Usage:
+  python3 emulate-pipeline.py --jobs 50
+  python3 emulate-pipeline.py --jobs 200 --submit-rate 20 --bedrock-latency 0.2 --bedrock-concurrency 4
+  python3 emulate-pipeline.py --jobs 20 --window-scale 0.1 --expire --output emulation.json
+
+Needs PyYAML to read template.yaml (pip3 install pyyaml).
+"""
+
+import argparse
+import base64
+import json
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import local_aws
+
+TEMPLATE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'template.yaml')
+FINAL_STATUSES = {'Voice-is-Ready', 'failed', 'images-to-text conversion is failed', 'pdf-to-images conversion is failed'}
+# Lambda's default MaximumConcurrency for an SQS event source is bounded only by the account, keep it modest
+DEFAULT_QUEUE_CONCURRENCY = 10
+
+
+def load_template(path=TEMPLATE):
+    try:
+        import yaml
+    except ImportError:
+        sys.exit('emulate-pipeline.py needs PyYAML to read template.yaml: pip3 install pyyaml')
+
+    class TemplateLoader(yaml.SafeLoader):
+        pass
+
+    # !Ref X and !GetAtt X.Arn become plain strings, enough to tell which resource an event points at
+    TemplateLoader.add_multi_constructor('!', lambda loader, tag, node: (
+        loader.construct_scalar(node) if isinstance(node, yaml.ScalarNode) else None
+    ))
+    with open(path) as f:
+        return yaml.load(f, Loader=TemplateLoader)
+
+
+def event_sources(template):
+    """(function name, code dir, event type, properties) for every stream and queue trigger"""
+    sources = []
+    for name, resource in template['Resources'].items():
+        if resource.get('Type') != 'AWS::Serverless::Function':
+            continue
+        code_dir = os.path.basename(resource['Properties']['CodeUri'].rstrip('/'))
+        for event in (resource['Properties'].get('Events') or {}).values():
+            if event['Type'] in ('DynamoDB', 'SQS'):
+                sources.append((name, code_dir, event['Type'], event.get('Properties') or {}))
+    return sources
+
+
+def make_aws(args):
+    return local_aws.LocalAWS(
+        bedrock=local_aws.FakeBedrock(local_aws.Behavior(args.bedrock_latency, args.jitter, args.bedrock_throttle_rate,
+                                                         args.bedrock_concurrency, seed=1)),
+        polly=local_aws.FakePolly(local_aws.Behavior(args.polly_latency, args.jitter, args.polly_throttle_rate,
+                                                     args.polly_concurrency, seed=2)),
+        s3=local_aws.FakeS3(local_aws.Behavior(args.s3_latency, seed=3)),
+        dynamodb=local_aws.FakeDynamoDB(local_aws.Behavior(args.dynamodb_latency, seed=4))
+    ).install()
+
+
+class Emulator:
+    def __init__(self, args, template):
+        from tts_common import queues
+        # Throttled records come back after seconds rather than the production 30 s and up
+        queues.BASE_BACKOFF_SECONDS, queues.MAX_BACKOFF_SECONDS = 1, 4
+        self.aws = make_aws(args)
+        urls = self.aws.connect_stage_queues(visibility_timeout=args.visibility_timeout)
+        queue_urls = {
+            'RenderQueue': urls[self.aws.RENDER_QUEUE],
+            'TextQueue': urls[self.aws.TEXT_QUEUE],
+            'SweepQueue': urls[self.aws.SWEEP_QUEUE],
+            'OcrQueue': urls[self.aws.OCR_QUEUE],
+            'SynthesisQueue': urls[self.aws.SYNTHESIS_QUEUE]
+        }
+        self.dead_letter_urls = [url for name, url in urls.items() if '-dlq-' in name]
+        self.upload = local_aws.load_handler('upload-execution')
+        self.sources = {}
+
+        for function_name, code_dir, event_type, properties in event_sources(template):
+            handler = local_aws.load_handler(code_dir, f'{function_name}_emulated')
+            window = properties.get('MaximumBatchingWindowInSeconds', 0) * args.window_scale
+            if event_type == 'DynamoDB':
+                filters = [json.loads(f['Pattern']) for f in (properties.get('FilterCriteria') or {}).get('Filters', [])]
+                source = local_aws.StreamEventSource(self.aws.table, handler, function_name,
+                                                     batch_size=properties.get('BatchSize', 100), batching_window=window,
+                                                     filters=filters, shards=args.shards,
+                                                     max_retries=properties.get('MaximumRetryAttempts', 2),
+                                                     report_batch_item_failures='ReportBatchItemFailures' in properties.get('FunctionResponseTypes', []))
+            else:
+                queue = properties['Queue'].split('.')[0]
+                concurrency = (properties.get('ScalingConfig') or {}).get('MaximumConcurrency', DEFAULT_QUEUE_CONCURRENCY)
+                source = local_aws.SQSEventSource(self.aws.sqs, queue_urls[queue], handler, function_name,
+                                                  batch_size=properties.get('BatchSize', 10), max_concurrency=concurrency,
+                                                  batching_window=window)
+            self.sources[f'{function_name} ({event_type})'] = source
+
+    def start(self):
+        for source in self.sources.values():
+            source.start()
+
+    def stop(self):
+        for source in self.sources.values():
+            source.stop()
+
+    def submit(self, body, email):
+        response = self.upload.lambda_handler(local_aws.api_event(body, email=email), local_aws.LambdaContext('upload-execution'))
+        if response['statusCode'] != 200:
+            raise RuntimeError(f"upload failed: {response['body']}")
+        return json.loads(response['body'])['reference_key']
+
+    def wait(self, reference_keys, timeout, drain=False):
+        """Until the jobs reached a final status and the streams are idle, with drain also every queue"""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            items = {item['reference_key']: item['TaskStatus'] for item in self.aws.table.scan()['Items']}
+            sources = [source for source in self.sources.values() if drain or isinstance(source, local_aws.StreamEventSource)]
+            if all(source.idle() for source in sources) and all(items.get(key) in FINAL_STATUSES for key in reference_keys):
+                return True
+            time.sleep(0.1)
+        return False
+
+
+def make_body(args, generator):
+    if generator.random() < args.pdf_ratio:
+        texts = [local_aws.filler_text(args.chars_per_page, seed=generator.randint(0, 1000)) for _ in range(args.pages)]
+        return {
+            'fileName': 'emulated.pdf',
+            'language': 'english',
+            'startPage': 1,
+            'endPage': args.pages,
+            'fileContent': base64.b64encode(local_aws.make_fake_pdf(texts)).decode('ascii')
+        }
+    return {'text': local_aws.filler_text(args.chars, seed=generator.randint(0, 1000)), 'language': 'english', 'voice_id': 'Joanna'}
+
+
+def function_stats(emulator):
+    functions = {}
+    for name, source in emulator.sources.items():
+        failures = source.failed_batches if isinstance(source, local_aws.StreamEventSource) else source.record_failures
+        functions[name] = {'invocations': source.invocations, 'records': source.records_delivered, 'failures': failures}
+    return functions
+
+
+def report(emulator, reference_keys, makespan, finished):
+    aws = emulator.aws
+    items = [item for item in aws.table.scan()['Items'] if item['reference_key'] in reference_keys]
+    statuses = {}
+    for item in items:
+        statuses[item['TaskStatus']] = statuses.get(item['TaskStatus'], 0) + 1
+    rejected = sum(document.get('RejectedTransitions', 0) for document in aws.metrics)
+    return {
+        'jobs': len(reference_keys),
+        'finished': finished,
+        'statuses': statuses,
+        'makespan_s': makespan,
+        'jobs_per_second': len(reference_keys) / makespan if makespan else None,
+        'rejected_transitions': rejected,
+        'dead_lettered': sum(int(aws.sqs.get_queue_attributes(QueueUrl=url)['Attributes']['ApproximateNumberOfMessages'])
+                             for url in emulator.dead_letter_urls),
+        'bedrock_throttled': aws.bedrock.behavior.throttled,
+        'polly_throttled': aws.polly.behavior.throttled,
+        'functions': function_stats(emulator)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the real handlers behind the template.yaml triggers, in process')
+    parser.add_argument('--jobs', type=int, default=20)
+    parser.add_argument('--users', type=int, default=5)
+    parser.add_argument('--pdf-ratio', type=float, default=0.5, help='share of PDF jobs, the rest are TEXT')
+    parser.add_argument('--pages', type=int, default=3, help='pages per PDF job')
+    parser.add_argument('--chars-per-page', type=int, default=1500)
+    parser.add_argument('--chars', type=int, default=4000, help='characters per TEXT job')
+    parser.add_argument('--submit-rate', type=float, default=0, help='jobs per second, 0 submits all at once')
+    parser.add_argument('--upload-concurrency', type=int, default=8, help='concurrent upload requests')
+    parser.add_argument('--shards', type=int, default=4, help='stream shards, one in-order consumer each per function')
+    parser.add_argument('--window-scale', type=float, default=1.0, help='multiplier for MaximumBatchingWindowInSeconds')
+    parser.add_argument('--visibility-timeout', type=int, default=5, help='stage queue visibility timeout in seconds')
+    parser.add_argument('--bedrock-latency', type=float, default=0.02)
+    parser.add_argument('--bedrock-throttle-rate', type=float, default=0.0)
+    parser.add_argument('--bedrock-concurrency', type=int)
+    parser.add_argument('--polly-latency', type=float, default=0.01)
+    parser.add_argument('--polly-throttle-rate', type=float, default=0.0)
+    parser.add_argument('--polly-concurrency', type=int)
+    parser.add_argument('--s3-latency', type=float, default=0.0)
+    parser.add_argument('--dynamodb-latency', type=float, default=0.0)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--timeout', type=float, default=300, help='seconds to wait for every job to finish')
+    parser.add_argument('--expire', action='store_true', help='expire the jobs by TTL at the end and check the sweeper')
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--output', help='write the report as JSON')
+    args = parser.parse_args()
+
+    # Jobs are make_fake_pdf documents, rendered by the fake pdf2image
+    local_aws.install_fake_pdf2image()
+
+    emulator = Emulator(args, load_template())
+    generator = random.Random(args.seed)
+    bodies = [(make_body(args, generator), f'user{generator.randrange(args.users)}@example.com') for _ in range(args.jobs)]
+    print(f'🚌 {len(emulator.sources)} event sources from template.yaml, {args.jobs} jobs')
+
+    emulator.start()
+    start = time.perf_counter()
+    reference_keys = []
+    lock = threading.Lock()
+
+    def submit(body, email):
+        reference_key = emulator.submit(body, email)
+        with lock:
+            reference_keys.append(reference_key)
+
+    with ThreadPoolExecutor(max_workers=args.upload_concurrency) as executor:
+        futures = []
+        for n, (body, email) in enumerate(bodies):
+            if args.submit_rate:
+                time.sleep(max(0.0, start + n / args.submit_rate - time.perf_counter()))
+            futures.append(executor.submit(submit, body, email))
+        for future in futures:
+            future.result()
+    finished = emulator.wait(reference_keys, args.timeout)
+    makespan = time.perf_counter() - start
+
+    result = report(emulator, set(reference_keys), makespan, finished)
+    if args.expire:
+        bucket = emulator.aws.s3.objects(emulator.aws.BUCKET)
+        emulator.aws.table.expire_items(now=time.time() + 365 * 24 * 3600)
+        # The sweeper reads the TTL removals from its queue, behind the stream router
+        emulator.wait([], args.timeout, drain=True)
+        result['objects_left_after_expiry'] = sum(1 for key in list(bucket) if key.split('/')[1] in reference_keys)
+        result['functions'] = function_stats(emulator)
+    emulator.stop()
+
+    print(f"{'✅' if finished else '⚠️ '} {result['jobs']} jobs in {makespan:.1f}s ({result['jobs_per_second']:.1f} jobs/s): "
+          + ', '.join(f'{status} {count}' for status, count in sorted(result['statuses'].items())))
+    print(f"   rejected status transitions {result['rejected_transitions']} | dead-lettered {result['dead_lettered']} | "
+          f"throttled bedrock {result['bedrock_throttled']} polly {result['polly_throttled']}")
+    if 'objects_left_after_expiry' in result:
+        print(f"   objects left after TTL expiry {result['objects_left_after_expiry']}")
+    print(f"\n{'function':42} {'invocations':>12} {'records':>8} {'failures':>9}")
+    for name, stats in result['functions'].items():
+        print(f"{name:42} {stats['invocations']:12} {stats['records']:8} {stats['failures']:9}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+        print(f'\n📄 Report written to {args.output}')
+    return 0 if finished else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,49 @@
+import json
+import os
+from tts_common.artifacts import delete_keys, job_keys
+from tts_common.metrics import StageMetrics
+from tts_common.queues import process_batch
+
+def expired_reference_key(record):
+    # stream-router only queues TTL removals, the body is the stream record
+    return json.loads(record['body'])['dynamodb']['Keys']['reference_key']['S']
+
+def give_up(record):
+    # The job's item is gone already, there is no status to fail, the message moves to the dead-letter queue
+    print(f"Giving up sweeping {expired_reference_key(record)}")
+
+def lambda_handler(event, context):
+    metrics = StageMetrics('artifact-sweeper')
+    bucket = os.environ['S3_BUCKET']
+    # messageId -> reference_key, for the records whose keys were listed
+    listed = {}
+    job_artifacts = {}
+    
+    def list_record(record, final_attempt):
+        reference_key = expired_reference_key(record)
+        if reference_key not in job_artifacts:
+            with metrics.timer('ListTime'):
+                job_artifacts[reference_key] = job_keys(bucket, reference_key)
+        listed[record['messageId']] = reference_key
+    
+    try:
+        # A failed listing only sends its own message back (ReportBatchItemFailures)
+        response = process_batch(event, list_record, give_up)
+        
+        # Keys of the whole batch share DeleteObjects calls, deleting a missing key is not an error
+        deleted = 0
+        try:
+            with metrics.timer('DeleteTime'):
+                deleted = delete_keys(bucket, [key for keys in job_artifacts.values() for key in keys])
+        except Exception as e:
+            # All listed records are retried, already deleted keys are simply not listed again
+            print(f"Deleting artifacts of {len(job_artifacts)} jobs failed: {e}")
+            response['batchItemFailures'].extend({'itemIdentifier': message_id} for message_id in listed)
+            job_artifacts.clear()
+        
+        metrics.add('JobsSwept', len(job_artifacts))
+        metrics.add('ObjectsDeleted', deleted)
+        metrics.add('Failures', len(response['batchItemFailures']))
+        return response
+    finally:
+        metrics.flush()
@@ -0,0 +1 @@
+"""Code shared by the handlers in lambda-functions/, deployed as the CommonLayer Lambda layer"""
@@ -0,0 +1,40 @@
+"""
+S3 artifacts of a job and their removal.
+
+Every job keeps its objects under <prefix>/<reference_key>/: the upload, the
+rendered page images, the OCR page checkpoints, the synthesized chunk audio
+and download/ with the text and audio. Deletes go through DeleteObjects with up to 1,000 keys per call,
+so removing a 500-page job is one list and one delete request per prefix.
+"""
+
+from tts_common.clients import get_client
+
+ARTIFACT_PREFIXES = ['upload', 'images', 'ocr', 'audio', 'download']
+# DeleteObjects limit
+DELETE_BATCH_SIZE = 1000
+
+def list_keys(bucket, prefix):
+    keys = []
+    paginator = get_client('s3').get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        keys.extend(obj['Key'] for obj in page.get('Contents', []))
+    return keys
+
+def job_keys(bucket, reference_key, prefixes=None):
+    keys = []
+    for prefix in prefixes or ARTIFACT_PREFIXES:
+        keys.extend(list_keys(bucket, f'{prefix}/{reference_key}/'))
+    return keys
+
+def delete_keys(bucket, keys):
+    """Delete keys in batches of DELETE_BATCH_SIZE, returns the number deleted. Raises if S3 reports per-key errors."""
+    s3 = get_client('s3')
+    deleted = 0
+    for i in range(0, len(keys), DELETE_BATCH_SIZE):
+        batch = keys[i:i + DELETE_BATCH_SIZE]
+        response = s3.delete_objects(Bucket=bucket, Delete={'Objects': [{'Key': key} for key in batch], 'Quiet': True})
+        errors = response.get('Errors', [])
+        if errors:
+            raise RuntimeError(f"{len(errors)} of {len(batch)} deletes failed, first: {errors[0].get('Key')} {errors[0].get('Code')}")
+        deleted += len(batch)
+    return deleted
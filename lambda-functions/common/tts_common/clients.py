@@ -0,0 +1,123 @@
+"""
+Lazily created AWS clients shared by every handler.
+
+Clients are built on first use and kept for the lifetime of the container,
+so a code path only pays for the clients it actually calls and warm
+invocations reuse the same connection pools.
+"""
+
+import os
+import threading
+
+# Upper bound on concurrent AWS calls per process, thread pools in the handlers use the same number
+MAX_POOL_CONNECTIONS = int(os.environ.get('MAX_POOL_CONNECTIONS', '32'))
+CONNECT_TIMEOUT = 5
+DEFAULT_READ_TIMEOUT = 30
+# Bedrock OCR of a dense page and Polly synthesis of a long chunk run well past the default
+READ_TIMEOUTS = {
+    'bedrock-runtime': 120,
+    'polly': 60
+}
+MAX_ATTEMPTS = 5
+
+_lock = threading.Lock()
+_clients = {}
+_resources = {}
+_tables = {}
+_overrides = {}
+_limits = {}
+# Local helpers that never reach the service and need no slot
+UNLIMITED_METHODS = {'generate_presigned_url', 'generate_presigned_post', 'get_paginator', 'get_waiter', 'can_paginate', 'close'}
+
+def get_config(service_name):
+    from botocore.config import Config
+    return Config(
+        max_pool_connections=MAX_POOL_CONNECTIONS,
+        connect_timeout=CONNECT_TIMEOUT,
+        read_timeout=READ_TIMEOUTS.get(service_name, DEFAULT_READ_TIMEOUT),
+        retries={'mode': 'adaptive', 'max_attempts': MAX_ATTEMPTS},
+        tcp_keepalive=True
+    )
+
+class ConcurrencyLimitedClient:
+    """Client proxy letting at most N API calls to one service run at the same time across threads"""
+
+    def __init__(self, client, semaphore):
+        self._client = client
+        self._semaphore = semaphore
+
+    def __getattr__(self, name):
+        attribute = getattr(self._client, name)
+        if not callable(attribute) or name in UNLIMITED_METHODS:
+            return attribute
+
+        def call(*args, **kwargs):
+            with self._semaphore:
+                return attribute(*args, **kwargs)
+        return call
+
+def limit_concurrency(service_name, limit):
+    """Bound concurrent calls to service_name made through get_client, None removes the bound"""
+    with _lock:
+        if limit:
+            _limits[service_name] = threading.BoundedSemaphore(limit)
+        else:
+            _limits.pop(service_name, None)
+
+def get_client(service_name, **kwargs):
+    client = _get_client(service_name, **kwargs)
+    semaphore = _limits.get(service_name)
+    return ConcurrencyLimitedClient(client, semaphore) if semaphore else client
+
+def _get_client(service_name, **kwargs):
+    if service_name in _overrides:
+        return _overrides[service_name]
+    key = (service_name, tuple(sorted(kwargs.items())))
+    client = _clients.get(key)
+    if client is None:
+        # The default boto3 session is not safe to use from several threads at once
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                import boto3
+                client = boto3.client(service_name, config=get_config(service_name), **kwargs)
+                _clients[key] = client
+    return client
+
+def get_resource(service_name):
+    resource = _resources.get(service_name)
+    if resource is None:
+        with _lock:
+            resource = _resources.get(service_name)
+            if resource is None:
+                import boto3
+                resource = boto3.resource(service_name, config=get_config(service_name))
+                _resources[service_name] = resource
+    return resource
+
+def get_table(table_name=None):
+    table_name = table_name or os.environ['DYNAMODB_TABLE']
+    table = _tables.get(table_name)
+    if table is None:
+        table = get_resource('dynamodb').Table(table_name)
+        _tables[table_name] = table
+    return table
+
+def register_client(service_name, client):
+    """Use client for service_name whatever the arguments, e.g. an in-process fake"""
+    with _lock:
+        _overrides[service_name] = client
+
+def register_resource(service_name, resource):
+    with _lock:
+        _resources[service_name] = resource
+        if service_name == 'dynamodb':
+            _tables.clear()
+
+def reset_clients():
+    with _lock:
+        _clients.clear()
+        _resources.clear()
+        _tables.clear()
+        _overrides.clear()
+        _limits.clear()
@@ -0,0 +1,135 @@
+"""
+Per-stage metrics as CloudWatch Embedded Metric Format (EMF) log lines.
+
+Each handler invocation collects its timings and counters in a StageMetrics
+and writes them as one JSON log line on flush. CloudWatch extracts the
+metrics from the log asynchronously, so the hot path makes no PutMetricData
+calls. Metrics are dimensioned by Stage and InputType, and by Stage alone for
+stage-wide dashboards and alarms.
+
+The same numbers are summarised into the job's Timeline attribute as part of
+the stage's status update (status_update), so per-job latency analysis needs
+no extra writes.
+"""
+
+import json
+import os
+import time
+from contextlib import contextmanager
+
+NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'TTSPipeline')
+# EMF accepts at most 100 metrics per directive and 100 values per metric
+MAX_METRICS = 100
+MAX_VALUES = 100
+
+_sink = None
+
+def set_sink(sink):
+    """Send EMF documents to sink(document) instead of stdout, None restores stdout"""
+    global _sink
+    _sink = sink
+
+def seconds_since(timestamp):
+    """Age of an event timestamp, epoch seconds or ISO 8601 as in SNS and S3 notifications"""
+    if timestamp is None:
+        return None
+    if isinstance(timestamp, str):
+        from datetime import datetime
+        timestamp = datetime.fromisoformat(timestamp.replace('Z', '+00:00')).timestamp()
+    return max(0.0, time.time() - float(timestamp))
+
+def iso_time(epoch):
+    return time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(epoch)) + '.%03dZ' % (int(epoch * 1000) % 1000)
+
+def status_update(status, metrics=None):
+    """update_item arguments setting TaskStatus and, with metrics, appending the stage to Timeline"""
+    update = {
+        'UpdateExpression': 'SET TaskStatus = :status',
+        'ExpressionAttributeValues': {':status': status}
+    }
+    if metrics is not None:
+        update['UpdateExpression'] += ', Timeline = list_append(if_not_exists(Timeline, :empty), :entry)'
+        update['ExpressionAttributeValues'].update({':empty': [], ':entry': [metrics.timeline_entry(status)]})
+    return update
+
+class StageMetrics:
+    def __init__(self, stage, input_type='UNKNOWN'):
+        self.stage = stage
+        self.input_type = input_type
+        self.start = time.perf_counter()
+        self.started_at = time.time()
+        self.values = {}
+        self.units = {}
+        self.properties = {}
+
+    def put(self, name, value, unit='Milliseconds'):
+        self.values.setdefault(name, []).append(value)
+        self.units[name] = unit
+
+    def add(self, name, value, unit='Count'):
+        """Accumulate into a single value, e.g. bytes or tokens summed over a job"""
+        values = self.values.setdefault(name, [0])
+        values[0] += value
+        self.units[name] = unit
+
+    def set_property(self, name, value):
+        # Searchable in Logs Insights, not a metric
+        self.properties[name] = value
+
+    @contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.put(name, (time.perf_counter() - start) * 1000)
+
+    def queue_wait(self, timestamp):
+        wait = seconds_since(timestamp)
+        if wait is not None:
+            self.put('QueueWait', wait * 1000)
+
+    def timeline_entry(self, status):
+        """One Timeline element: when the stage ran and the totals of its metrics, integers only"""
+        entry = {
+            'stage': self.stage,
+            'status': status,
+            'input_type': self.input_type,
+            'started_at': iso_time(self.started_at),
+            'finished_at': iso_time(time.time()),
+            'duration_ms': round((time.perf_counter() - self.start) * 1000)
+        }
+        entry.update({name: round(sum(values)) for name, values in self.values.items()})
+        return entry
+
+    def documents(self):
+        names = list(self.values)
+        pending = {name: list(self.values[name]) for name in names}
+        while any(pending.values()):
+            batch = [name for name in names if pending[name]][:MAX_METRICS]
+            document = {
+                '_aws': {
+                    'Timestamp': int(time.time() * 1000),
+                    'CloudWatchMetrics': [{
+                        'Namespace': NAMESPACE,
+                        'Dimensions': [['Stage', 'InputType'], ['Stage']],
+                        'Metrics': [{'Name': name, 'Unit': self.units[name]} for name in batch]
+                    }]
+                },
+                'Stage': self.stage,
+                'InputType': self.input_type
+            }
+            document.update(self.properties)
+            for name in batch:
+                values, pending[name] = pending[name][:MAX_VALUES], pending[name][MAX_VALUES:]
+                document[name] = values[0] if len(values) == 1 else values
+            yield document
+
+    def flush(self):
+        self.put('Duration', (time.perf_counter() - self.start) * 1000)
+        for document in self.documents():
+            if _sink is not None:
+                _sink(document)
+            else:
+                print(json.dumps(document, default=str))
+        self.values.clear()
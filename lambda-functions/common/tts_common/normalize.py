@@ -0,0 +1,168 @@
+"""
+Text normalization between OCR and synthesis.
+
+OCR pages carry running headers and footers repeated on every page, page
+numbers, words hyphenated across line breaks and ragged whitespace. Polly
+bills every character it is sent and reads most of them aloud.
+normalize_pages drops repeated edge lines and bare page numbers, joins
+hyphenated words, and collapses whitespace to one blank line between
+paragraphs.
+
+Number and abbreviation expansion are optional and English only. They make
+the text longer, changing how Polly reads it rather than what it costs.
+Amounts next to a currency symbol and list markers ("1.", "2)") are left as
+they are, Polly reads those better than their spelled-out words.
+
+billed_length counts characters the way polly-invoker sends them: split_text
+rebuilds chunks from whitespace-separated words, so repeated whitespace is
+never billed and is not counted as saved.
+"""
+
+import re
+
+# Non-empty lines at the top and at the bottom of a page checked for headers and footers
+EDGE_LINES = 2
+# An edge line recurring (digits ignored) on this share of pages is a running header or footer
+REPEAT_SHARE = 0.5
+MIN_PAGES_FOR_REPEATS = 3
+EXPANSIONS = ('numbers', 'abbreviations')
+
+PAGE_NUMBER_LINE = re.compile(r'^[\W_]*(page\s*)?\d+(\s*(of|/)\s*\d+)?[\W_]*$', re.IGNORECASE)
+HYPHENATED_BREAK = re.compile(r'(\w)-[ \t]*\n\s*([a-z])')
+PARAGRAPH_BREAK = re.compile(r'\n[ \t]*\n')
+
+ABBREVIATIONS = [
+    (re.compile(r'\be\.g\.'), 'for example'),
+    (re.compile(r'\bi\.e\.'), 'that is'),
+    (re.compile(r'\betc\.(?=\s+[A-Z]|\s*$)'), 'et cetera.'),
+    (re.compile(r'\betc\.'), 'et cetera'),
+    (re.compile(r'\bvs\.'), 'versus'),
+    (re.compile(r'\bapprox\.'), 'approximately'),
+    (re.compile(r'\bDr\.(?=\s+[A-Z])'), 'Doctor'),
+    (re.compile(r'\bMr\.(?=\s+[A-Z])'), 'Mister'),
+    (re.compile(r'\bMrs\.(?=\s+[A-Z])'), 'Missus'),
+    (re.compile(r'\bProf\.(?=\s+[A-Z])'), 'Professor'),
+    (re.compile(r'\bFig\.(?=\s*\d)'), 'Figure'),
+    (re.compile(r'\bNo\.(?=\s*\d)'), 'Number'),
+    (re.compile(r'\bp\.(?=\s*\d)'), 'page'),
+    (re.compile(r'\bpp\.(?=\s*\d)'), 'pages')
+]
+# Whole numbers only, decimals, versions, codes like A4 or 3.5 and amounts like $1,000 or 20 € are left to Polly
+CURRENCY = '$€£¥'
+INTEGER = re.compile(rf'(?<![\w.,{CURRENCY}])(?<![{CURRENCY}] )(\d{{1,3}}(?:,\d{{3}})+|\d+)(?![\w]|[.,]\d| ?[{CURRENCY}])')
+# A number opening a line and followed by "." or ")" numbers a list item, years are not list numbers
+LIST_MARKER = re.compile(r'^[ \t]*(\d{1,3})[.)](?=\s)', re.MULTILINE)
+
+ONES = ['zero', 'one', 'two', 'three', 'four', 'five', 'six', 'seven', 'eight', 'nine', 'ten',
+        'eleven', 'twelve', 'thirteen', 'fourteen', 'fifteen', 'sixteen', 'seventeen', 'eighteen', 'nineteen']
+TENS = ['', '', 'twenty', 'thirty', 'forty', 'fifty', 'sixty', 'seventy', 'eighty', 'ninety']
+SCALES = [(10 ** 9, 'billion'), (10 ** 6, 'million'), (1000, 'thousand')]
+
+def billed_length(text):
+    return len(' '.join(text.split()))
+
+def signature(line):
+    return re.sub(r'\d+', '#', ' '.join(line.lower().split()))
+
+def edge_indexes(lines):
+    filled = [n for n, line in enumerate(lines) if line.strip()]
+    return set(filled[:EDGE_LINES] + filled[-EDGE_LINES:])
+
+def repeated_edge_lines(pages):
+    """Signatures of edge lines that recur across pages"""
+    if len(pages) < MIN_PAGES_FOR_REPEATS:
+        return set()
+    counts = {}
+    for lines in pages:
+        for sig in {signature(lines[n]) for n in edge_indexes(lines)}:
+            counts[sig] = counts.get(sig, 0) + 1
+    threshold = max(2, REPEAT_SHARE * len(pages))
+    return {sig for sig, count in counts.items() if count >= threshold}
+
+def is_furniture(line, repeated):
+    return bool(PAGE_NUMBER_LINE.match(line.strip())) or signature(line) in repeated
+
+def strip_page_furniture(pages):
+    """
+    Pages with running headers, footers and bare page numbers removed. Edge
+    lines are dropped from the outside in, a line is only looked at once the
+    lines between it and the page edge were dropped.
+    """
+    pages = [page.replace('\r\n', '\n').replace('\u00ad', '').split('\n') for page in pages]
+    repeated = repeated_edge_lines(pages)
+    stripped = []
+    for lines in pages:
+        filled = [n for n, line in enumerate(lines) if line.strip()]
+        dropped = set()
+        for edge in (filled[:EDGE_LINES], filled[::-1][:EDGE_LINES]):
+            for n in edge:
+                if n in dropped or not is_furniture(lines[n], repeated):
+                    break
+                dropped.add(n)
+        stripped.append('\n'.join(line for n, line in enumerate(lines) if n not in dropped))
+    return stripped
+
+def below_thousand(number):
+    hundreds, rest = divmod(number, 100)
+    words = [ONES[hundreds], 'hundred'] if hundreds else []
+    if rest >= 20:
+        words.append(TENS[rest // 10] + (f'-{ONES[rest % 10]}' if rest % 10 else ''))
+    elif rest or not words:
+        words.append(ONES[rest])
+    return words
+
+def cardinal(number):
+    words = []
+    for scale, name in SCALES:
+        count, number = divmod(number, scale)
+        if count:
+            words += cardinal(count).split() + [name]
+    if number or not words:
+        words += below_thousand(number)
+    return ' '.join(words)
+
+def number_to_words(number):
+    # Years are read in pairs, "nineteen ninety-nine", "twenty twenty-four"
+    if 1100 <= number <= 1999 or 2010 <= number <= 2099:
+        high, low = divmod(number, 100)
+        if not low:
+            tail = ['hundred']
+        elif low < 10:
+            tail = ['oh'] + below_thousand(low)
+        else:
+            tail = below_thousand(low)
+        return ' '.join(below_thousand(high) + tail)
+    return cardinal(number)
+
+def expand_numbers(text):
+    """Text with its whole numbers in words, line breaks must still be in place to tell list markers apart"""
+    markers = {match.start(1) for match in LIST_MARKER.finditer(text)}
+    return INTEGER.sub(
+        lambda match: match.group(0) if match.start() in markers else number_to_words(int(match.group(1).replace(',', ''))),
+        text
+    )
+
+def expand_abbreviations(text):
+    for pattern, replacement in ABBREVIATIONS:
+        text = pattern.sub(replacement, text)
+    return text
+
+def expansions(setting, language):
+    """Enabled expansions from a comma separated setting such as NORMALIZE_EXPAND, none for other languages than English"""
+    if str(language).lower() != 'english':
+        return ()
+    return tuple(name for name in (part.strip() for part in (setting or '').split(',')) if name in EXPANSIONS)
+
+def normalize_pages(pages, expand=()):
+    """OCR page texts in order -> one text, paragraphs separated by a blank line"""
+    text = '\n\n'.join(strip_page_furniture(pages))
+    # A hyphen at a line end before a lowercase letter splits a word, also across pages
+    text = HYPHENATED_BREAK.sub(r'\1\2', text)
+    # Before whitespace is collapsed, so list markers are still at the start of their line
+    if 'abbreviations' in expand:
+        text = expand_abbreviations(text)
+    if 'numbers' in expand:
+        text = expand_numbers(text)
+    paragraphs = [' '.join(paragraph.split()) for paragraph in PARAGRAPH_BREAK.split(text)]
+    text = '\n\n'.join(paragraph for paragraph in paragraphs if paragraph)
+    return text + '\n' if text else ''
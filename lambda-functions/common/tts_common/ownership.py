@@ -0,0 +1,40 @@
+"""
+Which jobs belong to a user.
+
+Jobs carry the submitting user's email as Username. Handlers that accept
+reference keys from a client (track-execution URLs, status-notifier
+subscriptions) keep only the keys this check returns.
+"""
+
+import time
+from tts_common.clients import get_resource, get_table
+
+BATCH_GET_LIMIT = 100
+MAX_UNPROCESSED_RETRIES = 5
+
+def get_owned_reference_keys(reference_keys, username):
+    table = get_table()
+    owned = set()
+    for i in range(0, len(reference_keys), BATCH_GET_LIMIT):
+        request_items = {
+            table.name: {
+                'Keys': [{'reference_key': key} for key in reference_keys[i:i + BATCH_GET_LIMIT]],
+                'ProjectionExpression': 'reference_key, Username'
+            }
+        }
+        
+        attempt = 0
+        while request_items:
+            response = get_resource('dynamodb').batch_get_item(RequestItems=request_items)
+            for item in response['Responses'].get(table.name, []):
+                if item.get('Username') == username:
+                    owned.add(item['reference_key'])
+            
+            request_items = response.get('UnprocessedKeys') or {}
+            if request_items:
+                attempt += 1
+                if attempt > MAX_UNPROCESSED_RETRIES:
+                    raise RuntimeError('BatchGetItem left keys unprocessed after retries')
+                time.sleep(min(0.05 * 2 ** attempt, 1.0))
+    
+    return owned
@@ -0,0 +1,78 @@
+"""
+Live progress counters on the job item.
+
+A stage that works through a known number of units (pages OCR'd, audio
+chunks synthesized) keeps <Unit>Done and <Unit>Total on the item. Done is
+raised with atomic ADD updates, and increments are coalesced so a job makes
+at most one progress write every PROGRESS_INTERVAL_SECONDS however fast its
+units finish. <Unit>StartedAt and <Unit>Baseline (units already done when the
+current attempt started, e.g. resumed OCR pages) let readers extrapolate an
+ETA from the throughput of the current attempt.
+"""
+
+import os
+import time
+from tts_common.clients import get_table
+
+PROGRESS_INTERVAL_SECONDS = float(os.environ.get('PROGRESS_INTERVAL_SECONDS', '5'))
+# (stage, unit attribute prefix) in pipeline order
+PROGRESS_STAGES = [('ocr', 'Pages'), ('synthesis', 'Chunks')]
+
+class ProgressCounter:
+    def __init__(self, reference_key, unit, total, done=0, interval=None):
+        self.reference_key = reference_key
+        self.unit = unit
+        self.total = total
+        self.interval = PROGRESS_INTERVAL_SECONDS if interval is None else interval
+        self.pending = 0
+        self.last_write = time.time()
+        # Absolute values for this attempt, ADD increments after that
+        get_table().update_item(
+            Key={'reference_key': reference_key},
+            UpdateExpression=f'SET {unit}Total = :total, {unit}Done = :done, {unit}Baseline = :done, '
+                             f'{unit}StartedAt = :now, {unit}UpdatedAt = :now',
+            ExpressionAttributeValues={':total': total, ':done': done, ':now': int(self.last_write * 1000)}
+        )
+
+    def add(self, count=1):
+        self.pending += count
+        if time.time() - self.last_write >= self.interval:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        self.last_write = time.time()
+        get_table().update_item(
+            Key={'reference_key': self.reference_key},
+            UpdateExpression=f'ADD {self.unit}Done :count SET {self.unit}UpdatedAt = :now',
+            ExpressionAttributeValues={':count': self.pending, ':now': int(self.last_write * 1000)}
+        )
+        self.pending = 0
+
+def progress_attributes():
+    return [f'{unit}{field}' for _, unit in PROGRESS_STAGES for field in ('Done', 'Total', 'Baseline', 'StartedAt', 'UpdatedAt')]
+
+def job_progress(item, now=None):
+    """
+    {stage, done, total, percent, eta_seconds} for the latest stage with
+    counters on the item, or None. eta_seconds is None until the current
+    attempt has finished a unit.
+    """
+    now = time.time() if now is None else now
+    for stage, unit in reversed(PROGRESS_STAGES):
+        if f'{unit}Total' not in item:
+            continue
+        total = int(item[f'{unit}Total'])
+        done = min(total, int(item.get(f'{unit}Done', 0)))
+        progress = {'stage': stage, 'done': done, 'total': total, 'percent': round(100.0 * done / total, 1) if total else 100.0, 'eta_seconds': None}
+        started_at = int(item.get(f'{unit}StartedAt', 0)) / 1000
+        updated_at = int(item.get(f'{unit}UpdatedAt', 0)) / 1000
+        finished = done - int(item.get(f'{unit}Baseline', 0))
+        if done >= total:
+            progress['eta_seconds'] = 0
+        elif finished > 0 and updated_at > started_at:
+            rate = finished / (updated_at - started_at)
+            progress['eta_seconds'] = round(max(0.0, updated_at + (total - done) / rate - now), 1)
+        return progress
+    return None
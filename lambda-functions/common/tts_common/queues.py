@@ -0,0 +1,97 @@
+"""
+SQS batch consumption for the queue-buffered stages.
+
+The image converter and Polly invoker read their work from SQS queues with
+ReportBatchItemFailures. Failed records are returned as batchItemFailures
+and redelivered. When a downstream service throttles, the record and the
+rest of the batch go back to the queue with a growing visibility timeout, so
+a burst turns into queueing delay instead of failed jobs. A job is only
+marked failed on its last receive before the queue moves it to the
+dead-letter queue, also when that receive is skipped because of throttling.
+"""
+
+import os
+import random
+from tts_common.clients import get_client
+
+# Must match maxReceiveCount of the queue's RedrivePolicy
+MAX_RECEIVE_COUNT = int(os.environ.get('MAX_RECEIVE_COUNT', '8'))
+BASE_BACKOFF_SECONDS = 30
+MAX_BACKOFF_SECONDS = 900
+THROTTLING_ERRORS = {
+    'ThrottlingException',
+    'TooManyRequestsException',
+    'ServiceQuotaExceededException',
+    'ProvisionedThroughputExceededException',
+    'RequestLimitExceeded',
+    'SlowDown'
+}
+
+def is_throttling_error(error):
+    response = getattr(error, 'response', None) or {}
+    return response.get('Error', {}).get('Code') in THROTTLING_ERRORS
+
+def is_sqs_event(event):
+    records = event.get('Records') or [{}]
+    return records[0].get('eventSource') == 'aws:sqs'
+
+def queue_url(queue_arn):
+    _, _, _, region, account_id, name = queue_arn.split(':')
+    return f'https://sqs.{region}.amazonaws.com/{account_id}/{name}'
+
+def receive_count(record):
+    return int(record.get('attributes', {}).get('ApproximateReceiveCount', '1'))
+
+def sent_at(record):
+    """Enqueue time in epoch seconds, for the QueueWait metric"""
+    return int(record['attributes']['SentTimestamp']) / 1000 if 'SentTimestamp' in record.get('attributes', {}) else None
+
+def delay_retry(record):
+    # Full jitter so a throttled burst does not come back in lockstep
+    backoff = min(MAX_BACKOFF_SECONDS, BASE_BACKOFF_SECONDS * 2 ** (receive_count(record) - 1))
+    try:
+        get_client('sqs').change_message_visibility(
+            QueueUrl=queue_url(record['eventSourceARN']),
+            ReceiptHandle=record['receiptHandle'],
+            VisibilityTimeout=int(random.uniform(BASE_BACKOFF_SECONDS, backoff))
+        )
+    except Exception as e:
+        # The record is still reported as failed and comes back after the queue's own timeout
+        print(f"Could not delay message {record['messageId']}: {e}")
+
+def give_up_record(record, give_up):
+    try:
+        give_up(record)
+    except Exception as e:
+        print(f"Could not mark the job of message {record['messageId']} failed: {e}")
+
+def process_batch(event, handle, give_up):
+    """
+    Call handle(record, final_attempt) for each SQS record and return the
+    partial batch response. final_attempt is True on the receive after which
+    the queue gives up, when the handler should record the job as failed.
+    give_up(record) does that for a record on its last receive that is
+    returned unprocessed because the batch was throttled.
+    """
+    failures = []
+    throttled = False
+    for record in event['Records']:
+        final_attempt = receive_count(record) >= MAX_RECEIVE_COUNT
+        if throttled:
+            # The service is saturated, trying the rest of the batch would only throttle again
+            failures.append({'itemIdentifier': record['messageId']})
+            if final_attempt:
+                # Next stop is the dead-letter queue, the job must not stay in its current status
+                give_up_record(record, give_up)
+            else:
+                delay_retry(record)
+            continue
+        try:
+            handle(record, final_attempt)
+        except Exception as e:
+            print(f"Message {record['messageId']} failed on receive {receive_count(record)}: {e}")
+            failures.append({'itemIdentifier': record['messageId']})
+            if is_throttling_error(e):
+                throttled = True
+                delay_retry(record)
+    return {'batchItemFailures': failures}
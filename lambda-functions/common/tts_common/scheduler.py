@@ -0,0 +1,79 @@
+"""
+Weighted fair queuing of jobs across users and size classes.
+
+Each (user, priority class) pair is a flow. A job's finish tag is
+max(virtual time, flow's last tag) + cost / weight, and the job with the
+smallest tag runs next (self-clocked fair queuing). Interactive jobs carry a
+higher weight than bulk ones, so one user's 500-page PDFs get their share of
+capacity without holding up other users' one-sentence jobs.
+
+reserved_slots keeps the last free execution slots for interactive jobs, so
+short jobs start immediately even when bulk work could fill every slot.
+
+Only pipeline-worker.py schedules with it. The Lambda consumers receive
+their SQS batches in arrival order and do not reorder them.
+"""
+
+import heapq
+import itertools
+
+# Rough service time in seconds: render + OCR per page, synthesis per character
+PAGE_COST = 3.0
+CHAR_COST = 0.001
+# (name, weight, largest cost in the class)
+PRIORITY_CLASSES = [
+    ('interactive', 8, 5.0),
+    ('standard', 2, 60.0),
+    ('bulk', 1, float('inf'))
+]
+CLASS_WEIGHTS = {name: weight for name, weight, _ in PRIORITY_CLASSES}
+
+def job_cost(input_type, pages=0, chars=0):
+    if input_type == 'PDF':
+        return max(1, pages) * PAGE_COST + chars * CHAR_COST
+    return max(1, chars) * CHAR_COST
+
+def classify(cost):
+    for name, _, max_cost in PRIORITY_CLASSES:
+        if cost <= max_cost:
+            return name
+    return PRIORITY_CLASSES[-1][0]
+
+class FairScheduler:
+    def __init__(self, class_weights=None, reserved_slots=0, reserved_class='interactive'):
+        self.class_weights = class_weights or CLASS_WEIGHTS
+        self.reserved_slots = reserved_slots
+        self.reserved_class = reserved_class
+        self.virtual_time = 0.0
+        self.last_tags = {}
+        self.heaps = {name: [] for name in self.class_weights}
+        self.sequence = itertools.count()
+
+    def __len__(self):
+        return sum(len(heap) for heap in self.heaps.values())
+
+    def push(self, job, user, cost, priority=None):
+        priority = priority or classify(cost)
+        flow = (user, priority)
+        tag = max(self.virtual_time, self.last_tags.get(flow, 0.0)) + cost / self.class_weights[priority]
+        self.last_tags[flow] = tag
+        heapq.heappush(self.heaps[priority], (tag, next(self.sequence), job))
+        return priority
+
+    def pop(self, free_slots=None):
+        """Next job to run, or None. With free_slots at or below reserved_slots only the reserved class may start."""
+        reserved_only = free_slots is not None and free_slots <= self.reserved_slots
+        best = None
+        for priority, heap in self.heaps.items():
+            if not heap or (reserved_only and priority != self.reserved_class):
+                continue
+            if best is None or heap[0][:2] < self.heaps[best][0][:2]:
+                best = priority
+        if best is None:
+            return None
+        tag, _, job = heapq.heappop(self.heaps[best])
+        self.virtual_time = max(self.virtual_time, tag)
+        if len(self.last_tags) > 10000:
+            # Flows whose last tag is behind virtual time would restart from it anyway
+            self.last_tags = {flow: last for flow, last in self.last_tags.items() if last > self.virtual_time}
+        return job
@@ -0,0 +1,77 @@
+"""
+Job state machine for TaskStatus.
+
+Statuses are ordered by pipeline step and a job only moves forward.
+set_status writes a status with a ConditionExpression listing the statuses
+it may be reached from. A duplicate or out-of-order event (a redelivered OCR
+message, a second S3 notification for the same text) is rejected by DynamoDB
+instead of moving a finished job back to an earlier state or rewriting the
+same status. Rejected writes change nothing, so they add no stream record and
+no notification.
+
+    Upload-Completed
+    pdf-to-images conversion is completed | pdf-to-images conversion is failed
+    images-to-text conversion is completed | images-to-text conversion is failed
+    Voice-is-Ready | failed
+
+A status may be set from any status of an earlier step, since a later stage
+can finish before an earlier stage's status write lands (TEXT jobs skip the
+PDF step entirely). A step's failure can still turn into its success, for a
+retry or dead-letter redrive that succeeds after the job was marked failed.
+"""
+
+from tts_common.clients import get_table
+from tts_common.metrics import status_update
+
+UPLOADED = 'Upload-Completed'
+PAGES_RENDERED = 'pdf-to-images conversion is completed'
+RENDER_FAILED = 'pdf-to-images conversion is failed'
+TEXT_READY = 'images-to-text conversion is completed'
+OCR_FAILED = 'images-to-text conversion is failed'
+VOICE_READY = 'Voice-is-Ready'
+SYNTHESIS_FAILED = 'failed'
+
+# (success, failure) per pipeline step, in order
+STEPS = [
+    (UPLOADED, None),
+    (PAGES_RENDERED, RENDER_FAILED),
+    (TEXT_READY, OCR_FAILED),
+    (VOICE_READY, SYNTHESIS_FAILED)
+]
+
+def _allowed_from():
+    allowed = {}
+    earlier = []
+    for success, failure in STEPS:
+        if failure:
+            allowed[success] = earlier + [failure]
+            allowed[failure] = list(earlier)
+            earlier += [success, failure]
+        else:
+            earlier.append(success)
+    return allowed
+
+# status -> statuses it may be set from
+ALLOWED_FROM = _allowed_from()
+
+def can_transition(current, status):
+    return current in ALLOWED_FROM[status]
+
+def set_status(reference_key, status, metrics=None):
+    """
+    Move the job to status if its current status allows it. Returns False,
+    without raising, when the transition is rejected.
+    """
+    update = status_update(status, metrics)
+    sources = {f':from{n}': source for n, source in enumerate(ALLOWED_FROM[status])}
+    update['ConditionExpression'] = f"TaskStatus IN ({', '.join(sources)})"
+    update['ExpressionAttributeValues'].update(sources)
+    table = get_table()
+    try:
+        table.update_item(Key={'reference_key': reference_key}, **update)
+        return True
+    except table.meta.client.exceptions.ConditionalCheckFailedException:
+        print(f'Ignoring status {status!r} for {reference_key}, not allowed from its current status')
+        if metrics is not None:
+            metrics.add('RejectedTransitions', 1)
+        return False
@@ -2,103 +2,152 @@ import io
 import json
 import os
 import tempfile
-from typing import List
+import time
 from urllib.parse import urlparse
-import boto3
-from pdf2image import convert_from_path
-
-s3 = boto3.client('s3')
-sns = boto3.client('sns')
-dynamodb = boto3.resource('dynamodb')
+from tts_common.clients import get_client, get_table
+from tts_common.metrics import StageMetrics
+from tts_common.queues import is_sqs_event, process_batch
+from tts_common.status import PAGES_RENDERED, RENDER_FAILED, TEXT_READY, can_transition, set_status
 
 def parse_s3_path(s3_path):
     parsed = urlparse(s3_path)
     return parsed.netloc, parsed.path.lstrip('/')
 
-def update_dynamodb_status(reference_key, status):
-    table = dynamodb.Table(os.environ['DYNAMODB_TABLE'])
-    table.update_item(
-        Key={'reference_key': reference_key},
-        UpdateExpression='SET TaskStatus = :status',
-        ExpressionAttributeValues={':status': status}
-    )
+def update_dynamodb_status(reference_key, status, metrics=None):
+    return set_status(reference_key, status, metrics)
 
-def lambda_handler(event, context):
-    try:
-        record = event['Records'][0]['dynamodb']['NewImage']
-        reference_key = record['reference_key']['S']
-        input_type = record.get('InputType', {}).get('S', 'PDF')
-        
-        if input_type == 'TEXT':
-            # Skip PDF processing for text input, go directly to text processing
-            s3_path = record['S3Path']['S']
-            bucket, key = parse_s3_path(s3_path)
-            
-            # Get text content
-            response = s3.get_object(Bucket=bucket, Key=key)
-            text_content = response['Body'].read().decode('utf-8')
-            
-            # Save directly to download folder
-            text_key = f'download/{reference_key}/formatted_output.txt'
-            s3.put_object(
-                Bucket=bucket,
-                Key=text_key,
-                Body=text_content.encode('utf-8'),
-                ContentType='text/plain'
-            )
-            
-            update_dynamodb_status(reference_key, 'images-to-text conversion is completed')
-            return {'statusCode': 200}
-        
-        # PDF Processing
-        s3_path = record['S3Path']['S']
-        start_page = int(record['StartPage']['S'])
-        end_page = int(record['EndPage']['S'])
-        
-        bucket, key = parse_s3_path(s3_path)
-        
-        # Download PDF
-        tmp_file = tempfile.NamedTemporaryFile(delete=False)
+def process_text_job(record, reference_key, metrics):
+    # Skip PDF processing for text input, go directly to text processing
+    s3_path = record['S3Path']['S']
+    bucket, key = parse_s3_path(s3_path)
+    
+    # Copy directly to download folder, the body never passes through the Lambda
+    text_key = f'download/{reference_key}/formatted_output.txt'
+    with metrics.timer('CopyTime'):
+        get_client('s3').copy_object(
+            Bucket=bucket,
+            CopySource={'Bucket': bucket, 'Key': key},
+            Key=text_key,
+            ContentType='text/plain',
+            MetadataDirective='REPLACE'
+        )
+    
+    update_dynamodb_status(reference_key, 'images-to-text conversion is completed', metrics)
+
+def process_pdf_job(record, reference_key, context, metrics):
+    # pdf2image loads PIL and shells out to poppler, TEXT jobs never import it
+    from pdf2image import convert_from_path
+    
+    s3 = get_client('s3')
+    s3_path = record['S3Path']['S']
+    start_page = int(record['StartPage']['S'])
+    end_page = int(record['EndPage']['S'])
+    
+    bucket, key = parse_s3_path(s3_path)
+    
+    # Download PDF
+    tmp_file = tempfile.NamedTemporaryFile(delete=False)
+    with metrics.timer('DownloadTime'):
         s3.download_fileobj(bucket, key, tmp_file)
-        tmp_file.close()
+    tmp_file.close()
+    metrics.add('DownloadBytes', os.path.getsize(tmp_file.name), 'Bytes')
+    
+    # Convert to images
+    render_start = time.perf_counter()
+    images = convert_from_path(tmp_file.name, first_page=start_page, last_page=end_page)
+    if images:
+        metrics.put('RenderTimePerPage', (time.perf_counter() - render_start) * 1000 / len(images))
+    metrics.add('PagesRendered', len(images))
+    
+    # Upload images
+    uploaded_images = []
+    for i, image in enumerate(images):
+        img_byte_arr = io.BytesIO()
+        image.save(img_byte_arr, format='PNG')
+        img_byte_arr = img_byte_arr.getvalue()
         
-        # Convert to images
-        images = convert_from_path(tmp_file.name, first_page=start_page, last_page=end_page)
-        
-        # Upload images
-        uploaded_images = []
-        for i, image in enumerate(images):
-            img_byte_arr = io.BytesIO()
-            image.save(img_byte_arr, format='PNG')
-            img_byte_arr = img_byte_arr.getvalue()
-            
-            image_key = f'images/{reference_key}/page_{i+start_page}.png'
+        image_key = f'images/{reference_key}/page_{i+start_page}.png'
+        with metrics.timer('UploadTime'):
             s3.put_object(
                 Bucket=bucket,
                 Key=image_key,
                 Body=img_byte_arr,
                 ContentType='image/png'
             )
-            uploaded_images.append(image_key)
-        
-        update_dynamodb_status(reference_key, 'pdf-to-images conversion is completed')
-        
-        # Send SNS notification
+        metrics.add('UploadBytes', len(img_byte_arr), 'Bytes')
+        uploaded_images.append(image_key)
+    
+    os.unlink(tmp_file.name)
+    
+    message = {
+        'reference_key': reference_key,
+        'bucket': bucket,
+        'images': uploaded_images
+    }
+    
+    # pipeline-worker.py runs OCR itself and leaves SNS_TOPIC_NAME unset
+    if os.environ.get('SNS_TOPIC_NAME'):
         account_id = context.invoked_function_arn.split(':')[4]
         topic_arn = f"arn:aws:sns:{os.environ['AWS_REGION']}:{account_id}:{os.environ['SNS_TOPIC_NAME']}"
+        get_client('sns').publish(TopicArn=topic_arn, Message=json.dumps(message))
+    
+    # Only after the publish: a redelivery skips jobs already in this status, so a
+    # failed publish has to leave the job where a retry renders it again
+    update_dynamodb_status(reference_key, PAGES_RENDERED, metrics)
+    
+    return message
+
+def process_record(stream_record, context, final_attempt=True):
+    metrics = None
+    reference_key = None
+    try:
+        record = stream_record['dynamodb']['NewImage']
+        reference_key = record['reference_key']['S']
+        input_type = record.get('InputType', {}).get('S', 'PDF')
         
-        sns.publish(
-            TopicArn=topic_arn,
-            Message=json.dumps({
-                'reference_key': reference_key,
-                'bucket': bucket,
-                'images': uploaded_images
-            })
-        )
+        metrics = StageMetrics('document-splitter', input_type)
+        metrics.set_property('reference_key', reference_key)
+        # From the table write, so the wait covers the stream and the queue
+        metrics.queue_wait(stream_record['dynamodb'].get('ApproximateCreationDateTime'))
+        
+        # The stream router sends a record again when it retries a partly queued batch
+        status = get_table().get_item(Key={'reference_key': reference_key})['Item']['TaskStatus']
+        if not can_transition(status, TEXT_READY if input_type == 'TEXT' else PAGES_RENDERED):
+            print(f"Skipping {reference_key} in status {status!r}")
+            return
         
-        os.unlink(tmp_file.name)
-        return {'statusCode': 200}
+        if input_type == 'TEXT':
+            process_text_job(record, reference_key, metrics)
+        else:
+            process_pdf_job(record, reference_key, context, metrics)
         
     except Exception as e:
-        update_dynamodb_status(reference_key, 'pdf-to-images conversion is failed')
-        raise e
\ No newline at end of file
+        if metrics:
+            metrics.add('Failures', 1)
+        # Earlier receives go back to the queue, only the last one fails the job
+        if reference_key and final_attempt:
+            update_dynamodb_status(reference_key, RENDER_FAILED, metrics)
+        raise e
+    finally:
+        if metrics:
+            metrics.flush()
+
+def fail_queue_record(record):
+    stream_record = json.loads(record['body'])
+    update_dynamodb_status(stream_record['dynamodb']['NewImage']['reference_key']['S'], RENDER_FAILED)
+
+def lambda_handler(event, context):
+    # Batches from the render or text queue, the body is the job's stream record
+    # as sent by stream-router. Failed messages are reported back
+    # (ReportBatchItemFailures) and redelivered, the rest of the batch is done.
+    if is_sqs_event(event):
+        return process_batch(
+            event,
+            lambda record, final_attempt: process_record(json.loads(record['body']), context, final_attempt),
+            fail_queue_record
+        )
+    
+    # Called directly with stream records (pipeline-worker, tests)
+    for stream_record in event['Records']:
+        process_record(stream_record, context)
+    return {'statusCode': 200}
@@ -1,11 +1,22 @@
 import base64
 import json
 import os
-import boto3
+import re
+import time
+from tts_common.artifacts import delete_keys, job_keys, list_keys
+from tts_common.clients import get_client, get_table
+from tts_common.metrics import StageMetrics
+from tts_common.normalize import billed_length, expansions, normalize_pages
+from tts_common.progress import ProgressCounter
+from tts_common.queues import is_sqs_event, process_batch, queue_url, sent_at
+from tts_common.status import TEXT_READY, can_transition, set_status
 
-s3 = boto3.client('s3')
-bedrock = boto3.client('bedrock-runtime')
-dynamodb = boto3.resource('dynamodb')
+# Stop starting pages when less than this plus two of the slowest pages so far is left
+DEADLINE_MARGIN_MS = 10000
+PAGE_NUMBER = re.compile(r'page_(\d+)\.\w+$')
+
+class OutOfTime(Exception):
+    """The Lambda deadline is near, the job continues from its checkpoints in a new invocation"""
 
 def get_model_endpoint():
     region = os.environ['AWS_REGION']
@@ -18,17 +29,21 @@ def get_model_endpoint():
     else:
         return 'us.anthropic.claude-3-5-sonnet-20240620-v1:0'
 
-def update_dynamodb(reference_key, status):
-    table = dynamodb.Table(os.environ['DYNAMODB_TABLE'])
-    table.update_item(
+def update_dynamodb(reference_key, status, metrics=None):
+    return set_status(reference_key, status, metrics)
+
+def get_job(reference_key):
+    return get_table().get_item(
         Key={'reference_key': reference_key},
-        UpdateExpression='SET TaskStatus = :status',
-        ExpressionAttributeValues={':status': status}
-    )
+        ProjectionExpression='TaskStatus, #lang',
+        ExpressionAttributeNames={'#lang': 'Language'},
+        ConsistentRead=True
+    ).get('Item')
 
-def process_image_claude(image_base64):
+def process_image_claude(image_base64, metrics):
     model_endpoint = get_model_endpoint()
-    response = bedrock.invoke_model(
+    start = time.perf_counter()
+    response = get_client('bedrock-runtime').invoke_model(
         modelId=model_endpoint,
         body=json.dumps({
             'anthropic_version': 'bedrock-2023-05-31',
@@ -57,46 +72,134 @@ def process_image_claude(image_base64):
     )
     
     response_body = json.loads(response['body'].read())
+    metrics.put('BedrockLatency', (time.perf_counter() - start) * 1000)
+    usage = response_body.get('usage', {})
+    metrics.add('BedrockInputTokens', usage.get('input_tokens', 0))
+    metrics.add('BedrockOutputTokens', usage.get('output_tokens', 0))
     return response_body['content'][0]['text']
 
-def lambda_handler(event, context):
+def page_number(key):
+    match = PAGE_NUMBER.search(key)
+    return int(match.group(1)) if match else 0
+
+def checkpoint_key(reference_key, page):
+    # Outside download/, which would trigger synthesis
+    return f'ocr/{reference_key}/page_{page}.txt'
+
+def load_checkpoints(s3, bucket, reference_key):
+    """Text of the pages an earlier attempt already sent through Bedrock, by page number"""
+    done = {}
+    for key in list_keys(bucket, f'ocr/{reference_key}/'):
+        done[page_number(key)] = s3.get_object(Bucket=bucket, Key=key)['Body'].read().decode('utf-8')
+    return done
+
+def drop_page_artifacts(bucket, reference_key, metrics):
+    # The page images and checkpoints are not read again once the text is out
+    try:
+        with metrics.timer('CleanupTime'):
+            metrics.add('ObjectsDeleted', delete_keys(bucket, job_keys(bucket, reference_key, ['images', 'ocr'])))
+    except Exception as e:
+        # Anything left over goes when the job expires
+        print(f'Could not delete page artifacts of {reference_key}: {e}')
+
+def convert_images(message, queued_at, final_attempt=True, context=None):
+    metrics = StageMetrics('image-converter', 'PDF')
     try:
-        message = json.loads(event['Records'][0]['Sns']['Message'])
         reference_key = message['reference_key']
         bucket = message['bucket']
+        s3 = get_client('s3')
+        metrics.set_property('reference_key', reference_key)
+        metrics.queue_wait(queued_at)
         
-        # List all images
-        all_objects = []
-        paginator = s3.get_paginator('list_objects_v2')
-        page_iterator = paginator.paginate(Bucket=bucket, Prefix=f'images/{reference_key}/')
+        # A redelivered message for a job whose text is already out must not start synthesis again
+        job = get_job(reference_key)
+        status = job['TaskStatus'] if job else None
+        if status is None or not can_transition(status, TEXT_READY):
+            print(f'Skipping {reference_key} in status {status!r}')
+            return
         
-        for page in page_iterator:
-            if 'Contents' in page:
-                all_objects.extend(page['Contents'])
+        # Page order is numeric, a plain key sort puts page_10 before page_2
+        image_keys = sorted(list_keys(bucket, f'images/{reference_key}/'), key=page_number)
+        if not image_keys:
+            update_dynamodb(reference_key, 'images-to-text conversion is failed', metrics)
+            return
         
-        if not all_objects:
-            update_dynamodb(reference_key, 'images-to-text conversion is failed')
-            return {'statusCode': 200}
-        
-        # Process each image with Bedrock
-        all_text = ''
-        for obj in sorted(all_objects, key=lambda x: x['Key']):
-            image_key = obj['Key']
+        # Pages finished by an earlier attempt are never sent to Bedrock again
+        texts = load_checkpoints(s3, bucket, reference_key)
+        resumed = sum(1 for key in image_keys if page_number(key) in texts)
+        metrics.add('PagesResumed', resumed)
+        progress = ProgressCounter(reference_key, 'Pages', len(image_keys), done=resumed)
+        slowest_page_ms = 0
+        for image_key in image_keys:
+            page = page_number(image_key)
+            if page in texts:
+                continue
+            if context and context.get_remaining_time_in_millis() < DEADLINE_MARGIN_MS + 2 * slowest_page_ms:
+                progress.flush()
+                raise OutOfTime(f'{len(texts)} of {len(image_keys)} pages done')
+            start = time.perf_counter()
             
-            image_object = s3.get_object(Bucket=bucket, Key=image_key)
-            image_content = image_object['Body'].read()
+            with metrics.timer('DownloadTime'):
+                image_object = s3.get_object(Bucket=bucket, Key=image_key)
+                image_content = image_object['Body'].read()
+            metrics.add('DownloadBytes', len(image_content), 'Bytes')
             image_base64 = base64.b64encode(image_content).decode('utf-8')
             
-            all_text += process_image_claude(image_base64) + '\n\n'
+            texts[page] = process_image_claude(image_base64, metrics)
+            s3.put_object(Bucket=bucket, Key=checkpoint_key(reference_key, page), Body=texts[page])
+            metrics.add('PagesProcessed', 1)
+            # Counted once the checkpoint is saved, so a page is never counted twice
+            progress.add()
+            slowest_page_ms = max(slowest_page_ms, (time.perf_counter() - start) * 1000)
+        
+        progress.flush()
+        # Checkpoints keep the raw OCR text, normalization runs on the whole document every time
+        pages = [texts[page_number(key)] for key in image_keys]
+        with metrics.timer('NormalizeTime'):
+            all_text = normalize_pages(pages, expansions(os.environ.get('NORMALIZE_EXPAND'), job.get('Language', 'english')))
+        raw_chars = billed_length(' '.join(pages))
+        metrics.add('CharsBeforeNormalization', raw_chars)
+        metrics.add('CharsSaved', raw_chars - billed_length(all_text))
         
         # Save extracted text to S3
         text_output_key = f'download/{reference_key}/formatted_output.txt'
-        s3.put_object(Bucket=bucket, Key=text_output_key, Body=all_text)
-        
-        update_dynamodb(reference_key, 'images-to-text conversion is completed')
+        with metrics.timer('UploadTime'):
+            s3.put_object(Bucket=bucket, Key=text_output_key, Body=all_text)
+        metrics.add('UploadBytes', len(all_text.encode('utf-8')), 'Bytes')
         
-        return {'statusCode': 200}
+        update_dynamodb(reference_key, 'images-to-text conversion is completed', metrics)
+        drop_page_artifacts(bucket, reference_key, metrics)
         
+    except OutOfTime:
+        metrics.add('Continuations', 1)
+        raise
     except Exception as e:
-        update_dynamodb(reference_key, 'images-to-text conversion is failed')
-        raise e
\ No newline at end of file
+        metrics.add('Failures', 1)
+        # Earlier receives go back to the queue, only the last one fails the job.
+        # Checkpoints are kept either way, a retry resumes after the last finished page.
+        if final_attempt:
+            update_dynamodb(reference_key, 'images-to-text conversion is failed', metrics)
+        raise e
+    finally:
+        metrics.flush()
+
+def handle_queue_record(record, final_attempt, context):
+    try:
+        convert_images(json.loads(record['body']), sent_at(record), final_attempt, context)
+    except OutOfTime as e:
+        # Progress was made, so continue in a fresh message instead of spending one of this message's receives
+        print(f"Continuing {record['messageId']} in a new message: {e}")
+        get_client('sqs').send_message(QueueUrl=queue_url(record['eventSourceARN']), MessageBody=record['body'])
+
+def fail_queue_record(record):
+    update_dynamodb(json.loads(record['body'])['reference_key'], 'images-to-text conversion is failed')
+
+def lambda_handler(event, context):
+    # Batches from the OCR queue (SNS raw message delivery), or a direct SNS invocation
+    if is_sqs_event(event):
+        return process_batch(event, lambda record, final_attempt: handle_queue_record(record, final_attempt, context), fail_queue_record)
+    
+    # Asynchronous invocation retries resume from the checkpoints
+    record = event['Records'][0]['Sns']
+    convert_images(json.loads(record['Message']), record.get('Timestamp'), context=context)
+    return {'statusCode': 200}
\ No newline at end of file
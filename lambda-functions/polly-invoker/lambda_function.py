@@ -1,16 +1,15 @@
+import hashlib
 import json
-import os
-import boto3
+from tts_common.artifacts import delete_keys, job_keys, list_keys
+from tts_common.clients import get_client, get_table
+from tts_common.metrics import StageMetrics
+from tts_common.progress import ProgressCounter
+from tts_common.queues import is_sqs_event, process_batch, sent_at
+from tts_common.status import SYNTHESIS_FAILED, VOICE_READY, can_transition, set_status
 
-s3 = boto3.client('s3')
-polly = boto3.client('polly')
-dynamodb = boto3.resource('dynamodb')
-table = dynamodb.Table(os.environ['DYNAMODB_TABLE'])
-
-def get_language_from_dynamodb(reference_key):
-    response = table.get_item(Key={'reference_key': reference_key})
-    language = str(response['Item']['Language']).lower()
-    return language
+def get_job(reference_key):
+    response = get_table().get_item(Key={'reference_key': reference_key})
+    return response['Item']
 
 def get_voice_id(language):
     if language == 'english':
@@ -28,85 +27,156 @@ def get_language_code(language):
     else:
         return 'en-US'
 
+# synthesize_speech rejects requests over 3,000 billed characters
+MAX_CHARS = 3000
+
 def split_text(text):
-    MAX_CHARS = 190000
-    words = text.split()
     chunks = []
     current_chunk = []
+    current_length = 0
     
-    for word in words:
-        if len(' '.join(current_chunk + [word])) <= MAX_CHARS:
+    for word in text.split():
+        # A single overlong "word" (e.g. a URL) is cut rather than rejected by Polly
+        while len(word) > MAX_CHARS:
+            if current_chunk:
+                chunks.append(' '.join(current_chunk))
+                current_chunk, current_length = [], 0
+            chunks.append(word[:MAX_CHARS])
+            word = word[MAX_CHARS:]
+        
+        added_length = len(word) + (1 if current_chunk else 0)
+        if current_length + added_length <= MAX_CHARS:
             current_chunk.append(word)
+            current_length += added_length
         else:
             chunks.append(' '.join(current_chunk))
             current_chunk = [word]
+            current_length = len(word)
     
     if current_chunk:
         chunks.append(' '.join(current_chunk))
     
     return chunks
 
-def update_dynamodb_status(reference_key, status):
-    table.update_item(
-        Key={'reference_key': reference_key},
-        UpdateExpression='SET TaskStatus = :status',
-        ExpressionAttributeValues={':status': status}
-    )
+def update_dynamodb_status(reference_key, status, metrics=None):
+    return set_status(reference_key, status, metrics)
 
-def lambda_handler(event, context):
+def checkpoint_key(reference_key, index, chunk):
+    # The digest ties the audio to its text, a retry after the text changed synthesizes the chunk again
+    digest = hashlib.sha256(chunk.encode('utf-8')).hexdigest()[:16]
+    return f'audio/{reference_key}/chunk_{index}_{digest}.mp3'
+
+def drop_chunk_artifacts(bucket, reference_key, metrics):
+    # The chunk audio is not read again once Audio.mp3 is out
     try:
-        bucket = event['Records'][0]['s3']['bucket']['name']
-        key = event['Records'][0]['s3']['object']['key']
+        with metrics.timer('CleanupTime'):
+            metrics.add('ObjectsDeleted', delete_keys(bucket, job_keys(bucket, reference_key, ['audio'])))
+    except Exception as e:
+        # Anything left over goes when the job expires
+        print(f'Could not delete chunk audio of {reference_key}: {e}')
+
+def synthesize_document(s3_record, queued_at, final_attempt=True):
+    metrics = StageMetrics('polly-invoker')
+    try:
+        bucket = s3_record['s3']['bucket']['name']
+        key = s3_record['s3']['object']['key']
         
         reference_key = key.split('/')[1]
+        s3 = get_client('s3')
+        polly = get_client('polly')
+        metrics.set_property('reference_key', reference_key)
+        metrics.queue_wait(queued_at)
+        
+        # Get language and input type from DynamoDB
+        job = get_job(reference_key)
+        metrics.input_type = job.get('InputType', 'PDF')
+        if not can_transition(job['TaskStatus'], VOICE_READY):
+            # Duplicate S3 notification for a job that already has its audio
+            print(f"Skipping {reference_key} in status {job['TaskStatus']!r}")
+            return
         
         # Get text content
-        response = s3.get_object(Bucket=bucket, Key=key)
-        text_content = response['Body'].read().decode('utf-8')
+        with metrics.timer('DownloadTime'):
+            response = s3.get_object(Bucket=bucket, Key=key)
+            text_content = response['Body'].read().decode('utf-8')
         
-        # Get language from DynamoDB
-        language = get_language_from_dynamodb(reference_key)
+        language = str(job['Language']).lower()
         voice_id = get_voice_id(language)
         language_code = get_language_code(language)
         
         # Split text into chunks
         text_chunks = split_text(text_content)
+        if not text_chunks:
+            # Blank text upload or OCR found no text, a retry would not change that and an empty Audio.mp3 is no result
+            print(f"No text to synthesize for {reference_key}")
+            metrics.add('Failures', 1)
+            update_dynamodb_status(reference_key, SYNTHESIS_FAILED, metrics)
+            return
+        # Chunks finished by an earlier attempt are never sent to Polly again
+        chunk_keys = [checkpoint_key(reference_key, index, chunk) for index, chunk in enumerate(text_chunks)]
+        saved = set(list_keys(bucket, f'audio/{reference_key}/'))
+        resumed = sum(1 for chunk_key in chunk_keys if chunk_key in saved)
+        metrics.add('ChunksResumed', resumed)
+        progress = ProgressCounter(reference_key, 'Chunks', len(text_chunks), done=resumed)
         
-        # Convert each chunk to audio
-        audio_files = []
-        for i, chunk in enumerate(text_chunks):
-            polly_response = polly.synthesize_speech(
-                Text=chunk,
-                OutputFormat='mp3',
-                VoiceId=voice_id,
-                LanguageCode=language_code
-            )
-            
-            audio_key = f'download/{reference_key}/chunk_{i}.mp3'
+        # Convert each chunk to audio, MP3 frames can simply be concatenated
+        audio_chunks = []
+        for chunk, chunk_key in zip(text_chunks, chunk_keys):
+            if chunk_key in saved:
+                with metrics.timer('DownloadTime'):
+                    audio_chunks.append(s3.get_object(Bucket=bucket, Key=chunk_key)['Body'].read())
+                continue
+            with metrics.timer('PollyLatency'):
+                polly_response = polly.synthesize_speech(
+                    Text=chunk,
+                    OutputFormat='mp3',
+                    VoiceId=voice_id,
+                    LanguageCode=language_code
+                )
+                audio_chunks.append(polly_response['AudioStream'].read())
+            metrics.add('PollyCharacters', polly_response.get('RequestCharacters', len(chunk)))
+            s3.put_object(Bucket=bucket, Key=chunk_key, Body=audio_chunks[-1], ContentType='audio/mpeg')
+            # Counted once the checkpoint is saved, so a chunk is never counted twice
+            progress.add()
+        progress.flush()
+        
+        final_audio_key = f'download/{reference_key}/Audio.mp3'
+        audio = b''.join(audio_chunks)
+        with metrics.timer('UploadTime'):
             s3.put_object(
                 Bucket=bucket,
-                Key=audio_key,
-                Body=polly_response['AudioStream'].read(),
+                Key=final_audio_key,
+                Body=audio,
                 ContentType='audio/mpeg'
             )
-            audio_files.append(audio_key)
-        
-        # Rename first chunk to Audio.mp3 (VocalDocs pattern)
-        final_audio_key = f'download/{reference_key}/Audio.mp3'
-        s3.copy_object(
-            Bucket=bucket,
-            CopySource={'Bucket': bucket, 'Key': audio_files[0]},
-            Key=final_audio_key
-        )
-        
-        # Clean up chunk files
-        for audio_file in audio_files:
-            s3.delete_object(Bucket=bucket, Key=audio_file)
-        
-        update_dynamodb_status(reference_key, 'Voice-is-Ready')
+        metrics.add('UploadBytes', len(audio), 'Bytes')
         
-        return {'statusCode': 200}
+        update_dynamodb_status(reference_key, VOICE_READY, metrics)
+        drop_chunk_artifacts(bucket, reference_key, metrics)
         
     except Exception as e:
-        update_dynamodb_status(reference_key, 'failed')
-        raise e
\ No newline at end of file
+        metrics.add('Failures', 1)
+        # Earlier receives go back to the queue, only the last one fails the job.
+        # Chunk audio is kept either way, a retry resumes after the last finished chunk.
+        if final_attempt:
+            update_dynamodb_status(reference_key, SYNTHESIS_FAILED, metrics)
+        raise e
+    finally:
+        metrics.flush()
+
+def handle_queue_record(record, final_attempt):
+    # The body is the S3 event notification, s3:TestEvent has no Records
+    for s3_record in json.loads(record['body']).get('Records', []):
+        synthesize_document(s3_record, sent_at(record), final_attempt)
+
+def fail_queue_record(record):
+    for s3_record in json.loads(record['body']).get('Records', []):
+        update_dynamodb_status(s3_record['s3']['object']['key'].split('/')[1], SYNTHESIS_FAILED)
+
+def lambda_handler(event, context):
+    # Batches from the synthesis queue, or a direct S3 notification
+    if is_sqs_event(event):
+        return process_batch(event, handle_queue_record, fail_queue_record)
+    
+    synthesize_document(event['Records'][0], event['Records'][0].get('eventTime'))
+    return {'statusCode': 200}
\ No newline at end of file
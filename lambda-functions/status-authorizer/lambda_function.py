@@ -0,0 +1,51 @@
+import base64
+import json
+import os
+from tts_common.clients import get_client
+
+# Browsers cannot set headers on a WebSocket handshake, the Cognito access token comes as ?token=
+TOKEN_PARAMETER = 'token'
+
+def token_claims(token):
+    # Only read after Cognito accepted the token, so the payload needs no signature check here
+    payload = token.split('.')[1]
+    return json.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))
+
+def get_username(token):
+    """Email of the token's user, None unless Cognito accepts it as an access token of this pool and app client"""
+    cognito = get_client('cognito-idp')
+    try:
+        user = cognito.get_user(AccessToken=token)
+    except (cognito.exceptions.NotAuthorizedException, cognito.exceptions.UserNotFoundException,
+            cognito.exceptions.InvalidParameterException):
+        return None
+    
+    claims = token_claims(token)
+    if not claims.get('iss', '').endswith('/' + os.environ['USER_POOL_ID']):
+        return None
+    if claims.get('client_id') != os.environ['USER_POOL_CLIENT_ID']:
+        return None
+    # Jobs are owned by the email claim, the same one the REST API authorizer hands to the handlers
+    attributes = {attribute['Name']: attribute['Value'] for attribute in user['UserAttributes']}
+    return attributes.get('email')
+
+def policy(effect, resource, username=None):
+    response = {
+        'principalId': username or 'anonymous',
+        'policyDocument': {
+            'Version': '2012-10-17',
+            'Statement': [{'Action': 'execute-api:Invoke', 'Effect': effect, 'Resource': resource}]
+        }
+    }
+    if username:
+        # Passed to every route of the connection as requestContext.authorizer.username
+        response['context'] = {'username': username}
+    return response
+
+def lambda_handler(event, context):
+    token = (event.get('queryStringParameters') or {}).get(TOKEN_PARAMETER)
+    username = get_username(token) if token else None
+    if not username:
+        print(f"Rejected WebSocket connection {event['requestContext'].get('connectionId')}")
+        return policy('Deny', event['methodArn'])
+    return policy('Allow', event['methodArn'], username)
@@ -0,0 +1,134 @@
+import json
+import os
+import time
+from boto3.dynamodb.conditions import Key
+from tts_common.clients import get_client, get_table
+from tts_common.ownership import get_owned_reference_keys
+from tts_common.progress import job_progress, progress_attributes
+
+# Connections are dropped by API Gateway after 2 hours at the latest
+SUBSCRIPTION_TTL = 2 * 60 * 60
+MAX_SUBSCRIPTIONS = 100
+
+def get_subscriptions_table():
+    return get_table(os.environ['SUBSCRIPTIONS_TABLE'])
+
+def websocket_response(status_code, body=None):
+    return {'statusCode': status_code, 'body': json.dumps(body or {})}
+
+def subscribe(connection_id, username, reference_keys):
+    expires_at = int(time.time()) + SUBSCRIPTION_TTL
+    with get_subscriptions_table().batch_writer() as batch:
+        for reference_key in reference_keys:
+            batch.put_item(Item={
+                'reference_key': reference_key,
+                'connection_id': connection_id,
+                'Username': username,
+                'ExpiresAt': expires_at
+            })
+
+def unsubscribe_connection(connection_id):
+    subscriptions_table = get_subscriptions_table()
+    response = subscriptions_table.query(
+        IndexName='connection_id-index',
+        KeyConditionExpression=Key('connection_id').eq(connection_id)
+    )
+    with subscriptions_table.batch_writer() as batch:
+        for item in response['Items']:
+            batch.delete_item(Key={
+                'reference_key': item['reference_key'],
+                'connection_id': connection_id
+            })
+
+def handle_websocket(event):
+    route_key = event['requestContext']['routeKey']
+    connection_id = event['requestContext']['connectionId']
+    # Set by the $connect authorizer (status-authorizer) and kept for the whole connection
+    username = (event['requestContext'].get('authorizer') or {}).get('username')
+    
+    if route_key == '$connect':
+        return websocket_response(200 if username else 401)
+    
+    if route_key == '$disconnect':
+        unsubscribe_connection(connection_id)
+        return websocket_response(200)
+    
+    if route_key == 'subscribe':
+        body = json.loads(event.get('body') or '{}')
+        reference_keys = body.get('reference_keys') or []
+        if not isinstance(reference_keys, list) or not all(isinstance(key, str) and key for key in reference_keys):
+            return websocket_response(400, {'error': 'reference_keys must be a list of reference keys'})
+        reference_keys = list(dict.fromkeys(reference_keys))
+        if not reference_keys or len(reference_keys) > MAX_SUBSCRIPTIONS:
+            return websocket_response(400, {'error': f'reference_keys must contain 1 to {MAX_SUBSCRIPTIONS} keys'})
+        if not username:
+            return websocket_response(401, {'error': 'Connection is not authorized'})
+        owned = get_owned_reference_keys(reference_keys, username)
+        subscribed = [key for key in reference_keys if key in owned]
+        denied = [key for key in reference_keys if key not in owned]
+        subscribe(connection_id, username, subscribed)
+        return websocket_response(200, {'subscribed': subscribed, 'denied': denied})
+    
+    return websocket_response(400, {'error': f'Unknown route {route_key}'})
+
+def image_progress(image):
+    # Progress counters of a stream image, in the form job_progress reads from an item
+    return {name: int(image[name]['N']) for name in progress_attributes() if name in image}
+
+def units_done(image):
+    return {name: value for name, value in image_progress(image).items() if name.endswith(('Done', 'Total'))}
+
+def get_status_changes(records):
+    # Only the latest state per job in this batch is worth sending
+    changes = {}
+    for record in records:
+        if record.get('eventName') != 'MODIFY':
+            continue
+        new_image = record['dynamodb'].get('NewImage', {})
+        old_image = record['dynamodb'].get('OldImage', {})
+        new_status = new_image.get('TaskStatus', {}).get('S')
+        if not new_status:
+            continue
+        # Every write to the item is a MODIFY record (Timeline entries, counters reset to the
+        # same values by a retry), only a new status or more units done are worth a message
+        if new_status == old_image.get('TaskStatus', {}).get('S') and units_done(new_image) == units_done(old_image):
+            continue
+        changes[new_image['reference_key']['S']] = new_image
+    return changes
+
+def notify_subscribers(reference_key, image):
+    subscriptions_table = get_subscriptions_table()
+    apigateway = get_client('apigatewaymanagementapi', endpoint_url=os.environ['WEBSOCKET_ENDPOINT'])
+    response = subscriptions_table.query(
+        KeyConditionExpression=Key('reference_key').eq(reference_key)
+    )
+    message = json.dumps({
+        'reference_key': reference_key,
+        'TaskStatus': image['TaskStatus']['S'],
+        'Progress': job_progress(image_progress(image))
+    }).encode('utf-8')
+    
+    for item in response['Items']:
+        try:
+            apigateway.post_to_connection(ConnectionId=item['connection_id'], Data=message)
+        except apigateway.exceptions.GoneException:
+            subscriptions_table.delete_item(Key={
+                'reference_key': reference_key,
+                'connection_id': item['connection_id']
+            })
+        except apigateway.exceptions.ClientError as e:
+            # One failing connection must not fail the batch, the stream would send every record again
+            print(f"Could not notify connection {item['connection_id']} about {reference_key}: {e}")
+
+def lambda_handler(event, context):
+    if 'requestContext' in event:
+        return handle_websocket(event)
+    
+    changes = get_status_changes(event['Records'])
+    if not changes:
+        return {'statusCode': 200}
+    
+    for reference_key, image in changes.items():
+        notify_subscribers(reference_key, image)
+    
+    return {'statusCode': 200}
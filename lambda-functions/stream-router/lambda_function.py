@@ -0,0 +1,77 @@
+import json
+import os
+import time
+from tts_common.clients import get_client
+from tts_common.metrics import StageMetrics
+
+SQS_BATCH_LIMIT = 10
+MAX_SEND_ATTEMPTS = 3
+
+def is_ttl_removal(record):
+    # TTL deletions are REMOVE records made by the DynamoDB service principal
+    identity = record.get('userIdentity') or {}
+    return (record.get('eventName') == 'REMOVE'
+            and identity.get('type') == 'Service'
+            and identity.get('principalId') == 'dynamodb.amazonaws.com')
+
+def route(record):
+    """Queue URL for a stream record, None for records no stage works on"""
+    if record.get('eventName') == 'INSERT':
+        input_type = record['dynamodb'].get('NewImage', {}).get('InputType', {}).get('S', 'PDF')
+        return os.environ['TEXT_QUEUE_URL'] if input_type == 'TEXT' else os.environ['RENDER_QUEUE_URL']
+    if is_ttl_removal(record):
+        return os.environ['SWEEP_QUEUE_URL']
+    return None
+
+def message_body(record):
+    # Stages read the new image or the keys, the old image would only count against the 256 KB message limit
+    forwarded = dict(record, dynamodb={k: v for k, v in record['dynamodb'].items() if k != 'OldImage'})
+    return json.dumps(forwarded)
+
+def send_records(queue_url, records):
+    """Send records in batches of 10, returns the ones SQS did not take after retries"""
+    sqs = get_client('sqs')
+    failed = []
+    for i in range(0, len(records), SQS_BATCH_LIMIT):
+        pending = {str(n): record for n, record in enumerate(records[i:i + SQS_BATCH_LIMIT])}
+        for attempt in range(MAX_SEND_ATTEMPTS):
+            response = sqs.send_message_batch(
+                QueueUrl=queue_url,
+                Entries=[{'Id': entry_id, 'MessageBody': message_body(record)} for entry_id, record in pending.items()]
+            )
+            pending = {entry['Id']: pending[entry['Id']] for entry in response.get('Failed', [])}
+            if not pending:
+                break
+            time.sleep(0.1 * 2 ** attempt)
+        failed.extend(pending.values())
+    return failed
+
+def lambda_handler(event, context):
+    """
+    The one job consumer of the table's stream, next to status-notifier.
+    New jobs go to the render or text queue by InputType, TTL expiries to the
+    sweep queue. A record SQS would not take is reported back
+    (ReportBatchItemFailures) and the stream retries from it; records after it
+    that did get sent are sent again and skipped by the stages' status checks.
+    """
+    metrics = StageMetrics('stream-router')
+    try:
+        by_queue = {}
+        for record in event['Records']:
+            queue_url = route(record)
+            if queue_url:
+                by_queue.setdefault(queue_url, []).append(record)
+        
+        failed = []
+        for queue_url, records in by_queue.items():
+            failed.extend(send_records(queue_url, records))
+            metrics.add('RecordsRouted', len(records))
+        
+        if failed:
+            metrics.add('Failures', len(failed))
+            first = min(failed, key=lambda record: int(record['dynamodb']['SequenceNumber']))
+            print(f"{len(failed)} stream records could not be queued, retrying from {first['dynamodb']['SequenceNumber']}")
+            return {'batchItemFailures': [{'itemIdentifier': first['dynamodb']['SequenceNumber']}]}
+        return {'batchItemFailures': []}
+    finally:
+        metrics.flush()
@@ -1,15 +1,54 @@
 import json
 import os
-import boto3
+import time
+from decimal import Decimal
 from boto3.dynamodb.conditions import Attr
+from tts_common.clients import get_client, get_table
+from tts_common.ownership import get_owned_reference_keys
+from tts_common.progress import job_progress, progress_attributes
 
-dynamodb = boto3.resource('dynamodb')
-s3_client = boto3.client('s3')
-table = dynamodb.Table(os.environ['DYNAMODB_TABLE'])
+PRESIGNED_URL_EXPIRY = 3600
+# Stop handing out a cached URL this many seconds before it expires
+PRESIGNED_URL_REFRESH_MARGIN = 300
+PRESIGNED_URL_CACHE_SIZE = 5000
+MAX_BATCH_KEYS = 500
+
+# reference_key -> (presigned_url, expires_at), reused across warm invocations
+presigned_url_cache = {}
+
+def get_presigned_url(reference_key):
+    now = time.time()
+    cached = presigned_url_cache.get(reference_key)
+    if cached and cached[1] - PRESIGNED_URL_REFRESH_MARGIN > now:
+        return cached[0]
+    
+    audio_key = f'download/{reference_key}/Audio.mp3'
+    presigned_url = get_client('s3').generate_presigned_url(
+        'get_object',
+        Params={'Bucket': os.environ['S3_BUCKET'], 'Key': audio_key},
+        ExpiresIn=PRESIGNED_URL_EXPIRY
+    )
+    
+    if len(presigned_url_cache) >= PRESIGNED_URL_CACHE_SIZE:
+        for key in [k for k, v in presigned_url_cache.items() if v[1] - PRESIGNED_URL_REFRESH_MARGIN <= now]:
+            del presigned_url_cache[key]
+        if len(presigned_url_cache) >= PRESIGNED_URL_CACHE_SIZE:
+            # dicts keep insertion order, so this drops the oldest entry
+            del presigned_url_cache[next(iter(presigned_url_cache))]
+    
+    presigned_url_cache[reference_key] = (presigned_url, now + PRESIGNED_URL_EXPIRY)
+    return presigned_url
+
+def json_default(value):
+    # Numbers in DynamoDB items (Timeline durations and sizes) come back as Decimal
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
 
 def lambda_handler(event, context):
     try:
         username = event['requestContext']['authorizer']['claims']['email']
+        table = get_table()
         
         if 'action' in event and event['action'] == 'generate_url':
             # Generate presigned URL
@@ -23,12 +62,7 @@ def lambda_handler(event, context):
                     'body': json.dumps({'error': 'Access denied'})
                 }
             
-            audio_key = f'download/{reference_key}/Audio.mp3'
-            presigned_url = s3_client.generate_presigned_url(
-                'get_object',
-                Params={'Bucket': os.environ['S3_BUCKET'], 'Key': audio_key},
-                ExpiresIn=3600
-            )
+            presigned_url = get_presigned_url(reference_key)
             
             return {
                 'statusCode': 200,
@@ -36,10 +70,103 @@ def lambda_handler(event, context):
                 'body': json.dumps({'presigned_url': presigned_url})
             }
         
+        elif 'action' in event and event['action'] == 'get_timeline':
+            # Per-stage timings and sizes recorded by the pipeline for one request
+            reference_key = event['reference_key']
+            
+            response = table.get_item(
+                Key={'reference_key': reference_key},
+                ProjectionExpression='reference_key, Username, TaskStatus, InputType, Timeline'
+            )
+            if 'Item' not in response or response['Item']['Username'] != username:
+                return {
+                    'statusCode': 403,
+                    'headers': {'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'Access denied'})
+                }
+            
+            item = response['Item']
+            return {
+                'statusCode': 200,
+                'headers': {'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({
+                    'reference_key': reference_key,
+                    'TaskStatus': item['TaskStatus'],
+                    'InputType': item.get('InputType', 'PDF'),
+                    'Timeline': item.get('Timeline', [])
+                }, default=json_default)
+            }
+        
+        elif 'action' in event and event['action'] == 'get_progress':
+            # Pages OCR'd or chunks synthesized so far, with an ETA from the current throughput
+            reference_key = event['reference_key']
+            
+            response = table.get_item(
+                Key={'reference_key': reference_key},
+                ProjectionExpression=', '.join(['reference_key', 'Username', 'TaskStatus'] + progress_attributes())
+            )
+            if 'Item' not in response or response['Item']['Username'] != username:
+                return {
+                    'statusCode': 403,
+                    'headers': {'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'Access denied'})
+                }
+            
+            item = response['Item']
+            return {
+                'statusCode': 200,
+                'headers': {'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({
+                    'reference_key': reference_key,
+                    'TaskStatus': item['TaskStatus'],
+                    'Progress': job_progress(item)
+                })
+            }
+        
+        elif 'action' in event and event['action'] == 'generate_urls':
+            # Generate presigned URLs for many requests with one ownership lookup
+            reference_keys = event.get('reference_keys') or []
+            if not isinstance(reference_keys, list) or not all(isinstance(key, str) and key for key in reference_keys):
+                return {
+                    'statusCode': 400,
+                    'headers': {'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'reference_keys must be a list of reference keys'})
+                }
+            reference_keys = list(dict.fromkeys(reference_keys))
+            
+            if not reference_keys or len(reference_keys) > MAX_BATCH_KEYS:
+                return {
+                    'statusCode': 400,
+                    'headers': {'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': f'reference_keys must contain 1 to {MAX_BATCH_KEYS} keys'})
+                }
+            
+            owned = get_owned_reference_keys(reference_keys, username)
+            
+            presigned_urls = {}
+            denied = []
+            for reference_key in reference_keys:
+                if reference_key in owned:
+                    presigned_urls[reference_key] = get_presigned_url(reference_key)
+                else:
+                    denied.append(reference_key)
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'presigned_urls': presigned_urls, 'denied': denied})
+            }
+        
         else:
             # List user requests
+            include_timeline = bool(event.get('include_timeline'))
+            projection = 'reference_key, TaskStatus, UploadDateTime, InputType, FileName, #lang, TextPreview, #text, ' + ', '.join(progress_attributes())
+            if include_timeline:
+                projection += ', Timeline'
             response = table.scan(
-                FilterExpression=Attr('Username').eq(username)
+                FilterExpression=Attr('Username').eq(username),
+                ProjectionExpression=projection,
+                ExpressionAttributeNames={'#lang': 'Language', '#text': 'text'}
             )
             
             requests = []
@@ -55,15 +182,26 @@ def lambda_handler(event, context):
                     request_data['fileName'] = item.get('FileName', 'Unknown')
                     request_data['Language'] = item.get('Language', 'english')
                 else:
-                    request_data['text'] = item.get('text', '')[:100] + '...' if len(item.get('text', '')) > 100 else item.get('text', '')
+                    if 'TextPreview' in item:
+                        request_data['text'] = item['TextPreview']
+                    else:
+                        # Items written before the body moved to S3 carry the full text
+                        request_data['text'] = item.get('text', '')[:100] + '...' if len(item.get('text', '')) > 100 else item.get('text', '')
                     request_data['Language'] = item.get('Language', 'english')
                 
+                progress = job_progress(item)
+                if progress:
+                    request_data['Progress'] = progress
+                
+                if include_timeline:
+                    request_data['Timeline'] = item.get('Timeline', [])
+                
                 requests.append(request_data)
             
             return {
                 'statusCode': 200,
                 'headers': {'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'requests': requests})
+                'body': json.dumps({'requests': requests}, default=json_default)
             }
             
     except Exception as e:
@@ -71,4 +209,4 @@ def lambda_handler(event, context):
             'statusCode': 500,
             'headers': {'Access-Control-Allow-Origin': '*'},
             'body': json.dumps({'error': str(e)})
-        }
\ No newline at end of file
+        }
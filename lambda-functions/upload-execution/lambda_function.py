@@ -1,26 +1,393 @@
 import base64
+import hashlib
 import json
-import boto3
+import math
 import uuid
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
+from urllib.parse import quote, unquote, unquote_plus
+from tts_common.clients import MAX_POOL_CONNECTIONS, get_client, get_resource, get_table
+from tts_common.metrics import StageMetrics
 
-dynamodb = boto3.resource('dynamodb')
-s3_client = boto3.client('s3')
-table = dynamodb.Table(os.environ['DYNAMODB_TABLE'])
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Headers': 'Content-Type,Authorization,Idempotency-Key',
+    'Access-Control-Allow-Methods': 'POST,OPTIONS'
+}
 
-def lambda_handler(event, context):
+# S3 multipart limits: parts of at least 5 MiB, at most 10,000 parts
+MIN_PART_SIZE = 8 * 1024 * 1024
+MAX_PARTS = 10000
+MAX_UPLOAD_SIZE = 2 * 1024 * 1024 * 1024
+PRESIGNED_PART_EXPIRY = 3600
+# Multipart uploads are stored under a fixed name, the S3 event filter on the .pdf suffix is case-sensitive
+UPLOAD_OBJECT_NAME = 'input.pdf'
+UPLOAD_WINDOW = 24 * 60 * 60
+TEXT_PREVIEW_LENGTH = 100
+MAX_BATCH_DOCUMENTS = 500
+BATCH_UPLOAD_WORKERS = MAX_POOL_CONNECTIONS
+BATCH_WRITE_LIMIT = 25
+SQS_BATCH_LIMIT = 10
+MAX_UNPROCESSED_RETRIES = 5
+IDEMPOTENCY_WINDOW = 24 * 60 * 60
+MAX_IDEMPOTENCY_KEY_LENGTH = 255
+
+def api_response(status_code, body):
+    return {
+        'statusCode': status_code,
+        'headers': CORS_HEADERS,
+        'body': json.dumps(body)
+    }
+
+def build_pdf_item(reference_key, username, file_name, language, start_page, end_page, s3_path):
+    current_time = datetime.now(timezone.utc)
+    expiration_time = current_time + timedelta(weeks=0.5)
+    return {
+        'reference_key': reference_key,
+        'FileName': file_name,
+        'Language': language,
+        'StartPage': str(start_page),
+        'EndPage': str(end_page),
+        'S3Path': f"s3://{os.environ['S3_BUCKET']}/{s3_path}",
+        'UploadDateTime': current_time.isoformat(),
+        'TaskStatus': 'Upload-Completed',
+        'Username': username,
+        'ExpiresAt': int(expiration_time.timestamp()),
+        'InputType': 'PDF'
+    }
+
+def require_fields(body, *names):
+    missing = [name for name in names if body.get(name) is None]
+    if missing:
+        raise ValueError(f"Missing required fields: {', '.join(missing)}")
+
+def get_text_preview(text):
+    return text[:TEXT_PREVIEW_LENGTH] + '...' if len(text) > TEXT_PREVIEW_LENGTH else text
+
+def get_idempotency_table():
+    # Optional, submissions are not deduplicated without it
+    if not os.environ.get('IDEMPOTENCY_TABLE'):
+        return None
+    return get_table(os.environ['IDEMPOTENCY_TABLE'])
+
+def get_uploads_table():
+    return get_table(os.environ['UPLOADS_TABLE'])
+
+def get_idempotency_key(event, body, username):
+    headers = {name.lower(): value for name, value in (event.get('headers') or {}).items()}
+    key = headers.get('idempotency-key') or body.get('idempotency_key')
+    if key is not None and not isinstance(key, str):
+        raise ValueError('idempotency_key must be a string')
+    if not key or get_idempotency_table() is None:
+        return None
+    if len(key) > MAX_IDEMPOTENCY_KEY_LENGTH:
+        raise ValueError(f'Idempotency key longer than {MAX_IDEMPOTENCY_KEY_LENGTH} characters')
+    # Keys are only unique per client, so scope them to the user
+    return f'{username}#{key}'
+
+def get_previous_submission(idempotency_key):
+    response = get_idempotency_table().get_item(Key={'idempotency_key': idempotency_key}, ConsistentRead=True)
+    item = response.get('Item')
+    # TTL deletion lags behind expiry, so check it here as well
+    if item and int(item['ExpiresAt']) > time.time():
+        return item['reference_key']
+    return None
+
+def claim_idempotency_key(idempotency_key, reference_key):
+    """Bind the key to reference_key, returning the earlier reference_key if another request won"""
+    idempotency_table = get_idempotency_table()
+    now = int(time.time())
     try:
-        body = json.loads(event['body'])
-        username = event['requestContext']['authorizer']['claims']['email']
+        idempotency_table.put_item(
+            Item={
+                'idempotency_key': idempotency_key,
+                'reference_key': reference_key,
+                'ExpiresAt': now + IDEMPOTENCY_WINDOW
+            },
+            ConditionExpression='attribute_not_exists(idempotency_key) OR ExpiresAt < :now',
+            ExpressionAttributeValues={':now': now}
+        )
+        return None
+    except idempotency_table.meta.client.exceptions.ConditionalCheckFailedException:
+        return get_previous_submission(idempotency_key)
+
+def put_text_document(reference_key, username, text, language, voice_id):
+    current_time = datetime.now(timezone.utc)
+    expiration_time = current_time + timedelta(weeks=0.5)
+    
+    text_bytes = text.encode('utf-8')
+    s3_path = f"upload/{reference_key}/input.txt"
+    get_client('s3').put_object(
+        Bucket=os.environ['S3_BUCKET'],
+        Key=s3_path,
+        Body=text_bytes,
+        ContentType='text/plain'
+    )
+    
+    # The body lives in S3 only, keeping items and stream records small
+    return {
+        'reference_key': reference_key,
+        'TextPreview': get_text_preview(text),
+        'TextSize': len(text_bytes),
+        'TextSha256': hashlib.sha256(text_bytes).hexdigest(),
+        'Language': language,
+        'voice_id': voice_id,
+        'S3Path': f"s3://{os.environ['S3_BUCKET']}/{s3_path}",
+        'UploadDateTime': current_time.isoformat(),
+        'TaskStatus': 'Upload-Completed',
+        'Username': username,
+        'ExpiresAt': int(expiration_time.timestamp()),
+        'InputType': 'TEXT'
+    }
+
+def batch_put_items(items):
+    """Write items with BatchWriteItem, returning the reference keys left unprocessed"""
+    table = get_table()
+    unprocessed_keys = []
+    for i in range(0, len(items), BATCH_WRITE_LIMIT):
+        request_items = {
+            table.name: [{'PutRequest': {'Item': item}} for item in items[i:i + BATCH_WRITE_LIMIT]]
+        }
         
+        attempt = 0
+        while request_items:
+            response = get_resource('dynamodb').batch_write_item(RequestItems=request_items)
+            request_items = response.get('UnprocessedItems') or {}
+            if request_items:
+                attempt += 1
+                if attempt > MAX_UNPROCESSED_RETRIES:
+                    unprocessed_keys.extend(
+                        request['PutRequest']['Item']['reference_key'] for request in request_items[table.name]
+                    )
+                    break
+                time.sleep(min(0.05 * 2 ** attempt, 1.0))
+    
+    return unprocessed_keys
+
+def job_message(item):
+    # Owner and size let the worker's fair scheduler order jobs without reading the item
+    message = {
+        'reference_key': item['reference_key'],
+        'username': item['Username'],
+        'input_type': item['InputType']
+    }
+    if item['InputType'] == 'PDF':
+        message['pages'] = max(1, int(item['EndPage']) - int(item['StartPage']) + 1)
+    else:
+        message['chars'] = int(item['TextSize'])
+    return json.dumps(message)
+
+def enqueue_jobs(items):
+    """Hand new jobs to pipeline-worker.py when JOB_QUEUE_URL is set, the Lambda pipeline starts from the stream instead"""
+    queue_url = os.environ.get('JOB_QUEUE_URL')
+    if not queue_url or not items:
+        return
+    
+    sqs = get_client('sqs')
+    for i in range(0, len(items), SQS_BATCH_LIMIT):
+        messages = {str(n): job_message(item) for n, item in enumerate(items[i:i + SQS_BATCH_LIMIT])}
+        response = sqs.send_message_batch(
+            QueueUrl=queue_url,
+            Entries=[{'Id': message_id, 'MessageBody': body} for message_id, body in messages.items()]
+        )
+        for failure in response.get('Failed', []):
+            sqs.send_message(QueueUrl=queue_url, MessageBody=messages[failure['Id']])
+
+def submit_batch(body, username):
+    documents = body.get('documents') or []
+    if not documents or len(documents) > MAX_BATCH_DOCUMENTS:
+        return api_response(400, {'error': f'documents must contain 1 to {MAX_BATCH_DOCUMENTS} entries'})
+    
+    def upload(document):
         reference_key = str(uuid.uuid4())
-        current_time = datetime.now(timezone.utc)
-        expiration_time = current_time + timedelta(weeks=0.5)
+        try:
+            return put_text_document(
+                reference_key,
+                username,
+                document['text'],
+                document.get('language', 'english'),
+                document.get('voice_id', 'Joanna')
+            ), None
+        except Exception as e:
+            return None, str(e)
+    
+    with ThreadPoolExecutor(max_workers=BATCH_UPLOAD_WORKERS) as executor:
+        uploads = list(executor.map(upload, documents))
+    
+    unprocessed_keys = set(batch_put_items([item for item, error in uploads if item]))
+    enqueue_jobs([item for item, error in uploads if item and item['reference_key'] not in unprocessed_keys])
+    
+    results = []
+    for index, (item, error) in enumerate(uploads):
+        if item is None:
+            results.append({'index': index, 'error': error})
+        elif item['reference_key'] in unprocessed_keys:
+            results.append({'index': index, 'error': 'Job could not be registered, please retry'})
+        else:
+            results.append({'index': index, 'reference_key': item['reference_key']})
+    
+    return api_response(200, {
+        'message': 'Batch submitted',
+        'submitted': sum(1 for result in results if 'reference_key' in result),
+        'failed': sum(1 for result in results if 'error' in result),
+        'results': results
+    })
+
+def start_multipart_upload(body, username):
+    require_fields(body, 'fileName', 'fileSize', 'language', 'startPage', 'endPage')
+    file_name = os.path.basename(body['fileName'])
+    file_size = int(body['fileSize'])
+    if not file_name.lower().endswith('.pdf'):
+        return api_response(400, {'error': 'Only PDF files can be uploaded'})
+    if file_size <= 0 or file_size > MAX_UPLOAD_SIZE:
+        return api_response(400, {'error': f'fileSize must be between 1 and {MAX_UPLOAD_SIZE} bytes'})
+    language = body['language']
+    if not isinstance(language, str) or not language.isascii():
+        return api_response(400, {'error': 'language must be an ASCII string'})
+    start_page = int(body['startPage'])
+    end_page = int(body['endPage'])
+    
+    reference_key = str(uuid.uuid4())
+    s3_path = f"upload/{reference_key}/{UPLOAD_OBJECT_NAME}"
+    part_size = max(MIN_PART_SIZE, math.ceil(file_size / MAX_PARTS))
+    part_count = math.ceil(file_size / part_size)
+    
+    # Job parameters travel with the object, the S3 completion event registers the job from them
+    upload = get_client('s3').create_multipart_upload(
+        Bucket=os.environ['S3_BUCKET'],
+        Key=s3_path,
+        ContentType='application/pdf',
+        # User metadata must be ASCII, free-form values are percent-encoded
+        Metadata={
+            'reference-key': reference_key,
+            'username': quote(username),
+            'file-name': quote(file_name),
+            'language': language,
+            'start-page': str(start_page),
+            'end-page': str(end_page)
+        }
+    )
+    # complete_upload and abort_upload are only accepted from the user who started the upload
+    get_uploads_table().put_item(Item={
+        'reference_key': reference_key,
+        'Username': username,
+        'UploadId': upload['UploadId'],
+        'Key': s3_path,
+        'ExpiresAt': int(time.time()) + UPLOAD_WINDOW
+    })
+    
+    parts = [
+        {
+            'part_number': part_number,
+            'url': get_client('s3').generate_presigned_url(
+                'upload_part',
+                Params={
+                    'Bucket': os.environ['S3_BUCKET'],
+                    'Key': s3_path,
+                    'UploadId': upload['UploadId'],
+                    'PartNumber': part_number
+                },
+                ExpiresIn=PRESIGNED_PART_EXPIRY
+            )
+        }
+        for part_number in range(1, part_count + 1)
+    ]
+    
+    return api_response(200, {
+        'reference_key': reference_key,
+        'upload_id': upload['UploadId'],
+        'key': s3_path,
+        'part_size': part_size,
+        'parts': parts,
+        'expires_in': PRESIGNED_PART_EXPIRY
+    })
+
+def get_upload_key(body, username):
+    """Key of the upload the user started with start_upload, None if it is not theirs"""
+    require_fields(body, 'reference_key', 'upload_id')
+    response = get_uploads_table().get_item(Key={'reference_key': body['reference_key']}, ConsistentRead=True)
+    upload = response.get('Item')
+    if not upload or upload['Username'] != username or upload['UploadId'] != body['upload_id']:
+        return None
+    # Only keys handed out by start_upload may be completed or aborted
+    if body.get('key', upload['Key']) != upload['Key']:
+        raise ValueError('key does not belong to reference_key')
+    return upload['Key']
+
+def upload_not_found(body):
+    return api_response(403, {'error': 'No upload of yours with this reference_key and upload_id', 'reference_key': body['reference_key']})
+
+def complete_multipart_upload(body, username):
+    s3_path = get_upload_key(body, username)
+    if s3_path is None:
+        return upload_not_found(body)
+    require_fields(body, 'parts')
+    parts = sorted(body['parts'], key=lambda part: int(part['part_number']))
+    get_client('s3').complete_multipart_upload(
+        Bucket=os.environ['S3_BUCKET'],
+        Key=s3_path,
+        UploadId=body['upload_id'],
+        MultipartUpload={
+            'Parts': [{'PartNumber': int(part['part_number']), 'ETag': part['etag']} for part in parts]
+        }
+    )
+    return api_response(200, {
+        'message': 'Upload completed, processing will start shortly',
+        'reference_key': body['reference_key']
+    })
+
+def abort_multipart_upload(body, username):
+    s3_path = get_upload_key(body, username)
+    if s3_path is None:
+        return upload_not_found(body)
+    get_client('s3').abort_multipart_upload(
+        Bucket=os.environ['S3_BUCKET'],
+        Key=s3_path,
+        UploadId=body['upload_id']
+    )
+    get_uploads_table().delete_item(Key={'reference_key': body['reference_key']})
+    return api_response(200, {'message': 'Upload aborted', 'reference_key': body['reference_key']})
+
+def register_uploaded_objects(event):
+    table = get_table()
+    for record in event['Records']:
+        bucket = record['s3']['bucket']['name']
+        s3_path = unquote_plus(record['s3']['object']['key'])
+        
+        metadata = get_client('s3').head_object(Bucket=bucket, Key=s3_path).get('Metadata', {})
+        if 'reference-key' not in metadata:
+            # Written by the inline base64 path, which already registered the job
+            continue
+        
+        item = build_pdf_item(
+            metadata['reference-key'],
+            unquote(metadata['username']),
+            unquote(metadata['file-name']),
+            metadata['language'],
+            metadata['start-page'],
+            metadata['end-page'],
+            s3_path
+        )
         
+        try:
+            # S3 delivers events at least once, the job must only be created once
+            table.put_item(Item=item, ConditionExpression='attribute_not_exists(reference_key)')
+        except table.meta.client.exceptions.ConditionalCheckFailedException:
+            continue
+        enqueue_jobs([item])
+    
+    return {'statusCode': 200}
+
+def create_submission(body, username, reference_key):
+    metrics = StageMetrics('upload-execution', 'PDF' if 'fileContent' in body else 'TEXT')
+    metrics.set_property('reference_key', reference_key)
+    try:
         # Handle both PDF upload and text input
         if 'fileContent' in body:
-            # PDF Upload
+            # PDF Upload (small files only, large files use start_upload)
+            require_fields(body, 'fileName', 'language', 'startPage', 'endPage')
             file_name = body['fileName']
             language = body['language']
             start_page = body['startPage']
@@ -30,71 +397,96 @@ def lambda_handler(event, context):
             file_content = base64.b64decode(file_content_base64)
             s3_path = f"upload/{reference_key}/{file_name}"
             
-            s3_client.put_object(
-                Bucket=os.environ['S3_BUCKET'],
-                Key=s3_path,
-                Body=file_content
-            )
-            
-            item = {
-                'reference_key': reference_key,
-                'FileName': file_name,
-                'Language': language,
-                'StartPage': str(start_page),
-                'EndPage': str(end_page),
-                'S3Path': f"s3://{os.environ['S3_BUCKET']}/{s3_path}",
-                'UploadDateTime': current_time.isoformat(),
-                'TaskStatus': 'Upload-Completed',
-                'Username': username,
-                'ExpiresAt': int(expiration_time.timestamp()),
-                'InputType': 'PDF'
-            }
+            with metrics.timer('UploadTime'):
+                get_client('s3').put_object(
+                    Bucket=os.environ['S3_BUCKET'],
+                    Key=s3_path,
+                    Body=file_content
+                )
+            metrics.add('UploadBytes', len(file_content), 'Bytes')
             
+            item = build_pdf_item(reference_key, username, file_name, language, start_page, end_page, s3_path)
+        
         else:
             # Text Input
-            text = body['text']
-            language = body.get('language', 'english')
-            voice_id = body.get('voice_id', 'Joanna')
-            
-            s3_path = f"upload/{reference_key}/input.txt"
-            s3_client.put_object(
-                Bucket=os.environ['S3_BUCKET'],
-                Key=s3_path,
-                Body=text.encode('utf-8'),
-                ContentType='text/plain'
-            )
-            
-            item = {
-                'reference_key': reference_key,
-                'text': text,
-                'Language': language,
-                'voice_id': voice_id,
-                'S3Path': f"s3://{os.environ['S3_BUCKET']}/{s3_path}",
-                'UploadDateTime': current_time.isoformat(),
-                'TaskStatus': 'Upload-Completed',
-                'Username': username,
-                'ExpiresAt': int(expiration_time.timestamp()),
-                'InputType': 'TEXT'
-            }
+            if not isinstance(body.get('text'), str) or not body['text']:
+                raise ValueError('text must be a non-empty string')
+            with metrics.timer('UploadTime'):
+                item = put_text_document(
+                    reference_key,
+                    username,
+                    body['text'],
+                    body.get('language', 'english'),
+                    body.get('voice_id', 'Joanna')
+                )
+            metrics.add('UploadBytes', int(item['TextSize']), 'Bytes')
         
-        table.put_item(Item=item)
+        item['Timeline'] = [metrics.timeline_entry(item['TaskStatus'])]
+        get_table().put_item(Item=item)
+        return item
+    except Exception:
+        metrics.add('Failures', 1)
+        raise
+    finally:
+        metrics.flush()
+
+def lambda_handler(event, context):
+    if event.get('Records', [{}])[0].get('eventSource') == 'aws:s3':
+        return register_uploaded_objects(event)
+    
+    try:
+        body = json.loads(event['body'])
+        if not isinstance(body, dict):
+            raise ValueError('Request body must be a JSON object')
+        username = event['requestContext']['authorizer']['claims']['email']
         
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Headers': 'Content-Type,Authorization',
-                'Access-Control-Allow-Methods': 'POST,OPTIONS'
-            },
-            'body': json.dumps({
-                'message': 'Request submitted successfully',
-                'reference_key': reference_key
-            })
-        }
+        action = body.get('action')
+        if action == 'start_upload':
+            return start_multipart_upload(body, username)
+        if action == 'complete_upload':
+            return complete_multipart_upload(body, username)
+        if action == 'abort_upload':
+            return abort_multipart_upload(body, username)
+        if action == 'batch_submit':
+            return submit_batch(body, username)
         
+        reference_key = str(uuid.uuid4())
+        
+        # Retries with the same key return the original job instead of running the pipeline again
+        # Only single submissions take a key: start_upload creates no job until complete_upload,
+        # and batch_submit reports per document which ones to send again
+        idempotency_key = get_idempotency_key(event, body, username)
+        if idempotency_key:
+            previous_reference_key = get_previous_submission(idempotency_key) or claim_idempotency_key(idempotency_key, reference_key)
+            if previous_reference_key:
+                return api_response(200, {
+                    'message': 'Request already submitted',
+                    'reference_key': previous_reference_key
+                })
+        
+        try:
+            item = create_submission(body, username, reference_key)
+        except Exception:
+            if idempotency_key:
+                # Let the client retry a submission that never produced a job
+                get_idempotency_table().delete_item(Key={'idempotency_key': idempotency_key})
+            raise
+        
+        # The job exists from here on and the claim keeps pointing at it, a retry after a
+        # failed enqueue gets this reference_key instead of creating a second job
+        enqueue_jobs([item])
+        
+        return api_response(200, {
+            'message': 'Request submitted successfully',
+            'reference_key': reference_key
+        })
+        
+    except ValueError as e:
+        # Malformed requests: bad JSON or numbers, missing fields, a bad Idempotency-Key, a key not handed out by start_upload
+        return api_response(400, {'error': str(e)})
     except Exception as e:
         return {
             'statusCode': 500,
             'headers': {'Access-Control-Allow-Origin': '*'},
             'body': json.dumps({'error': str(e)})
-        }
\ No newline at end of file
+        }
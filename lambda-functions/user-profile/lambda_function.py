@@ -1,15 +1,15 @@
 import json
-import boto3
 from datetime import datetime
+from tts_common.clients import get_table
 
-dynamodb = boto3.resource('dynamodb')
-table = dynamodb.Table('UserProfiles')
+PROFILES_TABLE = 'UserProfiles'
 
 def lambda_handler(event, context):
     try:
         user_id = event['requestContext']['authorizer']['claims']['sub']
         email = event['requestContext']['authorizer']['claims']['email']
         username = event['requestContext']['authorizer']['claims'].get('preferred_username', '')
+        table = get_table(PROFILES_TABLE)
         
         if event['httpMethod'] == 'POST':
             body = json.loads(event['body'])
@@ -0,0 +1,1748 @@
+#!/usr/bin/env python3
+"""
+In-process stand-ins for the AWS services used by lambda-functions/
+
+Used by the local tooling (profiling, benchmarks, emulator) to run the real
+handlers offline. Only the calls and expression syntax the handlers use are
+implemented, with the same response shapes and error codes as boto3.
+"""
+
+import base64
+import copy
+import hashlib
+import importlib.util
+import io
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from decimal import Decimal
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lambda-functions', 'common'))
+
+REGION = 'us-east-1'
+ACCOUNT_ID = '123456789012'
+
+
+def iso_timestamp(epoch=None):
+    """Event timestamp the way SNS and S3 notifications format it"""
+    epoch = time.time() if epoch is None else epoch
+    return time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(epoch)) + '.%03dZ' % (int(epoch * 1000) % 1000)
+
+
+class ClientError(Exception):
+    """Same shape as botocore.exceptions.ClientError"""
+
+    def __init__(self, code, message='', operation_name=''):
+        super().__init__(f'An error occurred ({code}) when calling the {operation_name} operation: {message}')
+        self.response = {'Error': {'Code': code, 'Message': message}}
+        self.operation_name = operation_name
+
+
+def error_class(code):
+    return type(code, (ClientError,), {'__init__': lambda self, message='', operation_name='': ClientError.__init__(self, code, message, operation_name)})
+
+
+class Exceptions:
+    ConditionalCheckFailedException = error_class('ConditionalCheckFailedException')
+    ClientError = ClientError
+    NoSuchKey = error_class('NoSuchKey')
+    NoSuchUpload = error_class('NoSuchUpload')
+    GoneException = error_class('GoneException')
+    ThrottlingException = error_class('ThrottlingException')
+    ServiceQuotaExceededException = error_class('ServiceQuotaExceededException')
+    TextLengthExceededException = error_class('TextLengthExceededException')
+    ResourceNotFoundException = error_class('ResourceNotFoundException')
+    ValidationException = error_class('ValidationException')
+    QueueDoesNotExist = error_class('AWS.SimpleQueueService.NonExistentQueue')
+    ReceiptHandleIsInvalid = error_class('ReceiptHandleIsInvalid')
+
+
+class StreamingBody:
+    def __init__(self, data):
+        self._stream = io.BytesIO(data)
+        self.length = len(data)
+
+    def read(self, amt=None):
+        return self._stream.read() if amt is None else self._stream.read(amt)
+
+    def iter_chunks(self, chunk_size=1024 * 1024):
+        while True:
+            chunk = self._stream.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+    def close(self):
+        pass
+
+
+class Behavior:
+    """
+    Latency, throttling and concurrency model for one fake service.
+
+    Throttled calls are retried with exponential backoff up to max_attempts
+    times, like the botocore retry config in tts_common.clients, before the
+    ThrottlingException reaches the handler.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, throttle_rate=0.0, max_concurrency=None, seed=None,
+                 max_attempts=None, base_backoff=0.05, max_backoff=2.0):
+        from tts_common.clients import MAX_ATTEMPTS
+        self.latency = latency
+        self.jitter = jitter
+        self.throttle_rate = throttle_rate
+        self.max_concurrency = max_concurrency
+        self.max_attempts = MAX_ATTEMPTS if max_attempts is None else max_attempts
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.calls = 0
+        self.throttled = 0
+        self.retries = 0
+
+    def enter(self, operation_name, extra_latency=0.0):
+        with self.lock:
+            self.calls += 1
+            over_limit = self.max_concurrency is not None and self.in_flight >= self.max_concurrency
+            throttled = over_limit or (self.throttle_rate and self.random.random() < self.throttle_rate)
+            if throttled:
+                self.throttled += 1
+            else:
+                self.in_flight += 1
+            delay = self.latency + extra_latency + (self.random.uniform(0, self.jitter) if self.jitter else 0.0)
+        if throttled:
+            raise Exceptions.ThrottlingException('Rate exceeded', operation_name)
+        if delay > 0:
+            time.sleep(delay)
+
+    def exit(self):
+        with self.lock:
+            self.in_flight -= 1
+
+    def call(self, operation_name, fn, extra_latency=0.0):
+        attempt = 1
+        while True:
+            try:
+                self.enter(operation_name, extra_latency)
+                break
+            except Exceptions.ThrottlingException:
+                if attempt >= self.max_attempts:
+                    raise
+                with self.lock:
+                    self.retries += 1
+                    backoff = self.random.uniform(0, min(self.max_backoff, self.base_backoff * 2 ** attempt))
+                time.sleep(backoff)
+                attempt += 1
+        try:
+            return fn()
+        finally:
+            self.exit()
+
+
+class FakeClient:
+    exceptions = Exceptions
+
+    def __init__(self, behavior=None):
+        self.behavior = behavior or Behavior()
+        self.meta = type('Meta', (), {'region_name': REGION, 'client': self})()
+
+
+# DynamoDB expressions
+
+def to_dynamo(value):
+    """Store values the way boto3 returns them: numbers as Decimal, containers copied"""
+    if isinstance(value, bool) or value is None or isinstance(value, (str, bytes, Decimal)):
+        return value
+    if isinstance(value, int):
+        return Decimal(value)
+    if isinstance(value, float):
+        raise TypeError('Float types are not supported. Use Decimal types instead.')
+    if isinstance(value, dict):
+        return {k: to_dynamo(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_dynamo(v) for v in value]
+    if isinstance(value, (set, frozenset)):
+        return {to_dynamo(v) for v in value}
+    return value
+
+
+def serialize(value):
+    """Python value to DynamoDB JSON, as found in stream records"""
+    if value is None:
+        return {'NULL': True}
+    if isinstance(value, bool):
+        return {'BOOL': value}
+    if isinstance(value, (int, Decimal)):
+        return {'N': str(value)}
+    if isinstance(value, str):
+        return {'S': value}
+    if isinstance(value, bytes):
+        return {'B': base64.b64encode(value).decode('ascii')}
+    if isinstance(value, dict):
+        return {'M': {k: serialize(v) for k, v in value.items()}}
+    if isinstance(value, (list, tuple)):
+        return {'L': [serialize(v) for v in value]}
+    if isinstance(value, (set, frozenset)):
+        values = list(value)
+        if values and isinstance(values[0], str):
+            return {'SS': sorted(values)}
+        return {'NS': sorted(str(v) for v in values)}
+    raise TypeError(f'Unsupported type {type(value)}')
+
+
+TOKEN_RE = re.compile(r'\s*(?:(<>|<=|>=|[=<>(),.\[\]+-])|(#[A-Za-z0-9_]+)|(:[A-Za-z0-9_]+)|([A-Za-z_][A-Za-z0-9_]*)|(\d+))')
+KEYWORDS = {'AND', 'OR', 'NOT', 'IN', 'BETWEEN', 'SET', 'REMOVE', 'ADD', 'DELETE'}
+# Subset of the DynamoDB reserved words that attribute names in this project could collide with
+RESERVED_WORDS = {
+    'COUNT', 'DATA', 'DATE', 'HASH', 'INDEX', 'KEY', 'LANGUAGE', 'LEVEL', 'NAME', 'ORDER',
+    'PERCENT', 'RANGE', 'SIZE', 'STATUS', 'TEXT', 'TIME', 'TIMESTAMP', 'TTL', 'USER', 'VALUE'
+}
+MISSING = object()
+
+
+class Expression:
+    def __init__(self, text, names=None, values=None):
+        self.tokens = []
+        pos = 0
+        text = text.strip()
+        while pos < len(text):
+            match = TOKEN_RE.match(text, pos)
+            if not match:
+                raise Exceptions.ValidationException(f'Invalid expression near: {text[pos:]}')
+            op, name, value, word, number = match.groups()
+            if op:
+                self.tokens.append(('op', op))
+            elif name:
+                if name not in (names or {}):
+                    raise Exceptions.ValidationException(f'Undefined attribute name {name}')
+                self.tokens.append(('name', names[name]))
+            elif value:
+                if value not in (values or {}):
+                    raise Exceptions.ValidationException(f'Undefined attribute value {value}')
+                self.tokens.append(('value', to_dynamo(values[value])))
+            elif word:
+                if word.upper() in KEYWORDS:
+                    self.tokens.append(('kw', word.upper()))
+                elif word.upper() in RESERVED_WORDS and not text[match.end():].lstrip().startswith('('):
+                    raise Exceptions.ValidationException(f'Attribute name is a reserved keyword; reserved keyword: {word}')
+                else:
+                    self.tokens.append(('name', word))
+            else:
+                self.tokens.append(('int', int(number)))
+            pos = match.end()
+        self.pos = 0
+
+    def peek(self, offset=0):
+        index = self.pos + offset
+        return self.tokens[index] if index < len(self.tokens) else (None, None)
+
+    def take(self, kind=None, text=None):
+        token = self.peek()
+        if (kind and token[0] != kind) or (text and token[1] != text):
+            raise Exceptions.ValidationException(f'Unexpected token {token} in expression')
+        self.pos += 1
+        return token
+
+    def at(self, kind, text=None):
+        token = self.peek()
+        return token[0] == kind and (text is None or token[1] == text)
+
+    # Paths are lists of str (map keys) and int (list indexes)
+    def path(self):
+        path = [self.take('name')[1]]
+        while self.at('op', '.') or self.at('op', '['):
+            if self.take('op')[1] == '.':
+                path.append(self.take('name')[1])
+            else:
+                path.append(self.take('int')[1])
+                self.take('op', ']')
+        return path
+
+    def operand(self):
+        token = self.peek()
+        if token[0] == 'value':
+            self.pos += 1
+            return ('value', token[1])
+        if token[0] == 'name' and self.peek(1) == ('op', '('):
+            function = token[1]
+            self.pos += 2
+            args = [self.operand()]
+            while self.at('op', ','):
+                self.pos += 1
+                args.append(self.operand())
+            self.take('op', ')')
+            return ('call', function, args)
+        return ('path', self.path())
+
+    def value_expression(self):
+        left = self.operand()
+        if self.at('op', '+') or self.at('op', '-'):
+            op = self.take('op')[1]
+            return ('arith', op, left, self.operand())
+        return left
+
+    def condition(self):
+        node = self.and_condition()
+        while self.at('kw', 'OR'):
+            self.pos += 1
+            node = ('or', node, self.and_condition())
+        return node
+
+    def and_condition(self):
+        node = self.not_condition()
+        while self.at('kw', 'AND'):
+            self.pos += 1
+            node = ('and', node, self.not_condition())
+        return node
+
+    def not_condition(self):
+        if self.at('kw', 'NOT'):
+            self.pos += 1
+            return ('not', self.not_condition())
+        if self.at('op', '('):
+            self.pos += 1
+            node = self.condition()
+            self.take('op', ')')
+            return node
+        left = self.operand()
+        if left[0] == 'call' and left[1] != 'size':
+            return ('test', left)
+        if self.at('kw', 'BETWEEN'):
+            self.pos += 1
+            low = self.operand()
+            self.take('kw', 'AND')
+            return ('between', left, low, self.operand())
+        if self.at('kw', 'IN'):
+            self.pos += 1
+            self.take('op', '(')
+            options = [self.operand()]
+            while self.at('op', ','):
+                self.pos += 1
+                options.append(self.operand())
+            self.take('op', ')')
+            return ('in', left, options)
+        op = self.take('op')[1]
+        if op not in ('=', '<>', '<', '<=', '>', '>='):
+            raise Exceptions.ValidationException(f'Unknown comparator {op}')
+        return ('compare', op, left, self.operand())
+
+    def parse_condition(self):
+        node = self.condition()
+        if self.pos != len(self.tokens):
+            raise Exceptions.ValidationException('Trailing tokens in condition')
+        return node
+
+    def parse_update(self):
+        actions = []
+        while self.pos < len(self.tokens):
+            clause = self.take('kw')[1]
+            while True:
+                if clause == 'SET':
+                    path = self.path()
+                    self.take('op', '=')
+                    actions.append(('SET', path, self.value_expression()))
+                elif clause == 'REMOVE':
+                    actions.append(('REMOVE', self.path(), None))
+                elif clause in ('ADD', 'DELETE'):
+                    path = self.path()
+                    actions.append((clause, path, self.operand()))
+                else:
+                    raise Exceptions.ValidationException(f'Unknown update clause {clause}')
+                if not self.at('op', ','):
+                    break
+                self.pos += 1
+        return actions
+
+
+def get_path(item, path):
+    value = item
+    for part in path:
+        if isinstance(part, int):
+            if not isinstance(value, list) or part >= len(value):
+                return MISSING
+            value = value[part]
+        else:
+            if not isinstance(value, dict) or part not in value:
+                return MISSING
+            value = value[part]
+    return value
+
+
+def set_path(item, path, value):
+    target = item
+    for part in path[:-1]:
+        target = target[part]
+    if isinstance(path[-1], int) and path[-1] >= len(target):
+        target.append(value)
+    else:
+        target[path[-1]] = value
+
+
+def remove_path(item, path):
+    target = get_path(item, path[:-1]) if len(path) > 1 else item
+    if isinstance(target, dict):
+        target.pop(path[-1], None)
+    elif isinstance(target, list) and path[-1] < len(target):
+        del target[path[-1]]
+
+
+def evaluate_operand(node, item):
+    kind = node[0]
+    if kind == 'value':
+        return node[1]
+    if kind == 'path':
+        return get_path(item, node[1])
+    if kind == 'arith':
+        left, right = evaluate_operand(node[2], item), evaluate_operand(node[3], item)
+        if left is MISSING or right is MISSING:
+            raise Exceptions.ValidationException('An operand in the update expression does not exist')
+        return left + right if node[1] == '+' else left - right
+    function, args = node[1], node[2]
+    if function == 'if_not_exists':
+        value = evaluate_operand(args[0], item)
+        return evaluate_operand(args[1], item) if value is MISSING else value
+    if function == 'list_append':
+        return list(evaluate_operand(args[0], item)) + list(evaluate_operand(args[1], item))
+    if function == 'size':
+        value = evaluate_operand(args[0], item)
+        return MISSING if value is MISSING else Decimal(len(value))
+    raise Exceptions.ValidationException(f'Unsupported function {function}')
+
+
+def evaluate_condition(node, item):
+    kind = node[0]
+    if kind == 'or':
+        return evaluate_condition(node[1], item) or evaluate_condition(node[2], item)
+    if kind == 'and':
+        return evaluate_condition(node[1], item) and evaluate_condition(node[2], item)
+    if kind == 'not':
+        return not evaluate_condition(node[1], item)
+    if kind == 'test':
+        function, args = node[1][1], node[1][2]
+        value = evaluate_operand(args[0], item)
+        if function == 'attribute_exists':
+            return value is not MISSING
+        if function == 'attribute_not_exists':
+            return value is MISSING
+        if function == 'begins_with':
+            prefix = evaluate_operand(args[1], item)
+            return isinstance(value, str) and value.startswith(prefix)
+        if function == 'contains':
+            needle = evaluate_operand(args[1], item)
+            return value is not MISSING and needle in value
+        raise Exceptions.ValidationException(f'Unsupported function {function}')
+    if kind == 'in':
+        value = evaluate_operand(node[1], item)
+        return value is not MISSING and any(value == evaluate_operand(option, item) for option in node[2])
+    if kind == 'between':
+        value, low, high = (evaluate_operand(n, item) for n in node[1:])
+        return MISSING not in (value, low, high) and low <= value <= high
+    op, left, right = node[1], evaluate_operand(node[2], item), evaluate_operand(node[3], item)
+    if left is MISSING or right is MISSING:
+        return op == '<>' and not (left is MISSING and right is MISSING)
+    try:
+        return {
+            '=': lambda: left == right,
+            '<>': lambda: left != right,
+            '<': lambda: left < right,
+            '<=': lambda: left <= right,
+            '>': lambda: left > right,
+            '>=': lambda: left >= right
+        }[op]()
+    except TypeError:
+        return False
+
+
+def apply_update(item, actions):
+    # All operands see the item as it was before the update
+    before = copy.deepcopy(item)
+    for action, path, operand in actions:
+        if action == 'SET':
+            set_path(item, path, copy.deepcopy(evaluate_operand(operand, before)))
+        elif action == 'REMOVE':
+            remove_path(item, path)
+        elif action == 'ADD':
+            value = evaluate_operand(operand, before)
+            current = get_path(item, path)
+            if isinstance(value, set):
+                set_path(item, path, (set() if current is MISSING else set(current)) | value)
+            else:
+                set_path(item, path, (Decimal(0) if current is MISSING else current) + value)
+        elif action == 'DELETE':
+            current = get_path(item, path)
+            if current is not MISSING:
+                remaining = set(current) - evaluate_operand(operand, before)
+                if remaining:
+                    set_path(item, path, remaining)
+                else:
+                    remove_path(item, path)
+
+
+def project(item, projection, names):
+    if not projection:
+        return copy.deepcopy(item)
+    result = {}
+    for part in projection.split(','):
+        expression = Expression(part, names)
+        path = expression.path()
+        value = get_path(item, path)
+        if value is not MISSING:
+            # Nested projections keep only the top-level attribute here, enough for the handlers
+            result[path[0]] = copy.deepcopy(item[path[0]])
+    return result
+
+
+def item_size(item):
+    return len(json.dumps(serialize(item), default=str))
+
+
+EXPRESSION_ARGUMENTS = [('KeyConditionExpression', True), ('FilterExpression', False), ('ConditionExpression', False)]
+
+
+def build_conditions(kwargs):
+    """
+    Turn boto3.dynamodb.conditions objects (Key, Attr) into expression strings
+    with placeholders, as the boto3 resource layer does before a request.
+    """
+    if all(isinstance(kwargs.get(name), (str, type(None))) for name, _ in EXPRESSION_ARGUMENTS):
+        return kwargs
+    from boto3.dynamodb.conditions import ConditionExpressionBuilder
+    builder = ConditionExpressionBuilder()
+    kwargs = dict(kwargs)
+    names = dict(kwargs.get('ExpressionAttributeNames') or {})
+    values = dict(kwargs.get('ExpressionAttributeValues') or {})
+    for name, is_key_condition in EXPRESSION_ARGUMENTS:
+        condition = kwargs.get(name)
+        if condition is None or isinstance(condition, str):
+            continue
+        built = builder.build_expression(condition, is_key_condition=is_key_condition)
+        kwargs[name] = built.condition_expression
+        names.update(built.attribute_name_placeholders)
+        values.update(built.attribute_value_placeholders)
+    kwargs['ExpressionAttributeNames'] = names
+    kwargs['ExpressionAttributeValues'] = values
+    return kwargs
+
+
+class FakeTable:
+    MAX_ITEM_SIZE = 400 * 1024
+
+    def __init__(self, database, name, hash_key='reference_key', range_key=None, indexes=None):
+        self.database = database
+        self.name = name
+        self.table_name = name
+        self.hash_key = hash_key
+        self.range_key = range_key
+        self.indexes = indexes or {}
+        self.items = {}
+        self.lock = threading.RLock()
+        self.stream_listeners = []
+        self.meta = type('Meta', (), {'client': database})()
+        self.write_count = 0
+        self.read_count = 0
+
+    def key_of(self, item):
+        try:
+            return (item[self.hash_key], item.get(self.range_key) if self.range_key else None)
+        except KeyError:
+            raise Exceptions.ValidationException('One of the required keys was not given a value')
+
+    def check_condition(self, current, kwargs, operation_name):
+        condition = kwargs.get('ConditionExpression')
+        if condition is None:
+            return
+        node = Expression(condition, kwargs.get('ExpressionAttributeNames'), kwargs.get('ExpressionAttributeValues')).parse_condition()
+        if not evaluate_condition(node, current or {}):
+            raise Exceptions.ConditionalCheckFailedException('The conditional request failed', operation_name)
+
+    def emit(self, event_name, key, old, new, user_identity=None):
+        if not self.stream_listeners:
+            return
+        record = {
+            'eventID': uuid.uuid4().hex,
+            'eventName': event_name,
+            'eventSource': 'aws:dynamodb',
+            'awsRegion': REGION,
+            'dynamodb': {
+                'ApproximateCreationDateTime': time.time(),
+                'Keys': {k: serialize(v) for k, v in key.items()},
+                'SequenceNumber': str(self.database.next_sequence_number()),
+                'SizeBytes': item_size(new or old or {}),
+                'StreamViewType': 'NEW_AND_OLD_IMAGES'
+            }
+        }
+        if new is not None:
+            record['dynamodb']['NewImage'] = {k: serialize(v) for k, v in new.items()}
+        if old is not None:
+            record['dynamodb']['OldImage'] = {k: serialize(v) for k, v in old.items()}
+        if user_identity:
+            record['userIdentity'] = user_identity
+        for listener in self.stream_listeners:
+            listener(record)
+
+    def key_dict(self, item):
+        key = {self.hash_key: item[self.hash_key]}
+        if self.range_key:
+            key[self.range_key] = item[self.range_key]
+        return key
+
+    def put_item(self, Item, **kwargs):
+        kwargs = build_conditions(kwargs)
+
+        def put():
+            item = to_dynamo(copy.deepcopy(Item))
+            if item_size(item) > self.MAX_ITEM_SIZE:
+                raise Exceptions.ValidationException('Item size has exceeded the maximum allowed size', 'PutItem')
+            with self.lock:
+                key = self.key_of(item)
+                old = self.items.get(key)
+                self.check_condition(old, kwargs, 'PutItem')
+                self.items[key] = item
+                self.write_count += 1
+                self.emit('MODIFY' if old else 'INSERT', self.key_dict(item), copy.deepcopy(old) if old else None, copy.deepcopy(item))
+            return {'Attributes': old} if old and kwargs.get('ReturnValues') == 'ALL_OLD' else {}
+        return self.database.behavior.call('PutItem', put)
+
+    def get_item(self, Key, ProjectionExpression=None, ExpressionAttributeNames=None, ConsistentRead=False):
+        def get():
+            with self.lock:
+                self.read_count += 1
+                item = self.items.get(self.key_of(Key))
+                return {'Item': project(item, ProjectionExpression, ExpressionAttributeNames)} if item else {}
+        return self.database.behavior.call('GetItem', get)
+
+    def update_item(self, Key, UpdateExpression, **kwargs):
+        kwargs = build_conditions(kwargs)
+
+        def update():
+            actions = Expression(UpdateExpression, kwargs.get('ExpressionAttributeNames'), kwargs.get('ExpressionAttributeValues')).parse_update()
+            with self.lock:
+                key = self.key_of(Key)
+                old = self.items.get(key)
+                self.check_condition(old, kwargs, 'UpdateItem')
+                item = copy.deepcopy(old) if old else to_dynamo(dict(Key))
+                apply_update(item, actions)
+                if item_size(item) > self.MAX_ITEM_SIZE:
+                    raise Exceptions.ValidationException('Item size to update has exceeded the maximum allowed size', 'UpdateItem')
+                self.items[key] = item
+                self.write_count += 1
+                if item != old:
+                    self.emit('MODIFY' if old else 'INSERT', to_dynamo(dict(Key)), copy.deepcopy(old) if old else None, copy.deepcopy(item))
+                return_values = kwargs.get('ReturnValues', 'NONE')
+                if return_values == 'ALL_NEW':
+                    return {'Attributes': copy.deepcopy(item)}
+                if return_values == 'ALL_OLD':
+                    return {'Attributes': copy.deepcopy(old or {})}
+                if return_values == 'UPDATED_NEW':
+                    return {'Attributes': {path[0]: copy.deepcopy(item[path[0]]) for _, path, _ in actions if path[0] in item}}
+                return {}
+        return self.database.behavior.call('UpdateItem', update)
+
+    def delete_item(self, Key, **kwargs):
+        kwargs = build_conditions(kwargs)
+
+        def delete():
+            with self.lock:
+                key = self.key_of(Key)
+                old = self.items.get(key)
+                self.check_condition(old, kwargs, 'DeleteItem')
+                if old is not None:
+                    del self.items[key]
+                    self.write_count += 1
+                    self.emit('REMOVE', to_dynamo(dict(Key)), copy.deepcopy(old), None)
+            return {}
+        return self.database.behavior.call('DeleteItem', delete)
+
+    def filtered(self, items, kwargs, key_condition=None):
+        names, values = kwargs.get('ExpressionAttributeNames'), kwargs.get('ExpressionAttributeValues')
+        conditions = [Expression(text, names, values).parse_condition() for text in (key_condition, kwargs.get('FilterExpression')) if text]
+        result = [item for item in items if all(evaluate_condition(node, item) for node in conditions)]
+        return [project(item, kwargs.get('ProjectionExpression'), names) for item in result]
+
+    def scan(self, **kwargs):
+        kwargs = build_conditions(kwargs)
+
+        def scan():
+            with self.lock:
+                items = list(self.items.values())
+                self.read_count += 1
+            result = self.filtered(items, kwargs)
+            return {'Items': result, 'Count': len(result), 'ScannedCount': len(items)}
+        return self.database.behavior.call('Scan', scan)
+
+    def query(self, KeyConditionExpression, IndexName=None, **kwargs):
+        kwargs = build_conditions(dict(kwargs, KeyConditionExpression=KeyConditionExpression))
+
+        def query():
+            with self.lock:
+                items = list(self.items.values())
+                self.read_count += 1
+            if IndexName:
+                index_key = self.indexes[IndexName]
+                items = [item for item in items if index_key in item]
+            if self.range_key:
+                items.sort(key=lambda item: str(item.get(self.range_key, '')), reverse=not kwargs.get('ScanIndexForward', True))
+            result = self.filtered(items, kwargs, kwargs['KeyConditionExpression'])
+            return {'Items': result, 'Count': len(result), 'ScannedCount': len(items)}
+        return self.database.behavior.call('Query', query)
+
+    def batch_writer(self, overwrite_by_pkeys=None):
+        table = self
+
+        class BatchWriter:
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc_info):
+                return False
+
+            def put_item(self, Item):
+                table.put_item(Item=Item)
+
+            def delete_item(self, Key):
+                table.delete_item(Key=Key)
+
+        return BatchWriter()
+
+    def expire_items(self, now=None, attribute='ExpiresAt'):
+        """Run a TTL sweep, deleting expired items with the same stream records as DynamoDB TTL"""
+        now = now if now is not None else time.time()
+        with self.lock:
+            expired = [(key, item) for key, item in self.items.items() if attribute in item and item[attribute] < now]
+            for key, item in expired:
+                del self.items[key]
+                self.emit('REMOVE', self.key_dict(item), copy.deepcopy(item), None, user_identity={
+                    'type': 'Service',
+                    'principalId': 'dynamodb.amazonaws.com'
+                })
+        return len(expired)
+
+
+class FakeDynamoDB(FakeClient):
+    """Stands in for both boto3.resource('dynamodb') and its client"""
+
+    BATCH_WRITE_LIMIT = 25
+    BATCH_GET_LIMIT = 100
+
+    def __init__(self, behavior=None, unprocessed_rate=0.0, seed=None):
+        super().__init__(behavior)
+        self.tables = {}
+        self.unprocessed_rate = unprocessed_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.sequence_number = 0
+
+    def next_sequence_number(self):
+        with self.lock:
+            self.sequence_number += 1
+            return self.sequence_number
+
+    def create_table(self, name, hash_key='reference_key', range_key=None, indexes=None):
+        self.tables[name] = FakeTable(self, name, hash_key, range_key, indexes)
+        return self.tables[name]
+
+    def Table(self, name):
+        if name not in self.tables:
+            raise Exceptions.ResourceNotFoundException(f'Requested resource not found: Table: {name} not found')
+        return self.tables[name]
+
+    def unprocessed(self):
+        return self.unprocessed_rate and self.random.random() < self.unprocessed_rate
+
+    def batch_get_item(self, RequestItems):
+        responses, unprocessed = {}, {}
+        for name, request in RequestItems.items():
+            keys = request['Keys']
+            if len(keys) > self.BATCH_GET_LIMIT or len({json.dumps(k, sort_keys=True, default=str) for k in keys}) != len(keys):
+                raise Exceptions.ValidationException('Too many or duplicate keys in BatchGetItem', 'BatchGetItem')
+            table = self.Table(name)
+            for key in keys:
+                if self.unprocessed():
+                    unprocessed.setdefault(name, dict(request, Keys=[]))['Keys'].append(key)
+                    continue
+                response = table.get_item(Key=key, ProjectionExpression=request.get('ProjectionExpression'),
+                                          ExpressionAttributeNames=request.get('ExpressionAttributeNames'))
+                if 'Item' in response:
+                    responses.setdefault(name, []).append(response['Item'])
+        return {'Responses': responses, 'UnprocessedKeys': unprocessed}
+
+    def batch_write_item(self, RequestItems):
+        if sum(len(requests) for requests in RequestItems.values()) > self.BATCH_WRITE_LIMIT:
+            raise Exceptions.ValidationException('Too many items requested for the BatchWriteItem call', 'BatchWriteItem')
+        unprocessed = {}
+        for name, requests in RequestItems.items():
+            table = self.Table(name)
+            for request in requests:
+                if self.unprocessed():
+                    unprocessed.setdefault(name, []).append(request)
+                elif 'PutRequest' in request:
+                    table.put_item(Item=request['PutRequest']['Item'])
+                else:
+                    table.delete_item(Key=request['DeleteRequest']['Key'])
+        return {'UnprocessedItems': unprocessed}
+
+
+# S3
+
+class FakeS3(FakeClient):
+    MIN_PART_SIZE = 5 * 1024 * 1024
+
+    def __init__(self, behavior=None):
+        super().__init__(behavior)
+        self.buckets = {}
+        self.uploads = {}
+        self.lock = threading.RLock()
+        self.notifications = []
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def create_bucket(self, Bucket):
+        self.buckets.setdefault(Bucket, {})
+        return {}
+
+    def objects(self, bucket):
+        if bucket not in self.buckets:
+            raise ClientError('NoSuchBucket', 'The specified bucket does not exist')
+        return self.buckets[bucket]
+
+    def add_notification(self, callback, prefix='', suffix='', events=('ObjectCreated:*',)):
+        """callback(record) for matching object events, same record shape as S3 notifications"""
+        self.notifications.append((callback, prefix, suffix, events))
+
+    def notify(self, bucket, key, event_name, size):
+        for callback, prefix, suffix, events in self.notifications:
+            if not (key.startswith(prefix) and key.endswith(suffix)):
+                continue
+            if not any(event_name == pattern or (pattern.endswith('*') and event_name.startswith(pattern[:-1])) for pattern in events):
+                continue
+            callback({
+                'eventVersion': '2.1',
+                'eventSource': 'aws:s3',
+                'awsRegion': REGION,
+                'eventTime': iso_timestamp(),
+                'eventName': event_name,
+                's3': {
+                    'bucket': {'name': bucket, 'arn': f'arn:aws:s3:::{bucket}'},
+                    'object': {'key': key.replace(' ', '+'), 'size': size}
+                }
+            })
+
+    def store(self, bucket, key, body, content_type=None, metadata=None, event_name='ObjectCreated:Put'):
+        body = body.encode('utf-8') if isinstance(body, str) else bytes(body)
+        obj = {
+            'Body': body,
+            'ContentType': content_type or 'binary/octet-stream',
+            'Metadata': dict(metadata or {}),
+            'ETag': '"%s"' % hashlib.md5(body).hexdigest(),
+            'LastModified': time.time()
+        }
+        with self.lock:
+            self.objects(bucket)[key] = obj
+            self.bytes_in += len(body)
+        self.notify(bucket, key, event_name, len(body))
+        return obj
+
+    def get(self, bucket, key):
+        with self.lock:
+            obj = self.objects(bucket).get(key)
+        if obj is None:
+            raise Exceptions.NoSuchKey('The specified key does not exist.', 'GetObject')
+        return obj
+
+    def put_object(self, Bucket, Key, Body=b'', ContentType=None, Metadata=None, **kwargs):
+        if hasattr(Body, 'read'):
+            Body = Body.read()
+        obj = self.behavior.call('PutObject', lambda: self.store(Bucket, Key, Body, ContentType, Metadata))
+        return {'ETag': obj['ETag']}
+
+    def get_object(self, Bucket, Key, Range=None, **kwargs):
+        def get():
+            obj = self.get(Bucket, Key)
+            body = obj['Body']
+            response = {'ContentType': obj['ContentType'], 'Metadata': dict(obj['Metadata']), 'ETag': obj['ETag']}
+            if Range:
+                start, end = Range.replace('bytes=', '').split('-')
+                start, end = int(start), min(int(end) if end else len(body) - 1, len(body) - 1)
+                body = body[start:end + 1]
+                response['ContentRange'] = f"bytes {start}-{end}/{len(obj['Body'])}"
+            with self.lock:
+                self.bytes_out += len(body)
+            response.update({'Body': StreamingBody(body), 'ContentLength': len(body)})
+            return response
+        return self.behavior.call('GetObject', get)
+
+    def head_object(self, Bucket, Key, **kwargs):
+        def head():
+            try:
+                obj = self.get(Bucket, Key)
+            except ClientError:
+                raise ClientError('404', 'Not Found', 'HeadObject')
+            return {'ContentLength': len(obj['Body']), 'ContentType': obj['ContentType'],
+                    'Metadata': dict(obj['Metadata']), 'ETag': obj['ETag']}
+        return self.behavior.call('HeadObject', head)
+
+    def copy_object(self, Bucket, Key, CopySource, ContentType=None, MetadataDirective='COPY', Metadata=None, **kwargs):
+        def copy_():
+            source = self.get(CopySource['Bucket'], CopySource['Key'])
+            if MetadataDirective == 'REPLACE':
+                obj = self.store(Bucket, Key, source['Body'], ContentType, Metadata, 'ObjectCreated:Copy')
+            else:
+                obj = self.store(Bucket, Key, source['Body'], source['ContentType'], source['Metadata'], 'ObjectCreated:Copy')
+            return {'CopyObjectResult': {'ETag': obj['ETag']}}
+        return self.behavior.call('CopyObject', copy_)
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        def delete():
+            with self.lock:
+                self.objects(Bucket).pop(Key, None)
+            return {}
+        return self.behavior.call('DeleteObject', delete)
+
+    def delete_objects(self, Bucket, Delete, **kwargs):
+        def delete():
+            if len(Delete['Objects']) > 1000:
+                raise ClientError('MalformedXML', 'More than 1000 keys in one DeleteObjects request', 'DeleteObjects')
+            with self.lock:
+                objects = self.objects(Bucket)
+                for obj in Delete['Objects']:
+                    objects.pop(obj['Key'], None)
+            return {'Deleted': [{'Key': obj['Key']} for obj in Delete['Objects']]}
+        return self.behavior.call('DeleteObjects', delete)
+
+    def list_objects_v2(self, Bucket, Prefix='', MaxKeys=1000, ContinuationToken=None, StartAfter=None, **kwargs):
+        def list_():
+            with self.lock:
+                keys = sorted(key for key in self.objects(Bucket) if key.startswith(Prefix))
+                objects = self.objects(Bucket)
+                after = ContinuationToken or StartAfter
+                if after:
+                    keys = [key for key in keys if key > after]
+                page = keys[:MaxKeys]
+                response = {
+                    'KeyCount': len(page),
+                    'IsTruncated': len(keys) > MaxKeys,
+                    'Prefix': Prefix
+                }
+                if page:
+                    response['Contents'] = [
+                        {'Key': key, 'Size': len(objects[key]['Body']), 'ETag': objects[key]['ETag']}
+                        for key in page
+                    ]
+                if response['IsTruncated']:
+                    response['NextContinuationToken'] = page[-1]
+                return response
+        return self.behavior.call('ListObjectsV2', list_)
+
+    def get_paginator(self, operation_name):
+        if operation_name != 'list_objects_v2':
+            raise NotImplementedError(operation_name)
+        s3 = self
+
+        class Paginator:
+            def paginate(self, **kwargs):
+                token = None
+                while True:
+                    page = s3.list_objects_v2(**kwargs, **({'ContinuationToken': token} if token else {}))
+                    yield page
+                    if not page.get('IsTruncated'):
+                        return
+                    token = page['NextContinuationToken']
+
+        return Paginator()
+
+    def download_fileobj(self, Bucket, Key, Fileobj, **kwargs):
+        Fileobj.write(self.get_object(Bucket=Bucket, Key=Key)['Body'].read())
+
+    def upload_fileobj(self, Fileobj, Bucket, Key, ExtraArgs=None, **kwargs):
+        extra = ExtraArgs or {}
+        self.put_object(Bucket=Bucket, Key=Key, Body=Fileobj.read(), ContentType=extra.get('ContentType'), Metadata=extra.get('Metadata'))
+
+    def generate_presigned_url(self, ClientMethod, Params=None, ExpiresIn=3600, **kwargs):
+        params = dict(Params or {})
+        bucket, key = params.pop('Bucket', ''), params.pop('Key', '')
+        query = '&'.join(f'{name}={value}' for name, value in sorted(params.items()))
+        signature = hashlib.sha256(f'{ClientMethod}{bucket}{key}{query}{time.time()}'.encode()).hexdigest()[:32]
+        return f'https://{bucket}.s3.{REGION}.amazonaws.com/{key}?{query}&X-Amz-Expires={ExpiresIn}&X-Amz-Signature={signature}'.replace('?&', '?')
+
+    def create_multipart_upload(self, Bucket, Key, ContentType=None, Metadata=None, **kwargs):
+        upload_id = uuid.uuid4().hex
+        with self.lock:
+            self.objects(Bucket)
+            self.uploads[upload_id] = {'Bucket': Bucket, 'Key': Key, 'ContentType': ContentType, 'Metadata': Metadata, 'Parts': {}}
+        return {'Bucket': Bucket, 'Key': Key, 'UploadId': upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body, **kwargs):
+        body = Body.read() if hasattr(Body, 'read') else bytes(Body)
+        with self.lock:
+            if UploadId not in self.uploads:
+                raise Exceptions.NoSuchUpload('The specified upload does not exist.', 'UploadPart')
+            etag = '"%s"' % hashlib.md5(body).hexdigest()
+            self.uploads[UploadId]['Parts'][PartNumber] = (etag, body)
+        return {'ETag': etag}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload, **kwargs):
+        with self.lock:
+            upload = self.uploads.pop(UploadId, None)
+        if upload is None or upload['Key'] != Key:
+            raise Exceptions.NoSuchUpload('The specified upload does not exist.', 'CompleteMultipartUpload')
+        parts = MultipartUpload['Parts']
+        body = b''
+        for index, part in enumerate(parts):
+            etag, data = upload['Parts'].get(part['PartNumber'], (None, None))
+            if etag != part['ETag']:
+                raise ClientError('InvalidPart', 'One or more of the specified parts could not be found.', 'CompleteMultipartUpload')
+            if index < len(parts) - 1 and len(data) < self.MIN_PART_SIZE:
+                raise ClientError('EntityTooSmall', 'Your proposed upload is smaller than the minimum allowed size', 'CompleteMultipartUpload')
+            body += data
+        self.store(Bucket, Key, body, upload['ContentType'], upload['Metadata'], 'ObjectCreated:CompleteMultipartUpload')
+        return {'Bucket': Bucket, 'Key': Key}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId, **kwargs):
+        with self.lock:
+            self.uploads.pop(UploadId, None)
+        return {}
+
+
+# Messaging and model services
+
+class FakeSNS(FakeClient):
+    def __init__(self, behavior=None):
+        super().__init__(behavior)
+        self.subscribers = {}
+        self.published = 0
+
+    def subscribe_callback(self, topic_name, callback):
+        """callback(record) for every message published to topic_name, same record shape as SNS events"""
+        self.subscribers.setdefault(topic_name, []).append(callback)
+
+    def subscribe_queue(self, topic_name, sqs, queue_url, raw_message_delivery=True):
+        """SNS -> SQS subscription, with raw delivery the body is the published message itself"""
+        def deliver(record):
+            body = record['Sns']['Message'] if raw_message_delivery else json.dumps(dict(record['Sns'], Type='Notification'))
+            sqs.send_message(QueueUrl=queue_url, MessageBody=body)
+        self.subscribe_callback(topic_name, deliver)
+
+    def publish(self, TopicArn, Message, **kwargs):
+        def publish():
+            message_id = str(uuid.uuid4())
+            self.published += 1
+            for callback in self.subscribers.get(TopicArn.split(':')[-1], []):
+                callback({
+                    'EventSource': 'aws:sns',
+                    'Sns': {'MessageId': message_id, 'TopicArn': TopicArn, 'Message': Message, 'Timestamp': iso_timestamp()}
+                })
+            return {'MessageId': message_id}
+        return self.behavior.call('Publish', publish)
+
+
+class FakeBedrock(FakeClient):
+    """
+    bedrock-runtime invoke_model for the Claude messages API.
+
+    Page images produced by render_fake_pdf carry their text, which is returned
+    as the OCR result. Other images return filler text of ocr_chars characters.
+    """
+
+    def __init__(self, behavior=None, latency_per_output_token=0.0, ocr_chars=1500):
+        super().__init__(behavior)
+        self.latency_per_output_token = latency_per_output_token
+        self.ocr_chars = ocr_chars
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.lock = threading.Lock()
+
+    def invoke_model(self, modelId, body, **kwargs):
+        request = json.loads(body)
+        image = b''
+        for content in request['messages'][0]['content']:
+            if content['type'] == 'image':
+                image = base64.b64decode(content['source']['data'])
+        text = page_text_from_image(image) if image.startswith(FAKE_PNG_HEADER) else filler_text(self.ocr_chars, len(image))
+        text = text[:request.get('max_tokens', 1000) * 4]
+        usage = {'input_tokens': 1500 + len(image) // 1000, 'output_tokens': max(1, len(text) // 4)}
+
+        def invoke():
+            with self.lock:
+                self.input_tokens += usage['input_tokens']
+                self.output_tokens += usage['output_tokens']
+            return {
+                'body': StreamingBody(json.dumps({
+                    'id': f'msg_{uuid.uuid4().hex}',
+                    'type': 'message',
+                    'role': 'assistant',
+                    'content': [{'type': 'text', 'text': text}],
+                    'stop_reason': 'end_turn',
+                    'usage': usage
+                }).encode('utf-8')),
+                'contentType': 'application/json'
+            }
+        return self.behavior.call('InvokeModel', invoke, usage['output_tokens'] * self.latency_per_output_token)
+
+
+class FakePolly(FakeClient):
+    # synthesize_speech accepts at most 3,000 billed characters per request
+    MAX_CHARS = 3000
+    AUDIO_BYTES_PER_CHAR = 100
+
+    def __init__(self, behavior=None, latency_per_char=0.0):
+        super().__init__(behavior)
+        self.latency_per_char = latency_per_char
+        self.characters = 0
+        self.lock = threading.Lock()
+
+    def synthesize_speech(self, Text, OutputFormat, VoiceId, **kwargs):
+        if len(Text) > self.MAX_CHARS:
+            raise Exceptions.TextLengthExceededException('Maximum text length has been exceeded', 'SynthesizeSpeech')
+
+        def synthesize():
+            with self.lock:
+                self.characters += len(Text)
+            audio = hashlib.sha256(Text.encode('utf-8')).digest() * (len(Text) * self.AUDIO_BYTES_PER_CHAR // 32 + 1)
+            return {
+                'AudioStream': StreamingBody(audio[:len(Text) * self.AUDIO_BYTES_PER_CHAR]),
+                'ContentType': 'audio/mpeg',
+                'RequestCharacters': len(Text)
+            }
+        return self.behavior.call('SynthesizeSpeech', synthesize, len(Text) * self.latency_per_char)
+
+
+class FakeApiGatewayManagement(FakeClient):
+    def __init__(self, behavior=None):
+        super().__init__(behavior)
+        self.connections = {}
+
+    def connect(self, connection_id):
+        self.connections[connection_id] = []
+
+    def post_to_connection(self, ConnectionId, Data):
+        if ConnectionId not in self.connections:
+            raise Exceptions.GoneException('Connection is gone', 'PostToConnection')
+        self.connections[ConnectionId].append(Data)
+        return {}
+
+
+class FakeSQS(FakeClient):
+    """
+    Standard queues with visibility timeouts, long polling and redrive to a
+    dead-letter queue after maxReceiveCount receives.
+    """
+
+    def __init__(self, behavior=None):
+        super().__init__(behavior)
+        self.queues = {}
+        self.condition = threading.Condition()
+
+    def queue_url(self, name):
+        return f'https://sqs.{REGION}.amazonaws.com/{ACCOUNT_ID}/{name}'
+
+    def create_queue(self, QueueName, Attributes=None, **kwargs):
+        url = self.queue_url(QueueName)
+        with self.condition:
+            if url not in self.queues:
+                attributes = {'VisibilityTimeout': '30'}
+                attributes.update(Attributes or {})
+                self.queues[url] = {'name': QueueName, 'attributes': attributes, 'messages': []}
+        return {'QueueUrl': url}
+
+    def get_queue_url(self, QueueName, **kwargs):
+        url = self.queue_url(QueueName)
+        if url not in self.queues:
+            raise Exceptions.QueueDoesNotExist('The specified queue does not exist', 'GetQueueUrl')
+        return {'QueueUrl': url}
+
+    def queue_arn(self, url):
+        return f"arn:aws:sqs:{REGION}:{ACCOUNT_ID}:{url.rsplit('/', 1)[-1]}"
+
+    def notification_target(self, queue_url):
+        """FakeS3.add_notification callback delivering events to a queue, like an S3 QueueConfiguration"""
+        return lambda record: self.send_message(QueueUrl=queue_url, MessageBody=json.dumps({'Records': [record]}))
+
+    def queue(self, url, operation_name):
+        if url not in self.queues:
+            raise Exceptions.QueueDoesNotExist('The specified queue does not exist', operation_name)
+        return self.queues[url]
+
+    def enqueue(self, queue, body, delay=0, attributes=None):
+        message = {
+            'MessageId': str(uuid.uuid4()),
+            'Body': body,
+            'MD5OfBody': hashlib.md5(body.encode('utf-8')).hexdigest(),
+            'MessageAttributes': attributes or {},
+            'visible_at': time.time() + delay,
+            'receive_count': 0,
+            'sent_at': time.time(),
+            'receipt_handle': None
+        }
+        queue['messages'].append(message)
+        self.condition.notify_all()
+        return message
+
+    def send_message(self, QueueUrl, MessageBody, DelaySeconds=0, MessageAttributes=None, **kwargs):
+        def send():
+            with self.condition:
+                message = self.enqueue(self.queue(QueueUrl, 'SendMessage'), MessageBody, DelaySeconds, MessageAttributes)
+            return {'MessageId': message['MessageId'], 'MD5OfMessageBody': message['MD5OfBody']}
+        return self.behavior.call('SendMessage', send)
+
+    def send_message_batch(self, QueueUrl, Entries, **kwargs):
+        if len(Entries) > 10:
+            raise Exceptions.ValidationException('Maximum number of entries per request are 10', 'SendMessageBatch')
+
+        def send():
+            with self.condition:
+                queue = self.queue(QueueUrl, 'SendMessageBatch')
+                successful = []
+                for entry in Entries:
+                    message = self.enqueue(queue, entry['MessageBody'], entry.get('DelaySeconds', 0), entry.get('MessageAttributes'))
+                    successful.append({'Id': entry['Id'], 'MessageId': message['MessageId']})
+            return {'Successful': successful, 'Failed': []}
+        return self.behavior.call('SendMessageBatch', send)
+
+    def take_visible(self, queue, limit, visibility_timeout):
+        now = time.time()
+        max_receives, dead_letter_url = None, None
+        if 'RedrivePolicy' in queue['attributes']:
+            policy = json.loads(queue['attributes']['RedrivePolicy'])
+            max_receives = int(policy['maxReceiveCount'])
+            dead_letter_url = self.queue_url(policy['deadLetterTargetArn'].split(':')[-1])
+        received = []
+        for message in list(queue['messages']):
+            if len(received) >= limit:
+                break
+            if message['visible_at'] > now:
+                continue
+            if max_receives is not None and message['receive_count'] >= max_receives:
+                queue['messages'].remove(message)
+                if dead_letter_url in self.queues:
+                    message.update(visible_at=now, receive_count=0, receipt_handle=None)
+                    self.queues[dead_letter_url]['messages'].append(message)
+                continue
+            message['receive_count'] += 1
+            message['visible_at'] = now + visibility_timeout
+            message['receipt_handle'] = uuid.uuid4().hex
+            received.append({
+                'MessageId': message['MessageId'],
+                'ReceiptHandle': message['receipt_handle'],
+                'MD5OfBody': message['MD5OfBody'],
+                'Body': message['Body'],
+                'MessageAttributes': message['MessageAttributes'],
+                'Attributes': {
+                    'ApproximateReceiveCount': str(message['receive_count']),
+                    'SentTimestamp': str(int(message['sent_at'] * 1000))
+                }
+            })
+        return received
+
+    def receive_message(self, QueueUrl, MaxNumberOfMessages=1, WaitTimeSeconds=0, VisibilityTimeout=None, **kwargs):
+        def receive():
+            deadline = time.time() + WaitTimeSeconds
+            with self.condition:
+                queue = self.queue(QueueUrl, 'ReceiveMessage')
+                timeout = float(VisibilityTimeout if VisibilityTimeout is not None else queue['attributes']['VisibilityTimeout'])
+                while True:
+                    messages = self.take_visible(queue, min(10, MaxNumberOfMessages), timeout)
+                    remaining = deadline - time.time()
+                    if messages or remaining <= 0:
+                        return {'Messages': messages} if messages else {}
+                    # Wake up for new sends and for in-flight messages becoming visible again
+                    self.condition.wait(min(remaining, 0.05))
+        return self.behavior.call('ReceiveMessage', receive)
+
+    def find(self, queue, receipt_handle, operation_name):
+        for message in queue['messages']:
+            if message['receipt_handle'] == receipt_handle:
+                return message
+        raise Exceptions.ReceiptHandleIsInvalid('The input receipt handle is invalid', operation_name)
+
+    def delete_message(self, QueueUrl, ReceiptHandle, **kwargs):
+        def delete():
+            with self.condition:
+                queue = self.queue(QueueUrl, 'DeleteMessage')
+                queue['messages'].remove(self.find(queue, ReceiptHandle, 'DeleteMessage'))
+            return {}
+        return self.behavior.call('DeleteMessage', delete)
+
+    def delete_message_batch(self, QueueUrl, Entries, **kwargs):
+        def delete():
+            successful, failed = [], []
+            with self.condition:
+                queue = self.queue(QueueUrl, 'DeleteMessageBatch')
+                for entry in Entries:
+                    try:
+                        queue['messages'].remove(self.find(queue, entry['ReceiptHandle'], 'DeleteMessageBatch'))
+                        successful.append({'Id': entry['Id']})
+                    except ClientError as e:
+                        failed.append({'Id': entry['Id'], 'Code': e.response['Error']['Code'], 'SenderFault': True})
+            return {'Successful': successful, 'Failed': failed}
+        return self.behavior.call('DeleteMessageBatch', delete)
+
+    def change_message_visibility(self, QueueUrl, ReceiptHandle, VisibilityTimeout, **kwargs):
+        def change():
+            with self.condition:
+                queue = self.queue(QueueUrl, 'ChangeMessageVisibility')
+                self.find(queue, ReceiptHandle, 'ChangeMessageVisibility')['visible_at'] = time.time() + VisibilityTimeout
+                self.condition.notify_all()
+            return {}
+        return self.behavior.call('ChangeMessageVisibility', change)
+
+    def get_queue_attributes(self, QueueUrl, AttributeNames=None, **kwargs):
+        with self.condition:
+            queue = self.queue(QueueUrl, 'GetQueueAttributes')
+            now = time.time()
+            visible = sum(1 for message in queue['messages'] if message['visible_at'] <= now)
+            attributes = dict(queue['attributes'])
+            attributes.update({
+                'ApproximateNumberOfMessages': str(visible),
+                'ApproximateNumberOfMessagesNotVisible': str(len(queue['messages']) - visible),
+                'QueueArn': f"arn:aws:sqs:{REGION}:{ACCOUNT_ID}:{queue['name']}"
+            })
+        return {'Attributes': attributes}
+
+
+# Fake page rendering, used when pdf2image/poppler are not available
+
+FAKE_PDF_HEADER = b'%FAKEPDF\n'
+FAKE_PNG_HEADER = b'\x89FAKEPNG\n'
+
+
+def make_fake_pdf(pages):
+    """A document readable by render_fake_pdf, one text per page"""
+    return FAKE_PDF_HEADER + json.dumps(pages).encode('utf-8')
+
+
+def make_pdf(pages):
+    """A real, minimal PDF with one page of Helvetica text per entry, renderable by poppler"""
+    def escape(line):
+        return line.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+    objects = ['<< /Type /Catalog /Pages 2 0 R >>', None, '<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>']
+    page_ids = []
+    for text in pages:
+        lines = [text[i:i + 90] for i in range(0, len(text), 90)] or ['']
+        stream = 'BT /F1 10 Tf 12 TL 40 800 Td ' + ' '.join(f'({escape(line)}) Tj T*' for line in lines) + ' ET'
+        objects.append(f'<< /Length {len(stream.encode("latin-1", "replace"))} >>\nstream\n{stream}\nendstream')
+        objects.append(f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>')
+        page_ids.append(len(objects))
+    objects[1] = f'<< /Type /Pages /Kids [{" ".join(f"{i} 0 R" for i in page_ids)}] /Count {len(page_ids)} >>'
+
+    output = b'%PDF-1.4\n'
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += f'{number} 0 obj\n{body}\nendobj\n'.encode('latin-1', 'replace')
+    xref = len(output)
+    output += f'xref\n0 {len(objects) + 1}\n0000000000 65535 f \n'.encode()
+    output += b''.join(f'{offset:010d} 00000 n \n'.encode() for offset in offsets)
+    output += f'trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n'.encode()
+    return output
+
+
+def filler_text(length, seed=0):
+    words = ['the', 'speech', 'service', 'reads', 'every', 'page', 'of', 'this', 'document', 'aloud', 'with', 'care']
+    generator = random.Random(seed)
+    text = []
+    size = 0
+    while size < length:
+        word = generator.choice(words)
+        text.append(word)
+        size += len(word) + 1
+    return ' '.join(text)[:length]
+
+
+def page_text_from_image(image):
+    start = len(FAKE_PNG_HEADER) + 4
+    length = int.from_bytes(image[len(FAKE_PNG_HEADER):start], 'big')
+    return image[start:start + length].decode('utf-8')
+
+
+class FakePage:
+    def __init__(self, text, image_bytes=0):
+        self.text = text
+        self.image_bytes = image_bytes
+
+    def save(self, fp, format='PNG'):
+        text = self.text.encode('utf-8')
+        data = FAKE_PNG_HEADER + len(text).to_bytes(4, 'big') + text
+        # Padding to a realistic PNG size keeps upload and download volumes representative
+        fp.write(data + b'\0' * max(0, self.image_bytes - len(data)))
+
+
+def render_fake_pdf(path, first_page=None, last_page=None, image_bytes=0, **kwargs):
+    """Same signature as pdf2image.convert_from_path for documents made by make_fake_pdf"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    if not data.startswith(FAKE_PDF_HEADER):
+        raise ValueError('Not a document created by make_fake_pdf')
+    pages = json.loads(data[len(FAKE_PDF_HEADER):])
+    first_page = first_page or 1
+    last_page = min(last_page or len(pages), len(pages))
+    return [FakePage(text, image_bytes) for text in pages[first_page - 1:last_page]]
+
+
+def install_fake_pdf2image(render_latency=0.0, image_bytes=0):
+    """Register a pdf2image module backed by render_fake_pdf"""
+    import types
+
+    def convert_from_path(path, first_page=None, last_page=None, **kwargs):
+        pages = render_fake_pdf(path, first_page, last_page, image_bytes)
+        if render_latency:
+            time.sleep(render_latency * len(pages))
+        return pages
+
+    module = types.ModuleType('pdf2image')
+    module.convert_from_path = convert_from_path
+    sys.modules['pdf2image'] = module
+    return module
+
+
+# Wiring
+
+class LambdaContext:
+    def __init__(self, function_name, timeout=300):
+        self.function_name = function_name
+        self.invoked_function_arn = f'arn:aws:lambda:{REGION}:{ACCOUNT_ID}:function:{function_name}'
+        self.aws_request_id = str(uuid.uuid4())
+        self.memory_limit_in_mb = 1024
+        self.deadline = time.time() + timeout
+
+    def get_remaining_time_in_millis(self):
+        return max(0, int((self.deadline - time.time()) * 1000))
+
+
+class SQSEventSource:
+    """
+    Lambda's SQS event source mapping: polls a FakeSQS queue in batches with at
+    most max_concurrency invocations at a time, deletes the records the
+    handler did not list in batchItemFailures and leaves the others to become
+    visible again.
+    """
+
+    def __init__(self, sqs, queue_url, handler, function_name, batch_size=10, max_concurrency=2, batching_window=0.0):
+        self.sqs = sqs
+        self.queue_url = queue_url
+        self.handler = handler
+        self.function_name = function_name
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+        # MaximumBatchingWindowInSeconds: keep gathering a partial batch this long
+        self.batching_window = batching_window
+        # Messages gathered early in the window must not become visible again before the batch is handed over
+        queue_timeout = float(sqs.get_queue_attributes(QueueUrl=queue_url)['Attributes']['VisibilityTimeout'])
+        self.visibility_timeout = queue_timeout + batching_window
+        self.stopped = threading.Event()
+        self.threads = []
+        self.lock = threading.Lock()
+        self.invocations = 0
+        self.records_delivered = 0
+        self.record_failures = 0
+
+    def to_record(self, message):
+        return {
+            'messageId': message['MessageId'],
+            'receiptHandle': message['ReceiptHandle'],
+            'body': message['Body'],
+            'attributes': dict(message['Attributes'], ApproximateFirstReceiveTimestamp=str(int(time.time() * 1000))),
+            'messageAttributes': message.get('MessageAttributes', {}),
+            'md5OfBody': message['MD5OfBody'],
+            'eventSource': 'aws:sqs',
+            'eventSourceARN': self.sqs.queue_arn(self.queue_url),
+            'awsRegion': REGION
+        }
+
+    def poll_once(self, wait=0.05):
+        messages = self.sqs.receive_message(
+            QueueUrl=self.queue_url, MaxNumberOfMessages=self.batch_size, WaitTimeSeconds=wait,
+            VisibilityTimeout=self.visibility_timeout
+        ).get('Messages', [])
+        if not messages:
+            return False
+        deadline = time.time() + self.batching_window
+        while len(messages) < self.batch_size and time.time() < deadline:
+            messages += self.sqs.receive_message(
+                QueueUrl=self.queue_url, MaxNumberOfMessages=self.batch_size - len(messages),
+                WaitTimeSeconds=min(wait, max(0.0, deadline - time.time())), VisibilityTimeout=self.visibility_timeout
+            ).get('Messages', [])
+        try:
+            result = self.handler.lambda_handler({'Records': [self.to_record(m) for m in messages]}, LambdaContext(self.function_name))
+            failed = {failure['itemIdentifier'] for failure in (result or {}).get('batchItemFailures', [])}
+        except Exception:
+            failed = {message['MessageId'] for message in messages}
+        with self.lock:
+            self.invocations += 1
+            self.records_delivered += len(messages) - len(failed)
+            self.record_failures += len(failed)
+        for message in messages:
+            if message['MessageId'] not in failed:
+                try:
+                    self.sqs.delete_message(QueueUrl=self.queue_url, ReceiptHandle=message['ReceiptHandle'])
+                except Exceptions.ReceiptHandleIsInvalid:
+                    pass
+        return True
+
+    def idle(self):
+        # Messages stay in the queue, invisible, until the handler returned and they were deleted
+        attributes = self.sqs.get_queue_attributes(QueueUrl=self.queue_url)['Attributes']
+        return attributes['ApproximateNumberOfMessages'] == '0' and attributes['ApproximateNumberOfMessagesNotVisible'] == '0'
+
+    def start(self):
+        def poll():
+            while not self.stopped.is_set():
+                self.poll_once()
+
+        self.stopped.clear()
+        self.threads = [threading.Thread(target=poll, daemon=True) for _ in range(self.max_concurrency)]
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        for thread in self.threads:
+            thread.join()
+
+
+def matches_filter(pattern, value):
+    """
+    Lambda event filter pattern match: every key of the pattern must be in the
+    record, and a list in the pattern matches any of its values.
+    """
+    if isinstance(pattern, dict):
+        return isinstance(value, dict) and all(key in value and matches_filter(sub, value[key]) for key, sub in pattern.items())
+    if isinstance(pattern, list):
+        return any(matches_filter(option, value) for option in pattern)
+    return pattern == value
+
+
+class StreamEventSource:
+    """
+    Lambda's DynamoDB stream event source mapping. Records are split into
+    shards by partition key and each shard is processed by one invocation at
+    a time, in order, like ParallelizationFactor 1. Records not matching any
+    filter pattern are dropped before batching. A batch is delivered when it
+    holds batch_size records or its oldest record has waited batching_window
+    seconds. A failed batch is retried up to max_retries times, blocking its
+    shard, then skipped. With report_batch_item_failures (FunctionResponseTypes
+    ReportBatchItemFailures) a handler can return the SequenceNumber of the
+    first failed record: the records before it are checkpointed and the retry
+    starts at it.
+    """
+
+    def __init__(self, table, handler, function_name, batch_size=100, batching_window=0.0, filters=None,
+                 shards=4, max_retries=2, report_batch_item_failures=False):
+        self.handler = handler
+        self.report_batch_item_failures = report_batch_item_failures
+        self.function_name = function_name
+        self.batch_size = batch_size
+        self.batching_window = batching_window
+        self.filters = filters or []
+        self.max_retries = max_retries
+        self.shards = [[] for _ in range(shards)]
+        self.condition = threading.Condition()
+        self.stopped = threading.Event()
+        self.threads = []
+        self.in_flight = 0
+        self.invocations = 0
+        self.records_delivered = 0
+        self.failed_batches = 0
+        self.skipped_records = 0
+        table.stream_listeners.append(self.on_record)
+
+    def on_record(self, record):
+        if self.filters and not any(matches_filter(pattern, record) for pattern in self.filters):
+            return
+        key = json.dumps(record['dynamodb']['Keys'], sort_keys=True)
+        shard = int(hashlib.md5(key.encode()).hexdigest(), 16) % len(self.shards)
+        with self.condition:
+            self.shards[shard].append((time.time(), record))
+            self.condition.notify_all()
+
+    def idle(self):
+        with self.condition:
+            return not self.in_flight and not any(self.shards)
+
+    def next_batch(self, shard):
+        with self.condition:
+            while not self.stopped.is_set():
+                pending = self.shards[shard]
+                if pending:
+                    wait = pending[0][0] + self.batching_window - time.time()
+                    if len(pending) >= self.batch_size or wait <= 0:
+                        batch = [record for _, record in pending[:self.batch_size]]
+                        del pending[:self.batch_size]
+                        self.in_flight += 1
+                        return batch
+                    self.condition.wait(min(wait, 0.05))
+                else:
+                    self.condition.wait(0.05)
+            return None
+
+    def first_failure(self, batch, result):
+        """Index of the record to retry from, None when the whole batch succeeded"""
+        if not self.report_batch_item_failures or not isinstance(result, dict):
+            return None
+        failed = {failure.get('itemIdentifier') for failure in result.get('batchItemFailures') or []}
+        if not failed:
+            return None
+        for index, record in enumerate(batch):
+            if record['dynamodb']['SequenceNumber'] in failed:
+                return index
+        # An identifier that is not in the batch fails the whole batch
+        return 0
+
+    def process(self, shard):
+        while True:
+            batch = self.next_batch(shard)
+            if batch is None:
+                return
+            try:
+                for attempt in range(self.max_retries + 1):
+                    with self.condition:
+                        self.invocations += 1
+                    try:
+                        result = self.handler.lambda_handler({'Records': batch}, LambdaContext(self.function_name))
+                        failed = self.first_failure(batch, result)
+                        with self.condition:
+                            self.records_delivered += len(batch) if failed is None else failed
+                        if failed is None:
+                            break
+                        batch = batch[failed:]
+                        raise RuntimeError(f"record {batch[0]['dynamodb']['SequenceNumber']} reported as failed")
+                    except Exception as e:
+                        with self.condition:
+                            self.failed_batches += 1
+                        if attempt == self.max_retries:
+                            print(f'{self.function_name}: skipping {len(batch)} stream records after {attempt + 1} attempts: {e}')
+                            with self.condition:
+                                self.skipped_records += len(batch)
+            finally:
+                with self.condition:
+                    self.in_flight -= 1
+
+    def start(self):
+        self.stopped.clear()
+        self.threads = [threading.Thread(target=self.process, args=(shard,), daemon=True) for shard in range(len(self.shards))]
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        for thread in self.threads:
+            thread.join()
+
+
+class LocalAWS:
+    """One set of fakes configured like template.yaml"""
+
+    RENDER_QUEUE = 'tts-render-local'
+    TEXT_QUEUE = 'tts-text-local'
+    SWEEP_QUEUE = 'tts-sweep-local'
+    OCR_QUEUE = 'tts-ocr-local'
+    SYNTHESIS_QUEUE = 'tts-synthesis-local'
+
+    TABLE = 'tts-requests-local'
+    SUBSCRIPTIONS_TABLE = 'tts-status-subscriptions-local'
+    IDEMPOTENCY_TABLE = 'tts-idempotency-local'
+    UPLOADS_TABLE = 'tts-uploads-local'
+    BUCKET = 'tts-local-bucket'
+    TOPIC = 'tts-processing-local'
+
+    def __init__(self, bedrock=None, polly=None, s3=None, dynamodb=None):
+        self.s3 = s3 or FakeS3()
+        self.dynamodb = dynamodb or FakeDynamoDB()
+        self.sns = FakeSNS()
+        self.bedrock = bedrock or FakeBedrock()
+        self.polly = polly or FakePolly()
+        self.apigateway = FakeApiGatewayManagement()
+        self.sqs = FakeSQS()
+        # EMF documents written by tts_common.metrics, in emission order
+        self.metrics = []
+        self.s3.create_bucket(self.BUCKET)
+        self.table = self.dynamodb.create_table(self.TABLE)
+        self.dynamodb.create_table(self.SUBSCRIPTIONS_TABLE, 'reference_key', 'connection_id', {'connection_id-index': 'connection_id'})
+        self.dynamodb.create_table(self.IDEMPOTENCY_TABLE, 'idempotency_key')
+        self.dynamodb.create_table(self.UPLOADS_TABLE)
+        self.dynamodb.create_table('UserProfiles', 'user_id')
+
+    def connect_stage_queues(self, visibility_timeout=5, max_receive_count=8):
+        """
+        Buffer every stage behind queues like template.yaml: stream-router ->
+        render, text and sweep queues, SNS -> OCR queue (raw delivery),
+        download/*.txt S3 events -> synthesis queue, each with a dead-letter
+        queue. Returns {queue name: url}.
+        """
+        urls = {}
+        for name in (self.RENDER_QUEUE, self.TEXT_QUEUE, self.SWEEP_QUEUE, self.OCR_QUEUE, self.SYNTHESIS_QUEUE):
+            dead_letter_name = name.replace('-local', '-dlq-local')
+            urls[dead_letter_name] = self.sqs.create_queue(QueueName=dead_letter_name)['QueueUrl']
+            urls[name] = self.sqs.create_queue(QueueName=name, Attributes={
+                'VisibilityTimeout': str(visibility_timeout),
+                'RedrivePolicy': json.dumps({
+                    'deadLetterTargetArn': self.sqs.queue_arn(urls[dead_letter_name]),
+                    'maxReceiveCount': str(max_receive_count)
+                })
+            })['QueueUrl']
+        self.sns.subscribe_queue(self.TOPIC, self.sqs, urls[self.OCR_QUEUE])
+        self.s3.add_notification(self.sqs.notification_target(urls[self.SYNTHESIS_QUEUE]), prefix='download/', suffix='.txt')
+        return urls
+
+    def environment(self):
+        return {
+            'DYNAMODB_TABLE': self.TABLE,
+            'S3_BUCKET': self.BUCKET,
+            'SNS_TOPIC_NAME': self.TOPIC,
+            'AWS_REGION': REGION,
+            'AWS_DEFAULT_REGION': REGION,
+            'SUBSCRIPTIONS_TABLE': self.SUBSCRIPTIONS_TABLE,
+            'IDEMPOTENCY_TABLE': self.IDEMPOTENCY_TABLE,
+            'UPLOADS_TABLE': self.UPLOADS_TABLE,
+            'RENDER_QUEUE_URL': self.sqs.queue_url(self.RENDER_QUEUE),
+            'TEXT_QUEUE_URL': self.sqs.queue_url(self.TEXT_QUEUE),
+            'SWEEP_QUEUE_URL': self.sqs.queue_url(self.SWEEP_QUEUE),
+            'WEBSOCKET_ENDPOINT': f'https://local.execute-api.{REGION}.amazonaws.com/prod'
+        }
+
+    def install(self):
+        """Point tts_common.clients and the handler environment at these fakes"""
+        from tts_common import clients, metrics
+        os.environ.update(self.environment())
+        metrics.set_sink(self.metrics.append)
+        clients.reset_clients()
+        clients.register_client('s3', self.s3)
+        clients.register_client('sns', self.sns)
+        clients.register_client('bedrock-runtime', self.bedrock)
+        clients.register_client('polly', self.polly)
+        clients.register_client('apigatewaymanagementapi', self.apigateway)
+        clients.register_client('sqs', self.sqs)
+        clients.register_client('dynamodb', self.dynamodb)
+        clients.register_resource('dynamodb', self.dynamodb)
+        return self
+
+
+def load_handler(function_dir, module_name=None):
+    """Import lambda-functions/<function_dir>/lambda_function.py under its own module name"""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lambda-functions', function_dir, 'lambda_function.py')
+    module_name = module_name or f"{function_dir.replace('-', '_')}_lambda"
+    spec = importlib.util.spec_from_file_location(module_name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def api_event(body, email='test@example.com', headers=None, **extra):
+    event = {
+        'httpMethod': 'POST',
+        'headers': headers or {},
+        'body': json.dumps(body) if body is not None else None,
+        'requestContext': {'authorizer': {'claims': {'email': email, 'sub': hashlib.md5(email.encode()).hexdigest()}}}
+    }
+    event.update(extra)
+    return event
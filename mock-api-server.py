@@ -1,5 +1,5 @@
 #!/usr/bin/env python3
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
 import boto3
 import json
@@ -7,12 +7,17 @@ import os
 from dotenv import load_dotenv
 from datetime import datetime
 import uuid
+import time
 import jwt
 import base64
+import hashlib
 from werkzeug.utils import secure_filename
 # import PyPDF2  # No longer needed - using Bedrock instead
 import io
+import queue
+import threading
 import requests
+from collections import OrderedDict
 
 load_dotenv()
 
@@ -43,16 +48,279 @@ s3 = boto3.client(
 
 table = dynamodb.Table('tts-requests')
 
+class StatusBroker:
+    """In-process stand-in for the WebSocket status channel (status-notifier Lambda)"""
+    
+    def __init__(self, max_pending=100):
+        self.max_pending = max_pending
+        self.lock = threading.Lock()
+        self.subscribers = {}
+    
+    def subscribe(self, user_email):
+        subscriber = queue.Queue(maxsize=self.max_pending)
+        with self.lock:
+            self.subscribers.setdefault(user_email, set()).add(subscriber)
+        return subscriber
+    
+    def unsubscribe(self, user_email, subscriber):
+        with self.lock:
+            self.subscribers.get(user_email, set()).discard(subscriber)
+    
+    def publish(self, user_email, reference_key, status):
+        event = {'reference_key': reference_key, 'TaskStatus': status}
+        with self.lock:
+            subscribers = list(self.subscribers.get(user_email, ()))
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(event)
+            except queue.Full:
+                # A stalled client only loses intermediate statuses, never blocks a request
+                pass
+
+status_broker = StatusBroker()
+
+class JobPool:
+    """
+    Background workers for synthesis, in place of the Lambda pipeline.
+    
+    Routes submit jobs and return at once; a fixed number of threads work
+    through a bounded queue. When the queue is full submit returns False
+    and the route answers 503, so a load test sees backpressure instead of
+    piling up Flask threads. A route that writes the job first reserves its
+    slot, so a full queue is found before anything is written.
+    """
+    
+    def __init__(self, workers=4, max_queued=100):
+        self.jobs = queue.Queue(maxsize=max_queued)
+        self.max_queued = max_queued
+        self.reserved = 0
+        self.lock = threading.Lock()
+        self.stats = {'workers': workers, 'max_queued': max_queued, 'running': 0, 'completed': 0, 'failed': 0, 'rejected': 0}
+        for n in range(workers):
+            threading.Thread(target=self.work, name=f'job-worker-{n}', daemon=True).start()
+    
+    def has_room(self):
+        # Callers hold self.lock, every put goes through it so the space cannot be taken in between
+        if self.jobs.qsize() + self.reserved < self.max_queued:
+            return True
+        self.stats['rejected'] += 1
+        return False
+    
+    def reserve(self):
+        """Hold a queue slot for a job that is submitted later with reserved=True, False if none is free"""
+        with self.lock:
+            if not self.has_room():
+                return False
+            self.reserved += 1
+            return True
+    
+    def release(self):
+        """Give back a reserved slot when the job is not submitted after all"""
+        with self.lock:
+            self.reserved -= 1
+    
+    def submit(self, reference_key, user_email, fn, *args, reserved=False):
+        """Queue the job, False if the queue is full. Never fails for a reserved slot."""
+        with self.lock:
+            if reserved:
+                self.reserved -= 1
+            elif not self.has_room():
+                return False
+            self.jobs.put_nowait((reference_key, user_email, fn, args))
+        return True
+    
+    def work(self):
+        while True:
+            reference_key, user_email, fn, args = self.jobs.get()
+            with self.lock:
+                self.stats['running'] += 1
+            try:
+                fn(*args)
+                outcome = 'completed'
+            except Exception as e:
+                print(f"Job {reference_key} failed: {str(e)}")
+                outcome = 'failed'
+                try:
+                    set_task_status(reference_key, user_email, 'failed')
+                except Exception as status_error:
+                    print(f"Could not mark {reference_key} failed: {str(status_error)}")
+            finally:
+                with self.lock:
+                    self.stats['running'] -= 1
+                    self.stats[outcome] += 1
+                self.jobs.task_done()
+    
+    def snapshot(self):
+        with self.lock:
+            return dict(self.stats, queued=self.jobs.qsize(), reserved=self.reserved)
+
+job_pool = JobPool(
+    workers=int(os.getenv('MOCK_WORKERS', '4')),
+    max_queued=int(os.getenv('MOCK_QUEUE_DEPTH', '100'))
+)
+
+def queue_full_response():
+    return jsonify({'error': 'Too many jobs queued, retry later'}), 503, {'Retry-After': '5'}
+
+def set_task_status(reference_key, user_email, status):
+    table.update_item(
+        Key={'reference_key': reference_key},
+        UpdateExpression='SET TaskStatus = :status',
+        ExpressionAttributeValues={':status': status}
+    )
+    status_broker.publish(user_email, reference_key, status)
+
+def synthesize_text(reference_key, user_email, text, voice_id):
+    print(f"Generating audio for: {reference_key}")
+    
+    # Generate audio with Polly
+    response = polly.synthesize_speech(
+        Text=text,
+        OutputFormat='mp3',
+        VoiceId=voice_id
+    )
+    
+    # Upload to S3
+    s3_key = f'audio/{reference_key}.mp3'
+    s3.put_object(
+        Bucket='tts-bucket-1758893841',
+        Key=s3_key,
+        Body=response['AudioStream'].read(),
+        ContentType='audio/mpeg'
+    )
+    
+    print(f"Audio uploaded to S3: {s3_key}")
+    
+    # Update status
+    set_task_status(reference_key, user_email, 'Voice-is-Ready')
+    
+    print(f"Conversion complete: {reference_key}")
+
+class TokenVerifier:
+    """
+    Verifies Cognito ID tokens against the user pool's JWKS.
+    
+    The key set is fetched once and kept; a token signed with a key id it has
+    not seen (a rotated key) refetches it, at most once per min_refresh
+    seconds so tokens with made-up key ids cannot hammer the endpoint. With
+    jwks_file the keys come from a local JWKS document instead, reloaded when
+    the file changes, for running offline. Verified tokens are kept in a
+    bounded LRU until they expire, a repeat request costs one dict lookup.
+    """
+    
+    def __init__(self, region, user_pool_id, client_id, jwks_file=None, cache_size=1024, min_refresh=60):
+        self.issuer = f'https://cognito-idp.{region}.amazonaws.com/{user_pool_id}'
+        self.client_id = client_id
+        self.jwks_file = jwks_file
+        self.cache_size = cache_size
+        self.min_refresh = min_refresh
+        self.keys = {}
+        self.keys_loaded_at = 0
+        self.keys_version = None
+        self.keys_lock = threading.Lock()
+        self.cache = OrderedDict()
+        self.cache_lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'key_refreshes': 0, 'rejected': 0}
+    
+    def load_keys(self):
+        if self.jwks_file:
+            with open(self.jwks_file) as f:
+                document = json.load(f)
+        else:
+            response = requests.get(f'{self.issuer}/.well-known/jwks.json', timeout=5)
+            response.raise_for_status()
+            document = response.json()
+        return {key.key_id: key for key in jwt.PyJWKSet.from_dict(document).keys}
+    
+    def signing_key(self, kid):
+        key = self.keys.get(kid)
+        if key:
+            return key
+        with self.keys_lock:
+            # Another request may have refreshed while this one waited
+            if kid in self.keys:
+                return self.keys[kid]
+            if self.jwks_file:
+                version = os.path.getmtime(self.jwks_file)
+                stale = version != self.keys_version
+            else:
+                version = None
+                stale = time.time() - self.keys_loaded_at >= self.min_refresh
+            if stale:
+                self.keys = self.load_keys()
+                self.keys_loaded_at = time.time()
+                self.keys_version = version
+                self.stats['key_refreshes'] += 1
+            if kid not in self.keys:
+                raise jwt.InvalidTokenError(f'Unknown signing key {kid}')
+            return self.keys[kid]
+    
+    def cached(self, token, now):
+        with self.cache_lock:
+            entry = self.cache.get(token)
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+            claims, expires_at = entry
+            if expires_at <= now:
+                del self.cache[token]
+                self.stats['misses'] += 1
+                return None
+            self.cache.move_to_end(token)
+            self.stats['hits'] += 1
+            return claims
+    
+    def verify(self, token):
+        """Claims of a valid ID token, raises jwt.InvalidTokenError otherwise"""
+        now = time.time()
+        claims = self.cached(token, now)
+        if claims is not None:
+            return claims
+        try:
+            header = jwt.get_unverified_header(token)
+            key = self.signing_key(header.get('kid'))
+            claims = jwt.decode(
+                token,
+                key.key,
+                algorithms=['RS256'],
+                audience=self.client_id,
+                issuer=self.issuer,
+                options={'require': ['exp', 'iss', 'aud']}
+            )
+            if claims.get('token_use', 'id') != 'id':
+                raise jwt.InvalidTokenError('Not an ID token')
+        except jwt.InvalidTokenError:
+            with self.cache_lock:
+                self.stats['rejected'] += 1
+            raise
+        with self.cache_lock:
+            self.cache[token] = (claims, claims['exp'])
+            self.cache.move_to_end(token)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return claims
+    
+    def snapshot(self):
+        with self.cache_lock:
+            return dict(self.stats, cached_tokens=len(self.cache), signing_keys=len(self.keys))
+
+COGNITO_CLIENT_ID = os.getenv('USER_POOL_CLIENT_ID', '1piov92n8lm83rjufak0rih9qp')
+
+token_verifier = TokenVerifier(
+    region=os.getenv('AWS_REGION', 'us-east-1'),
+    user_pool_id=os.getenv('USER_POOL_ID', 'us-east-1_wRy4OwOKR'),
+    client_id=COGNITO_CLIENT_ID,
+    jwks_file=os.getenv('MOCK_JWKS_FILE'),
+    cache_size=int(os.getenv('MOCK_TOKEN_CACHE_SIZE', '1024'))
+)
+
 def extract_user_info(auth_header):
     try:
         if not auth_header or not auth_header.startswith('Bearer '):
             return None, 'Missing authorization token'
         
         token = auth_header.replace('Bearer ', '')
-        
-        # Decode JWT without verification (for local testing)
-        decoded = jwt.decode(token, options={"verify_signature": False})
-        print(f"Decoded token: {decoded}")  # Debug log
+        decoded = token_verifier.verify(token)
         
         user_email = decoded.get('email')
         user_id = decoded.get('sub')
@@ -70,7 +338,7 @@ def extract_user_info(auth_header):
         }, None
         
     except Exception as e:
-        print(f"Token validation error: {e}")  # Debug log
+        print(f"Token validation error: {e}")
         return None, f'Token validation failed: {str(e)}'
 
 def extract_user_email(auth_header):
@@ -89,57 +357,53 @@ def upload_text():
             
         user_email = user_info['email']
         
-        data = request.json
-        print(f"User {user_email} processing text: {data['text'][:50]}...")
-        
-        reference_key = str(uuid.uuid4())
-        
-        # Create DynamoDB record
-        item = {
-            'reference_key': reference_key,
-            'user_email': user_email,
-            'text': data['text'],
-            'voice': data.get('voice_id', 'Joanna'),
-            'language': data.get('language', 'en-US'),
-            'TaskStatus': 'Upload-Completed',
-            'UploadDateTime': datetime.now().isoformat(),
-            'InputType': 'TEXT'
-        }
+        # Take the job's queue slot before writing anything, a saturated pool leaves no orphaned job
+        if not job_pool.reserve():
+            return queue_full_response()
         
-        table.put_item(Item=item)
-        
-        print(f"Generating audio for: {reference_key}")
-        
-        # Generate audio with Polly
-        response = polly.synthesize_speech(
-            Text=data['text'],
-            OutputFormat='mp3',
-            VoiceId=data.get('voice_id', 'Joanna')
-        )
-        
-        # Upload to S3
-        s3_key = f'audio/{reference_key}.mp3'
-        s3.put_object(
-            Bucket='tts-bucket-1758893841',
-            Key=s3_key,
-            Body=response['AudioStream'].read(),
-            ContentType='audio/mpeg'
-        )
-        
-        print(f"Audio uploaded to S3: {s3_key}")
-        
-        # Update status
-        table.update_item(
-            Key={'reference_key': reference_key},
-            UpdateExpression='SET TaskStatus = :status',
-            ExpressionAttributeValues={':status': 'Voice-is-Ready'}
-        )
+        try:
+            data = request.json
+            print(f"User {user_email} processing text: {data['text'][:50]}...")
+            
+            reference_key = str(uuid.uuid4())
+            
+            # Keep the body in S3 only, like upload-execution
+            text_bytes = data['text'].encode('utf-8')
+            text_key = f'upload/{reference_key}/input.txt'
+            s3.put_object(
+                Bucket='tts-bucket-1758893841',
+                Key=text_key,
+                Body=text_bytes,
+                ContentType='text/plain'
+            )
+            
+            # Create DynamoDB record
+            item = {
+                'reference_key': reference_key,
+                'user_email': user_email,
+                'S3Path': f's3://tts-bucket-1758893841/{text_key}',
+                'TextPreview': data['text'][:100] + '...' if len(data['text']) > 100 else data['text'],
+                'TextSize': len(text_bytes),
+                'TextSha256': hashlib.sha256(text_bytes).hexdigest(),
+                'voice': data.get('voice_id', 'Joanna'),
+                'language': data.get('language', 'en-US'),
+                'TaskStatus': 'Upload-Completed',
+                'UploadDateTime': datetime.now().isoformat(),
+                'InputType': 'TEXT'
+            }
+            
+            table.put_item(Item=item)
+        except Exception:
+            job_pool.release()
+            raise
+        status_broker.publish(user_email, reference_key, 'Upload-Completed')
         
-        print(f"Conversion complete: {reference_key}")
+        # Synthesis runs on the job pool, the status changes to Voice-is-Ready when it is done
+        job_pool.submit(reference_key, user_email, synthesize_text, reference_key, user_email, data['text'], data.get('voice_id', 'Joanna'), reserved=True)
         
         return jsonify({
             'reference_key': reference_key,
-            'status': 'success'
+            'status': 'processing'
         })
         
     except Exception as e:
@@ -174,6 +438,30 @@ def track_requests():
         elif request.method == 'POST':
             # Generate presigned URL
             data = request.json
+            
+            if 'reference_keys' in data:
+                # Batch variant of the track-execution generate_urls action
+                reference_keys = data['reference_keys']
+                if not isinstance(reference_keys, list) or not all(isinstance(key, str) and key for key in reference_keys):
+                    return jsonify({'error': 'reference_keys must be a list of reference keys'}), 400
+                # Same limit as track-execution's MAX_BATCH_KEYS
+                if not reference_keys or len(set(reference_keys)) > 500:
+                    return jsonify({'error': 'reference_keys must contain 1 to 500 keys'}), 400
+                return jsonify({
+                    'presigned_urls': {
+                        reference_key: s3.generate_presigned_url(
+                            'get_object',
+                            Params={
+                                'Bucket': 'tts-bucket-1758893841',
+                                'Key': f'audio/{reference_key}.mp3'
+                            },
+                            ExpiresIn=3600
+                        )
+                        for reference_key in dict.fromkeys(reference_keys)
+                    },
+                    'denied': []
+                })
+            
             reference_key = data['reference_key']
             
             url = s3.generate_presigned_url(
@@ -192,6 +480,51 @@ def track_requests():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/jobs/stats', methods=['GET'])
+def job_pool_stats():
+    """Worker pool counters, for watching a load test"""
+    return jsonify(job_pool.snapshot())
+
+@app.route('/auth/stats', methods=['GET'])
+def auth_stats():
+    """Token cache hits and misses, key refreshes and rejected tokens"""
+    return jsonify(token_verifier.snapshot())
+
+@app.route('/events', methods=['GET'])
+def stream_status_events():
+    """Server-sent events with status changes for the authenticated user's jobs"""
+    # EventSource cannot set headers, so the token may also come as a query parameter
+    auth_header = request.headers.get('Authorization') or f"Bearer {request.args.get('token', '')}"
+    user_info, error = extract_user_info(auth_header)
+    
+    if error:
+        return jsonify({'error': error}), 401
+    
+    user_email = user_info['email']
+    reference_keys = set(request.args.getlist('reference_key'))
+    subscriber = status_broker.subscribe(user_email)
+    
+    def generate():
+        try:
+            yield ': connected\n\n'
+            while True:
+                try:
+                    event = subscriber.get(timeout=15)
+                except queue.Empty:
+                    yield ': keep-alive\n\n'
+                    continue
+                if reference_keys and event['reference_key'] not in reference_keys:
+                    continue
+                yield f"event: status\ndata: {json.dumps(event)}\n\n"
+        finally:
+            status_broker.unsubscribe(user_email, subscriber)
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 @app.route('/upload-pdf', methods=['POST'])
 def upload_pdf():
     try:
@@ -245,6 +578,7 @@ def upload_pdf():
         }
         
         table.put_item(Item=item)
+        status_broker.publish(user_email, reference_key, 'Upload-Completed')
         
         print(f"PDF uploaded to S3: {s3_path}")
         print(f"DynamoDB record created - Lambda pipeline will process with Bedrock")
@@ -261,6 +595,42 @@ def upload_pdf():
         traceback.print_exc()
         return jsonify({'error': str(e)}), 500
 
+def synthesize_extracted_text(reference_key, user_email, extracted_text, voice_id):
+    print(f"Generating audio for Bedrock-extracted text: {len(extracted_text)} characters")
+    
+    # Limit text length for Polly (max 3000 characters)
+    text_for_polly = extracted_text[:3000] if len(extracted_text) > 3000 else extracted_text
+    
+    # Generate audio with Polly
+    response = polly.synthesize_speech(
+        Text=text_for_polly,
+        OutputFormat='mp3',
+        VoiceId=voice_id
+    )
+    
+    # Upload audio to S3
+    audio_key = f'audio/{reference_key}.mp3'
+    s3.put_object(
+        Bucket='tts-bucket-1758893841',
+        Key=audio_key,
+        Body=response['AudioStream'].read(),
+        ContentType='audio/mpeg'
+    )
+    
+    # Update status to Voice-Ready, the extracted text stays in S3
+    table.update_item(
+        Key={'reference_key': reference_key},
+        UpdateExpression='SET TaskStatus = :status, ExtractedTextSize = :size',
+        ExpressionAttributeValues={
+            ':status': 'Voice-is-Ready',
+            ':size': len(extracted_text.encode('utf-8'))
+        }
+    )
+    
+    status_broker.publish(user_email, reference_key, 'Voice-is-Ready')
+    
+    print(f"Bedrock-to-audio conversion complete: {reference_key}")
+
 @app.route('/process-bedrock-text', methods=['POST'])
 def process_bedrock_text():
     """Process extracted text from Bedrock and generate audio"""
@@ -281,42 +651,12 @@ def process_bedrock_text():
         item = table.get_item(Key={'reference_key': reference_key})['Item']
         voice_id = item.get('voice', 'Joanna')
         
-        print(f"Generating audio for Bedrock-extracted text: {len(extracted_text)} characters")
-        
-        # Limit text length for Polly (max 3000 characters)
-        text_for_polly = extracted_text[:3000] if len(extracted_text) > 3000 else extracted_text
-        
-        # Generate audio with Polly
-        response = polly.synthesize_speech(
-            Text=text_for_polly,
-            OutputFormat='mp3',
-            VoiceId=voice_id
-        )
-        
-        # Upload audio to S3
-        audio_key = f'audio/{reference_key}.mp3'
-        s3.put_object(
-            Bucket='tts-bucket-1758893841',
-            Key=audio_key,
-            Body=response['AudioStream'].read(),
-            ContentType='audio/mpeg'
-        )
-        
-        # Update status to Voice-Ready
-        table.update_item(
-            Key={'reference_key': reference_key},
-            UpdateExpression='SET TaskStatus = :status, extracted_text = :text',
-            ExpressionAttributeValues={
-                ':status': 'Voice-is-Ready',
-                ':text': extracted_text
-            }
-        )
-        
-        print(f"Bedrock-to-audio conversion complete: {reference_key}")
+        if not job_pool.submit(reference_key, item.get('user_email'), synthesize_extracted_text, reference_key, item.get('user_email'), extracted_text, voice_id):
+            return queue_full_response()
         
         return jsonify({
             'reference_key': reference_key,
-            'status': 'success',
+            'status': 'processing',
             'text_length': len(extracted_text)
         })
         
@@ -339,7 +679,7 @@ def oauth_callback():
         
         token_data = {
             'grant_type': 'authorization_code',
-            'client_id': '1piov92n8lm83rjufak0rih9qp',
+            'client_id': COGNITO_CLIENT_ID,
             'code': code,
             'redirect_uri': redirect_uri
         }
@@ -370,4 +710,4 @@ def oauth_callback():
 if __name__ == '__main__':
     print("🚀 Starting mock API server on http://localhost:5000")
     print("Update frontend config: API_GATEWAY_URL: 'http://localhost:5000'")
-    app.run(debug=True, port=5000)
\ No newline at end of file
+    app.run(debug=True, port=5000, threaded=True)
\ No newline at end of file
@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+"""
+Long-lived pipeline worker
+
+Runs the document-splitter, image-converter and polly-invoker handlers for
+jobs taken from an SQS queue, as an alternative to the stream/SNS/S3 triggered
+Lambdas for sustained load: no cold starts, no 300 s limit, many jobs in
+flight per process.
+
+upload-execution enqueues {"reference_key": ...} for every new job when
+JOB_QUEUE_URL is set. Deploy the worker with the same environment as the
+Lambdas (DYNAMODB_TABLE, S3_BUCKET, AWS_REGION) but without SNS_TOPIC_NAME,
+and without the Lambda stream, SNS and S3 triggers, so each job runs once.
+
+Each job runs in a worker thread through the unchanged lambda_handler
+functions; asyncio only schedules jobs, long-polls the queue and keeps
+messages invisible while their job runs. Received jobs are buffered and
+started in weighted fair order across users and size classes
+(tts_common.scheduler), with slots reserved for short interactive jobs. Calls to each downstream service are
+bounded across all jobs with tts_common.clients.limit_concurrency. SIGTERM or
+SIGINT stops receiving and drains in-flight jobs before exiting.
+
+Usage:
+  JOB_QUEUE_URL=https://sqs... python3 pipeline-worker.py --max-jobs 16 --bedrock-concurrency 8
+  python3 pipeline-worker.py --local 20    # offline smoke run against local_aws fakes
+"""
+
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import signal
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(ROOT, 'lambda-functions', 'common'))
+
+from tts_common.clients import get_client, get_table, limit_concurrency
+from tts_common.metrics import iso_time
+from tts_common.scheduler import FairScheduler, job_cost
+
+STAGES = ['document-splitter', 'image-converter', 'polly-invoker']
+# Statuses after which a redelivered job can skip finished stages
+RESUME_AFTER = {
+    'pdf-to-images conversion is completed': 'image-converter',
+    'images-to-text conversion is completed': 'polly-invoker'
+}
+FINAL_STATUS = 'Voice-is-Ready'
+
+
+def load_handler(function_dir):
+    path = os.path.join(ROOT, 'lambda-functions', function_dir, 'lambda_function.py')
+    module_name = f"{function_dir.replace('-', '_')}_lambda"
+    spec = importlib.util.spec_from_file_location(module_name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+class WorkerContext:
+    """The parts of the Lambda context object the handlers read"""
+
+    def __init__(self, function_name):
+        region = os.environ.get('AWS_REGION', 'us-east-1')
+        account_id = os.environ.get('AWS_ACCOUNT_ID', '000000000000')
+        self.function_name = function_name
+        self.invoked_function_arn = f'arn:aws:lambda:{region}:{account_id}:function:{function_name}'
+        self.aws_request_id = str(uuid.uuid4())
+
+    def get_remaining_time_in_millis(self):
+        # No Lambda deadline, jobs run to completion
+        return 24 * 60 * 60 * 1000
+
+
+def stream_image(item):
+    """DynamoDB stream NewImage for the scalar attributes of an item"""
+    image = {}
+    for name, value in item.items():
+        if isinstance(value, str):
+            image[name] = {'S': value}
+        elif isinstance(value, bool):
+            image[name] = {'BOOL': value}
+        elif isinstance(value, (int, float)) or type(value).__name__ == 'Decimal':
+            image[name] = {'N': str(value)}
+    return image
+
+
+class PipelineWorker:
+    def __init__(self, queue_url, max_jobs=16, visibility_timeout=300, wait_time=20, drain_timeout=600, exit_when_idle=False,
+                 prefetch=None, reserved_slots=None):
+        self.queue_url = queue_url
+        self.max_jobs = max_jobs
+        # Jobs buffered beyond the running ones, the scheduler can only reorder what it holds
+        self.prefetch = max_jobs * 4 if prefetch is None else prefetch
+        self.scheduler = FairScheduler(reserved_slots=max(1, max_jobs // 4) if reserved_slots is None else reserved_slots)
+        self.heartbeats = {}
+        self.visibility_timeout = visibility_timeout
+        self.wait_time = wait_time
+        self.drain_timeout = drain_timeout
+        self.exit_when_idle = exit_when_idle
+        self.handlers = {stage: load_handler(stage) for stage in STAGES}
+        # Job threads block on AWS calls, queue housekeeping gets its own threads so it is never starved
+        self.job_executor = ThreadPoolExecutor(max_workers=max_jobs, thread_name_prefix='job')
+        self.queue_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='queue')
+        self.in_flight = set()
+        self.completed = 0
+        self.failed = 0
+        self.stopping = None
+
+    def run_job(self, reference_key, queued_at):
+        """Blocking: run the remaining stages of one job through the Lambda handlers"""
+        item = get_table().get_item(Key={'reference_key': reference_key}, ConsistentRead=True).get('Item')
+        if item is None or item['TaskStatus'] == FINAL_STATUS:
+            return
+        bucket = os.environ['S3_BUCKET']
+        first_stage = RESUME_AFTER.get(item['TaskStatus'], 'document-splitter')
+
+        if first_stage == 'document-splitter':
+            record = {
+                'eventName': 'INSERT',
+                'eventSource': 'aws:dynamodb',
+                'dynamodb': {'ApproximateCreationDateTime': queued_at, 'NewImage': stream_image(item)}
+            }
+            self.handlers['document-splitter'].lambda_handler({'Records': [record]}, WorkerContext('document-splitter'))
+
+        if first_stage != 'polly-invoker' and item.get('InputType', 'PDF') != 'TEXT':
+            message = {'reference_key': reference_key, 'bucket': bucket}
+            record = {'Sns': {'Message': json.dumps(message), 'Timestamp': iso_time(time.time())}}
+            self.handlers['image-converter'].lambda_handler({'Records': [record]}, WorkerContext('image-converter'))
+
+        record = {
+            'eventTime': iso_time(time.time()),
+            's3': {'bucket': {'name': bucket}, 'object': {'key': f'download/{reference_key}/formatted_output.txt'}}
+        }
+        self.handlers['polly-invoker'].lambda_handler({'Records': [record]}, WorkerContext('polly-invoker'))
+
+    async def sqs(self, operation, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.queue_executor, partial(getattr(get_client('sqs'), operation), QueueUrl=self.queue_url, **kwargs))
+
+    async def keep_invisible(self, message):
+        while True:
+            await asyncio.sleep(self.visibility_timeout / 2)
+            await self.sqs('change_message_visibility', ReceiptHandle=message['ReceiptHandle'], VisibilityTimeout=self.visibility_timeout)
+
+    def enqueue(self, message):
+        try:
+            job = json.loads(message['Body'])
+        except ValueError:
+            job = {}
+        # Messages from before the scheduling fields were added count as one-page jobs of an unknown user
+        cost = job_cost(job.get('input_type', 'PDF'), job.get('pages', 1), job.get('chars', 0))
+        self.scheduler.push(message, job.get('username', 'unknown'), cost)
+        self.heartbeats[message['MessageId']] = asyncio.ensure_future(self.keep_invisible(message))
+
+    def dispatch(self):
+        while self.max_jobs > len(self.in_flight):
+            message = self.scheduler.pop(self.max_jobs - len(self.in_flight))
+            if message is None:
+                return
+            self.start(message)
+
+    async def release_buffered(self):
+        """Hand jobs that never started back to the queue for other workers"""
+        while len(self.scheduler):
+            message = self.scheduler.pop()
+            self.heartbeats.pop(message['MessageId']).cancel()
+            try:
+                await self.sqs('change_message_visibility', ReceiptHandle=message['ReceiptHandle'], VisibilityTimeout=0)
+            except Exception:
+                pass
+
+    async def process(self, message):
+        loop = asyncio.get_running_loop()
+        heartbeat = self.heartbeats.pop(message['MessageId'], None) or asyncio.ensure_future(self.keep_invisible(message))
+        try:
+            reference_key = json.loads(message['Body'])['reference_key']
+            queued_at = int(message.get('Attributes', {}).get('SentTimestamp', time.time() * 1000)) / 1000
+            await loop.run_in_executor(self.job_executor, self.run_job, reference_key, queued_at)
+            await self.sqs('delete_message', ReceiptHandle=message['ReceiptHandle'])
+            self.completed += 1
+        except Exception as e:
+            # The message becomes visible again after the timeout and is retried, or moves to the DLQ
+            self.failed += 1
+            print(f"❌ Job from message {message['MessageId']} failed: {e}", flush=True)
+        finally:
+            heartbeat.cancel()
+
+    def start(self, message):
+        task = asyncio.ensure_future(self.process(message))
+        self.in_flight.add(task)
+        task.add_done_callback(self.in_flight.discard)
+
+    def stop(self):
+        if not self.stopping.is_set():
+            print('🛑 Stopping, draining in-flight jobs', flush=True)
+            self.stopping.set()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self.stopping = asyncio.Event()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(sig, self.stop)
+            except (NotImplementedError, RuntimeError):
+                pass
+
+        stop_wait = asyncio.ensure_future(self.stopping.wait())
+        receive = None
+        while not self.stopping.is_set():
+            self.dispatch()
+            capacity = self.max_jobs + self.prefetch - len(self.in_flight) - len(self.scheduler)
+            if receive is None and capacity > 0:
+                receive = asyncio.ensure_future(self.sqs(
+                    'receive_message',
+                    MaxNumberOfMessages=min(10, capacity),
+                    WaitTimeSeconds=self.wait_time,
+                    VisibilityTimeout=self.visibility_timeout,
+                    AttributeNames=['SentTimestamp', 'ApproximateReceiveCount']
+                ))
+            # Finished jobs free slots for buffered ones while the long poll is still open
+            waits = self.in_flight | {stop_wait} | ({receive} if receive else set())
+            await asyncio.wait(waits, return_when=asyncio.FIRST_COMPLETED)
+            if receive is not None and receive.done():
+                messages = receive.result().get('Messages', [])
+                receive = None
+                for message in messages:
+                    self.enqueue(message)
+                if not messages and not self.in_flight and not len(self.scheduler) and self.exit_when_idle:
+                    break
+        stop_wait.cancel()
+
+        if receive is not None:
+            # A long poll cannot be cancelled, what it still returns goes back with the rest of the buffer
+            for message in (await receive).get('Messages', []):
+                self.enqueue(message)
+        await self.release_buffered()
+
+        if self.in_flight:
+            done, pending = await asyncio.wait(self.in_flight, timeout=self.drain_timeout)
+            for task in pending:
+                # Not deleted, so SQS hands the job to another worker after the visibility timeout
+                task.cancel()
+        self.job_executor.shutdown(wait=False)
+        self.queue_executor.shutdown(wait=True)
+        print(f'✅ Worker stopped: {self.completed} jobs completed, {self.failed} failed', flush=True)
+
+
+def prepare_local(jobs):
+    """Offline run: fakes from local_aws.py, jobs submitted through the real upload handler"""
+    import base64
+    import local_aws
+
+    aws = local_aws.LocalAWS().install()
+    queue_url = aws.sqs.create_queue(QueueName='tts-jobs-local')['QueueUrl']
+    os.environ['JOB_QUEUE_URL'] = queue_url
+    os.environ.pop('SNS_TOPIC_NAME', None)
+    fake_renderer = importlib.util.find_spec('pdf2image') is None
+    if fake_renderer:
+        local_aws.install_fake_pdf2image()
+
+    upload = local_aws.load_handler('upload-execution')
+    for n in range(jobs):
+        if n % 2:
+            texts = [local_aws.filler_text(1500, seed=page) for page in range(3)]
+            pdf = local_aws.make_fake_pdf(texts) if fake_renderer else local_aws.make_pdf(texts)
+            body = {'fileName': 'worker.pdf', 'language': 'english', 'startPage': 1, 'endPage': 3,
+                    'fileContent': base64.b64encode(pdf).decode('ascii')}
+        else:
+            body = {'text': local_aws.filler_text(4000, seed=n), 'language': 'english'}
+        upload.lambda_handler(local_aws.api_event(body), local_aws.LambdaContext('upload-execution'))
+    return aws, queue_url
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the TTS pipeline from a job queue')
+    parser.add_argument('--queue-url', default=os.environ.get('JOB_QUEUE_URL'))
+    parser.add_argument('--max-jobs', type=int, default=16, help='jobs in flight per process')
+    parser.add_argument('--prefetch', type=int, help='jobs buffered for fair scheduling, default 4x --max-jobs')
+    parser.add_argument('--reserved-slots', type=int, help='slots only interactive jobs may take, default --max-jobs / 4')
+    parser.add_argument('--bedrock-concurrency', type=int, default=8, help='concurrent InvokeModel calls per process')
+    parser.add_argument('--polly-concurrency', type=int, default=8, help='concurrent SynthesizeSpeech calls per process')
+    parser.add_argument('--s3-concurrency', type=int, help='concurrent S3 calls per process')
+    parser.add_argument('--visibility-timeout', type=int, default=300)
+    parser.add_argument('--wait-time', type=int, default=20, help='SQS long poll seconds')
+    parser.add_argument('--drain-timeout', type=int, default=600, help='seconds to finish in-flight jobs on shutdown')
+    parser.add_argument('--exit-when-idle', action='store_true', help='stop once the queue is empty')
+    parser.add_argument('--local', type=int, metavar='JOBS', help='submit JOBS jobs to in-process fakes and process them')
+    args = parser.parse_args()
+
+    aws = None
+    if args.local:
+        aws, args.queue_url = prepare_local(args.local)
+        args.exit_when_idle = True
+        args.wait_time = 1
+    if not args.queue_url:
+        parser.error('--queue-url or JOB_QUEUE_URL is required')
+
+    limit_concurrency('bedrock-runtime', args.bedrock_concurrency)
+    limit_concurrency('polly', args.polly_concurrency)
+    limit_concurrency('s3', args.s3_concurrency)
+
+    worker = PipelineWorker(args.queue_url, args.max_jobs, args.visibility_timeout, args.wait_time,
+                            args.drain_timeout, args.exit_when_idle, args.prefetch, args.reserved_slots)
+    print(f'🚀 Worker consuming {args.queue_url} with up to {args.max_jobs} jobs in flight', flush=True)
+    start = time.perf_counter()
+    asyncio.run(worker.run())
+
+    if aws is not None:
+        statuses = [item['TaskStatus'] for item in aws.table.scan()['Items']]
+        print(f'📊 {statuses.count(FINAL_STATUS)}/{len(statuses)} jobs ready in {time.perf_counter() - start:.2f}s')
+        return 0 if statuses.count(FINAL_STATUS) == len(statuses) else 1
+    return 0 if not worker.failed else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,422 @@
+#!/usr/bin/env python3
+"""
+Cold-start and import-time profiling for every Lambda handler
+
+Each scenario loads one lambda-functions/*/lambda_function.py in a fresh
+interpreter (python -X importtime) against the in-process fakes from
+local_aws.py and records:
+  - module import time and the slowest imports
+  - first (cold) and second (warm) handler latency
+  - construction time of the real boto3 clients the handler used (when boto3 is installed)
+
+Results are written as JSON. The run fails when a scenario exceeds the import
+budget or regresses against a baseline report.
+
+Usage:
+  python3 profile-cold-start.py                          # all scenarios, writes cold-start-report.json
+  python3 profile-cold-start.py --scenario document-splitter:text --runs 5
+  python3 profile-cold-start.py --baseline old-report.json --tolerance 0.2
+"""
+
+import time
+
+PROCESS_START = time.perf_counter()
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import uuid
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+IMPORT_START_MARKER = '@@cold-start-import-start'
+IMPORT_END_MARKER = '@@cold-start-import-end'
+
+# Handler module import budget. boto3/botocore are not counted: every handler loads them on its
+# first AWS call, whether through tts_common.clients or an import of boto3.dynamodb.conditions.
+DEFAULT_MAX_IMPORT_MS = 100.0
+SDK_PACKAGES = ('boto3', 'botocore')
+
+
+def seed_text_job(aws, text='Hello world! This is a cold start profiling run.'):
+    reference_key = str(uuid.uuid4())
+    key = f'upload/{reference_key}/input.txt'
+    aws.s3.put_object(Bucket=aws.BUCKET, Key=key, Body=text.encode('utf-8'))
+    aws.table.put_item(Item={
+        'reference_key': reference_key,
+        'Username': 'test@example.com',
+        'Language': 'english',
+        'InputType': 'TEXT',
+        'TaskStatus': 'Upload-Completed',
+        'S3Path': f's3://{aws.BUCKET}/{key}'
+    })
+    return reference_key, key
+
+
+def stream_insert(aws, reference_key):
+    import local_aws
+    item = aws.table.get_item(Key={'reference_key': reference_key})['Item']
+    return {'Records': [{
+        'eventName': 'INSERT',
+        'eventSource': 'aws:dynamodb',
+        'dynamodb': {
+            'Keys': {'reference_key': {'S': reference_key}},
+            'NewImage': {k: local_aws.serialize(v) for k, v in item.items()}
+        }
+    }]}
+
+
+def upload_text(aws):
+    import local_aws
+    return lambda: local_aws.api_event({'text': 'Hello world! ' * 20, 'language': 'english', 'voice_id': 'Joanna'})
+
+
+def upload_batch(aws):
+    import local_aws
+    return lambda: local_aws.api_event({
+        'action': 'batch_submit',
+        'documents': [{'text': f'Document {i} of the batch.'} for i in range(25)]
+    })
+
+
+def splitter_text(aws):
+    return lambda: stream_insert(aws, seed_text_job(aws)[0])
+
+
+def splitter_pdf(aws):
+    import local_aws
+    fake = 'pdf2image' in sys.modules and getattr(sys.modules['pdf2image'], '__file__', None) is None
+
+    def make_event():
+        reference_key = str(uuid.uuid4())
+        pages = [local_aws.filler_text(1500, seed=i) for i in range(3)]
+        key = f'upload/{reference_key}/document.pdf'
+        aws.s3.put_object(Bucket=aws.BUCKET, Key=key, Body=local_aws.make_fake_pdf(pages) if fake else local_aws.make_pdf(pages))
+        aws.table.put_item(Item={
+            'reference_key': reference_key,
+            'Username': 'test@example.com',
+            'Language': 'english',
+            'InputType': 'PDF',
+            'StartPage': '1',
+            'EndPage': '3',
+            'TaskStatus': 'Upload-Completed',
+            'S3Path': f's3://{aws.BUCKET}/{key}'
+        })
+        return stream_insert(aws, reference_key)
+    return make_event
+
+
+def image_converter(aws):
+    import io
+    import local_aws
+
+    def make_event():
+        reference_key = str(uuid.uuid4())
+        aws.table.put_item(Item={'reference_key': reference_key, 'TaskStatus': 'pdf-to-images conversion is completed'})
+        for page in range(1, 3):
+            image = io.BytesIO()
+            local_aws.FakePage(local_aws.filler_text(1200, seed=page)).save(image)
+            aws.s3.put_object(Bucket=aws.BUCKET, Key=f'images/{reference_key}/page_{page}.png', Body=image.getvalue())
+        return {'Records': [{'EventSource': 'aws:sns', 'Sns': {'Message': json.dumps({
+            'reference_key': reference_key,
+            'bucket': aws.BUCKET
+        })}}]}
+    return make_event
+
+
+def polly_invoker(aws):
+    def make_event():
+        reference_key, _ = seed_text_job(aws)
+        key = f'download/{reference_key}/formatted_output.txt'
+        aws.s3.put_object(Bucket=aws.BUCKET, Key=key, Body=b'Hello world! This is a cold start profiling run.')
+        return {'Records': [{'eventSource': 'aws:s3', 's3': {'bucket': {'name': aws.BUCKET}, 'object': {'key': key}}}]}
+    return make_event
+
+
+def track_list(aws):
+    import local_aws
+    for _ in range(50):
+        seed_text_job(aws)
+    return lambda: local_aws.api_event(None, httpMethod='GET')
+
+
+def track_urls(aws):
+    import local_aws
+    reference_keys = [seed_text_job(aws)[0] for _ in range(50)]
+    return lambda: local_aws.api_event(None, action='generate_urls', reference_keys=reference_keys)
+
+
+def status_notifier(aws):
+    def make_event():
+        reference_key = str(uuid.uuid4())
+        connection_id = uuid.uuid4().hex
+        aws.apigateway.connect(connection_id)
+        aws.dynamodb.Table(aws.SUBSCRIPTIONS_TABLE).put_item(Item={'reference_key': reference_key, 'connection_id': connection_id})
+        return {'Records': [{
+            'eventName': 'MODIFY',
+            'eventSource': 'aws:dynamodb',
+            'dynamodb': {
+                'NewImage': {'reference_key': {'S': reference_key}, 'TaskStatus': {'S': 'Voice-is-Ready'}},
+                'OldImage': {'reference_key': {'S': reference_key}, 'TaskStatus': {'S': 'Upload-Completed'}}
+            }
+        }]}
+    return make_event
+
+
+def user_profile(aws):
+    import local_aws
+    return lambda: local_aws.api_event(None, httpMethod='GET')
+
+
+# name -> (function directory, event factory, modules required to run it for real)
+SCENARIOS = {
+    'upload-execution:text': ('upload-execution', upload_text, []),
+    'upload-execution:batch': ('upload-execution', upload_batch, []),
+    'document-splitter:text': ('document-splitter', splitter_text, []),
+    'document-splitter:pdf': ('document-splitter', splitter_pdf, ['pdf2image']),
+    'image-converter': ('image-converter', image_converter, []),
+    'polly-invoker': ('polly-invoker', polly_invoker, []),
+    'track-execution:list': ('track-execution', track_list, []),
+    'track-execution:generate_urls': ('track-execution', track_urls, []),
+    'status-notifier:stream': ('status-notifier', status_notifier, []),
+    'user-profile:get': ('user-profile', user_profile, [])
+}
+
+
+def measure_client_construction(aws):
+    """Time building the real boto3 clients for the fake services the handler called"""
+    import importlib.util
+    if importlib.util.find_spec('boto3') is None:
+        return None
+    from tts_common import clients
+    used = {
+        's3': aws.s3, 'sns': aws.sns, 'bedrock-runtime': aws.bedrock, 'polly': aws.polly,
+        'apigatewaymanagementapi': aws.apigateway
+    }
+    clients.reset_clients()
+    timings = {}
+    start = time.perf_counter()
+    import boto3
+    timings['import boto3'] = (time.perf_counter() - start) * 1000
+    for service_name, fake in used.items():
+        if fake.behavior.calls:
+            start = time.perf_counter()
+            kwargs = {'endpoint_url': os.environ['WEBSOCKET_ENDPOINT']} if service_name == 'apigatewaymanagementapi' else {}
+            clients.get_client(service_name, **kwargs)
+            timings[service_name] = (time.perf_counter() - start) * 1000
+    if aws.dynamodb.behavior.calls:
+        start = time.perf_counter()
+        clients.get_resource('dynamodb')
+        timings['dynamodb'] = (time.perf_counter() - start) * 1000
+    return timings
+
+
+def run_child(name, fake_renderer):
+    function_dir, factory, _ = SCENARIOS[name]
+    import local_aws
+    if fake_renderer:
+        local_aws.install_fake_pdf2image()
+    aws = local_aws.LocalAWS().install()
+    make_event = factory(aws)
+    first_event, second_event = make_event(), make_event()
+    context = local_aws.LambdaContext(function_dir)
+    setup_ms = (time.perf_counter() - PROCESS_START) * 1000
+
+    sys.stderr.write(IMPORT_START_MARKER + '\n')
+    sys.stderr.flush()
+    start = time.perf_counter()
+    module = local_aws.load_handler(function_dir)
+    import_ms = (time.perf_counter() - start) * 1000
+    sys.stderr.write(IMPORT_END_MARKER + '\n')
+    sys.stderr.flush()
+
+    start = time.perf_counter()
+    cold_response = module.lambda_handler(first_event, context)
+    cold_handler_ms = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    module.lambda_handler(second_event, context)
+    warm_handler_ms = (time.perf_counter() - start) * 1000
+
+    status_code = cold_response.get('statusCode') if isinstance(cold_response, dict) else None
+    client_construction = measure_client_construction(aws)
+    json.dump({
+        'harness_setup_ms': setup_ms,
+        'import_ms': import_ms,
+        'cold_handler_ms': cold_handler_ms,
+        'warm_handler_ms': warm_handler_ms,
+        'client_construction_ms': client_construction,
+        'status_code': status_code
+    }, sys.stdout)
+
+
+def parse_import_times(stderr):
+    """Self and cumulative microseconds per module imported between the markers"""
+    entries = []
+    inside = False
+    for line in stderr.splitlines():
+        if line == IMPORT_START_MARKER:
+            inside = True
+        elif line == IMPORT_END_MARKER:
+            break
+        elif inside and line.startswith('import time:') and '|' in line:
+            self_us, cumulative_us, module = line[len('import time:'):].split('|')
+            if self_us.strip().isdigit():
+                depth = (len(module) - len(module.lstrip())) // 2
+                entries.append({'module': module.strip(), 'depth': depth, 'self_us': int(self_us), 'cumulative_us': int(cumulative_us)})
+    return entries
+
+
+def sdk_import_us(entries):
+    """Cumulative import time of the outermost boto3/botocore modules in the import tree"""
+    total = 0
+    sdk_depth = None
+    # -X importtime lists a module after everything it imported, reversed a parent comes before its children
+    for entry in reversed(entries):
+        if sdk_depth is not None and entry['depth'] > sdk_depth:
+            continue
+        sdk_depth = None
+        if entry['module'].split('.')[0] in SDK_PACKAGES:
+            total += entry['cumulative_us']
+            sdk_depth = entry['depth']
+    return total
+
+
+def profile_scenario(name, runs, fake_renderer):
+    function_dir, _, requirements = SCENARIOS[name]
+    import importlib.util
+    missing = [module for module in requirements if importlib.util.find_spec(module) is None]
+    if missing and not fake_renderer:
+        return {'scenario': name, 'function': function_dir, 'status': 'skipped', 'reason': f"missing {', '.join(missing)}"}
+
+    samples = []
+    imports = []
+    for _ in range(runs):
+        command = [sys.executable, '-X', 'importtime', os.path.abspath(__file__), '--child', name]
+        if fake_renderer:
+            command.append('--fake-renderer')
+        start = time.perf_counter()
+        process = subprocess.run(command, capture_output=True, text=True, cwd=ROOT)
+        wall_ms = (time.perf_counter() - start) * 1000
+        if process.returncode != 0:
+            error = [line for line in process.stderr.splitlines() if not line.startswith('import time:')]
+            return {'scenario': name, 'function': function_dir, 'status': 'failed', 'error': '\n'.join(error[-15:])}
+        sample = json.loads(process.stdout)
+        sample['process_wall_ms'] = wall_ms
+        samples.append(sample)
+        imports = imports or parse_import_times(process.stderr)
+
+    def median(field):
+        return statistics.median(sample[field] for sample in samples)
+
+    construction = None
+    if samples[0]['client_construction_ms'] is not None:
+        construction = {
+            service: statistics.median(sample['client_construction_ms'][service] for sample in samples)
+            for service in samples[0]['client_construction_ms']
+        }
+
+    result = {
+        'scenario': name,
+        'function': function_dir,
+        'status': 'ok',
+        'status_code': samples[0]['status_code'],
+        'runs': runs,
+        'import_ms': median('import_ms'),
+        'cold_handler_ms': median('cold_handler_ms'),
+        'warm_handler_ms': median('warm_handler_ms'),
+        'client_construction_ms': construction,
+        'process_wall_ms': median('process_wall_ms'),
+        'harness_setup_ms': median('harness_setup_ms'),
+        'import_breakdown_us': sum(entry['self_us'] for entry in imports),
+        'sdk_import_ms': sdk_import_us(imports) / 1000,
+        'top_imports': sorted(
+            ({'module': entry['module'], 'self_us': entry['self_us'], 'cumulative_us': entry['cumulative_us']} for entry in imports),
+            key=lambda entry: entry['self_us'],
+            reverse=True
+        )[:10]
+    }
+    # What a real cold start pays before the handler returns: import, client setup, first invocation
+    result['cold_start_ms'] = result['import_ms'] + result['cold_handler_ms'] + sum((construction or {}).values())
+    return result
+
+
+def check_thresholds(results, max_import_ms, baseline, tolerance, min_delta_ms):
+    failures = []
+    previous = {result['scenario']: result for result in (baseline or {}).get('results', []) if result.get('status') == 'ok'}
+    for result in results:
+        if result['status'] == 'failed':
+            failures.append(f"{result['scenario']}: run failed")
+            continue
+        if result['status'] != 'ok':
+            continue
+        handler_import_ms = result['import_ms'] - result.get('sdk_import_ms', 0)
+        if handler_import_ms > max_import_ms:
+            failures.append(f"{result['scenario']}: import {handler_import_ms:.1f} ms (without boto3) exceeds budget {max_import_ms:.1f} ms")
+        before = previous.get(result['scenario'])
+        if before:
+            for field in ('import_ms', 'cold_start_ms'):
+                limit = max(before[field] * (1 + tolerance), before[field] + min_delta_ms)
+                if result[field] > limit:
+                    failures.append(f"{result['scenario']}: {field} {result[field]:.1f} ms vs baseline {before[field]:.1f} ms")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Profile handler cold starts against in-process AWS fakes')
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS), help='scenario to run (default: all)')
+    parser.add_argument('--runs', type=int, default=3, help='fresh interpreters per scenario, the median is reported')
+    parser.add_argument('--output', default='cold-start-report.json', help='JSON report path')
+    parser.add_argument('--baseline', help='earlier report to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed relative regression against the baseline')
+    parser.add_argument('--min-delta-ms', type=float, default=5.0, help='regressions smaller than this are noise')
+    parser.add_argument('--max-import-ms', type=float, default=DEFAULT_MAX_IMPORT_MS, help='import time budget per handler')
+    parser.add_argument('--fake-renderer', action='store_true', help='run the PDF scenario with the fake pdf2image from local_aws')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args.fake_renderer)
+        return 0
+
+    print('⏱️  Profiling Lambda cold starts...')
+    results = []
+    for name in args.scenario or SCENARIOS:
+        result = profile_scenario(name, args.runs, args.fake_renderer)
+        results.append(result)
+        if result['status'] == 'ok':
+            print(f"  {name:32} import {result['import_ms']:7.1f} ms | cold {result['cold_handler_ms']:7.1f} ms | "
+                  f"warm {result['warm_handler_ms']:7.1f} ms | cold start {result['cold_start_ms']:7.1f} ms")
+        else:
+            print(f"  {name:32} {result['status']}: {result.get('reason') or result.get('error')}")
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    failures = check_thresholds(results, args.max_import_ms, baseline, args.tolerance, args.min_delta_ms)
+
+    report = {
+        'generated_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'boto3_available': any(result.get('client_construction_ms') is not None for result in results),
+        'results': results,
+        'failures': failures
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'\n📄 Report written to {args.output}')
+
+    if failures:
+        print('❌ Cold start check failed:')
+        for failure in failures:
+            print(f'  - {failure}')
+        return 1
+    print('✅ Cold start within thresholds')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
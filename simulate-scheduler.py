@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Scheduling simulation for the pipeline worker
+
+Discrete-event simulation of a pool of execution slots fed by a synthetic
+arrival trace: many users submitting short TEXT jobs, a few submitting
+medium PDFs, and heavy users dumping bursts of 100-500 page PDFs. The same
+trace is run under FIFO, weighted fair queuing (tts_common.scheduler) and
+fair queuing with slots reserved for interactive jobs, and latency is
+reported per size class together with how many short jobs met the target.
+
+No AWS calls or handlers are involved, service times come from the
+scheduler's cost model with random noise.
+
+Usage:
+  python3 simulate-scheduler.py
+  python3 simulate-scheduler.py --slots 32 --heavy-users 4 --target-seconds 20
+  python3 simulate-scheduler.py --save-trace trace.jsonl
+  python3 simulate-scheduler.py --trace trace.jsonl --output simulation.json
+"""
+
+import argparse
+import heapq
+import json
+import os
+import random
+import sys
+from collections import deque
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lambda-functions', 'common'))
+
+from tts_common.scheduler import PRIORITY_CLASSES, FairScheduler, classify, job_cost
+
+
+def poisson_arrivals(generator, rate, duration):
+    time = generator.expovariate(rate)
+    while time < duration:
+        yield time
+        time += generator.expovariate(rate)
+
+
+def generate_trace(args):
+    generator = random.Random(args.seed)
+    jobs = []
+
+    def add(arrival, user, input_type, pages=0, chars=0):
+        jobs.append({'arrival': arrival, 'user': user, 'input_type': input_type, 'pages': pages, 'chars': chars})
+
+    for n in range(args.light_users):
+        for arrival in poisson_arrivals(generator, args.light_rate, args.duration):
+            add(arrival, f'light-{n}', 'TEXT', chars=generator.randint(50, 3000))
+    for n in range(args.medium_users):
+        for arrival in poisson_arrivals(generator, args.medium_rate, args.duration):
+            add(arrival, f'medium-{n}', 'PDF', pages=generator.randint(5, 30))
+    for n in range(args.heavy_users):
+        for _ in range(args.bursts):
+            start = generator.uniform(0, args.duration * 0.8)
+            for k in range(args.burst_size):
+                add(start + k * 0.1, f'heavy-{n}', 'PDF', pages=generator.randint(100, 500))
+
+    for job in jobs:
+        job['cost'] = job_cost(job['input_type'], job['pages'], job['chars'])
+        job['service'] = job['cost'] * generator.lognormvariate(0, args.noise)
+    jobs.sort(key=lambda job: job['arrival'])
+    return jobs
+
+
+def simulate(jobs, slots, policy, reserved_slots):
+    """Run the trace, returns per-job (class, wait, latency)"""
+    if policy == 'fifo':
+        queue = deque()
+        push = lambda job: queue.append(job)
+        pop = lambda free: queue.popleft() if queue else None
+    else:
+        scheduler = FairScheduler(reserved_slots=reserved_slots if policy == 'wfq+reserve' else 0)
+        push = lambda job: scheduler.push(job, job['user'], job['cost'])
+        pop = scheduler.pop
+
+    events = [(job['arrival'], 0, n) for n, job in enumerate(jobs)]
+    heapq.heapify(events)
+    free = slots
+    results = []
+    while events:
+        now, kind, n = heapq.heappop(events)
+        if kind == 0:
+            push(jobs[n])
+        else:
+            free += 1
+            job = jobs[n]
+            results.append((classify(job['cost']), job['start'] - job['arrival'], now - job['arrival']))
+        while free:
+            job = pop(free)
+            if job is None:
+                break
+            free -= 1
+            job['start'] = now
+            heapq.heappush(events, (now + job['service'], 1, job['index']))
+    return results
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * (len(ordered) - 1)))))] if ordered else None
+
+
+def summarize(results, target):
+    summary = {}
+    for name, _, _ in PRIORITY_CLASSES:
+        latencies = [latency for job_class, _, latency in results if job_class == name]
+        waits = [wait for job_class, wait, _ in results if job_class == name]
+        if not latencies:
+            continue
+        summary[name] = {
+            'jobs': len(latencies),
+            'wait_p50_s': percentile(waits, 0.5),
+            'wait_p95_s': percentile(waits, 0.95),
+            'latency_p50_s': percentile(latencies, 0.5),
+            'latency_p95_s': percentile(latencies, 0.95),
+            'latency_p99_s': percentile(latencies, 0.99)
+        }
+    short = [latency for job_class, _, latency in results if job_class == PRIORITY_CLASSES[0][0]]
+    summary['short_jobs_within_target'] = sum(1 for latency in short if latency <= target) / len(short) if short else None
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description='FIFO vs weighted fair queuing on a synthetic job trace')
+    parser.add_argument('--slots', type=int, default=16, help='concurrent jobs, like pipeline-worker --max-jobs')
+    parser.add_argument('--reserved-slots', type=int, help='slots kept for interactive jobs, default slots / 4')
+    parser.add_argument('--duration', type=float, default=3600, help='seconds of arrivals')
+    parser.add_argument('--light-users', type=int, default=50)
+    parser.add_argument('--light-rate', type=float, default=1 / 250, help='short jobs per second per light user')
+    parser.add_argument('--medium-users', type=int, default=5)
+    parser.add_argument('--medium-rate', type=float, default=1 / 60)
+    parser.add_argument('--heavy-users', type=int, default=2)
+    parser.add_argument('--bursts', type=int, default=1, help='bursts per heavy user')
+    parser.add_argument('--burst-size', type=int, default=20, help='large PDFs per burst')
+    parser.add_argument('--noise', type=float, default=0.3, help='lognormal sigma of service time around the cost model')
+    parser.add_argument('--target-seconds', type=float, default=30, help='latency target for interactive jobs')
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--trace', help='JSON lines trace to replay instead of generating one')
+    parser.add_argument('--save-trace', help='write the generated trace as JSON lines')
+    parser.add_argument('--output', help='write results as JSON')
+    args = parser.parse_args()
+
+    if args.trace:
+        with open(args.trace) as f:
+            jobs = [json.loads(line) for line in f if line.strip()]
+    else:
+        jobs = generate_trace(args)
+    if args.save_trace:
+        with open(args.save_trace, 'w') as f:
+            for job in jobs:
+                f.write(json.dumps(job) + '\n')
+    for n, job in enumerate(jobs):
+        job['index'] = n
+        # Recorded traces may carry only arrival, user, type and size
+        job.setdefault('cost', job_cost(job['input_type'], job.get('pages', 0), job.get('chars', 0)))
+        job.setdefault('service', job['cost'])
+
+    reserved_slots = max(1, args.slots // 4) if args.reserved_slots is None else args.reserved_slots
+    duration = max(job['arrival'] for job in jobs) if args.trace else args.duration
+    load = sum(job['service'] for job in jobs) / (args.slots * duration)
+    print(f'🧮 {len(jobs)} jobs, {args.slots} slots, offered load {load:.0%}, interactive target {args.target_seconds:.0f}s\n')
+    print(f"{'policy':12} {'class':12} {'jobs':>6} {'wait p50':>9} {'p50 s':>9} {'p95 s':>9} {'p99 s':>9}")
+
+    report = {'jobs': len(jobs), 'slots': args.slots, 'reserved_slots': reserved_slots, 'offered_load': load, 'policies': {}}
+    for policy in ('fifo', 'wfq', 'wfq+reserve'):
+        summary = summarize(simulate(jobs, args.slots, policy, reserved_slots), args.target_seconds)
+        report['policies'][policy] = summary
+        for name, stats in summary.items():
+            if isinstance(stats, dict):
+                print(f"{policy:12} {name:12} {stats['jobs']:6} {stats['wait_p50_s']:9.1f} {stats['latency_p50_s']:9.1f} "
+                      f"{stats['latency_p95_s']:9.1f} {stats['latency_p99_s']:9.1f}")
+        within = summary['short_jobs_within_target']
+        print(f"{policy:12} interactive jobs within {args.target_seconds:.0f}s: {within:.1%}\n" if within is not None else '')
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'📄 Report written to {args.output}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
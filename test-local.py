@@ -24,6 +24,9 @@ os.environ['DYNAMODB_TABLE'] = 'tts-requests'
 os.environ['S3_BUCKET'] = 'tts-bucket-1758569760'
 os.environ['AWS_DEFAULT_REGION'] = 'us-east-1'
 
+# Shared handler code, deployed as a Lambda layer
+sys.path.append('lambda-functions/common')
+
 # Load upload handler
 upload_spec = importlib.util.spec_from_file_location(
     "upload_lambda", 
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Tests for the OCR text normalization (tts_common/normalize.py)
+
+Feeds made-up OCR pages through normalize_pages and checks that running
+headers, footers and page numbers are dropped while body lines are kept,
+that words hyphenated across a line or a page break are joined, and that
+number and abbreviation expansion spell out what they should and leave
+currency amounts, list markers, decimals and codes alone.
+
+Usage:
+  python3 test-normalize.py
+"""
+
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lambda-functions', 'common'))
+
+from tts_common.normalize import billed_length, expand_abbreviations, expand_numbers, expansions, normalize_pages
+
+
+BODIES = ['Stone arches came first.', 'Iron followed them.', 'Steel spans grew longer.',
+          'Cables carried the decks.', 'Concrete made them cheap.']
+
+
+def book_pages():
+    """Pages with a running header, a numbered footer and one body paragraph"""
+    return [f'THE HISTORY OF BRIDGES\nChapter 2\n\n{body}\n\nPage {page} of {len(BODIES)}'
+            for page, body in enumerate(BODIES, 1)]
+
+
+def test_running_headers_and_footers():
+    text = normalize_pages(book_pages())
+    assert 'HISTORY OF BRIDGES' not in text, 'running header kept'
+    assert 'Chapter 2' not in text, 'second header line kept'
+    assert 'of 5' not in text, 'page footer kept'
+    assert text == '\n\n'.join(BODIES) + '\n', repr(text)
+
+
+def test_few_pages_keep_edge_lines():
+    # Two pages are too few to tell a running header from a repeated heading
+    text = normalize_pages(['Summary\nFirst page.', 'Summary\nSecond page.'])
+    assert text.count('Summary') == 2
+
+
+def test_bare_page_numbers():
+    text = normalize_pages(['12\nA page that starts with its number.', 'A page that ends with it.\n- 13 -'])
+    assert text == 'A page that starts with its number.\n\nA page that ends with it.\n', repr(text)
+
+
+def test_body_line_with_header_text_kept():
+    # Only the two outer lines at each end are checked, the same line further in stays
+    pages = [f'THE HISTORY OF BRIDGES\n{body}\nTHE HISTORY OF BRIDGES is the title.\nSo it was.\nPage {page}'
+             for page, body in enumerate(BODIES, 1)]
+    text = normalize_pages(pages)
+    assert text.count('THE HISTORY OF BRIDGES') == len(BODIES), repr(text)
+
+
+def test_hyphenation_across_lines_and_pages():
+    text = normalize_pages(['The bridge was com-\nplete by spring and the en-', 'gineers went home. A well-\nKnown name stayed.'])
+    assert 'complete' in text, repr(text)
+    assert 'engineers' in text, 'word split across a page break not joined'
+    # A capital after the break is a new word, not the rest of one
+    assert 'well- Known' in text, repr(text)
+
+
+def test_whitespace_collapsed():
+    text = normalize_pages(['Line  one\nline   two\n\n\n\nNext   paragraph.'])
+    assert text == 'Line one line two\n\nNext paragraph.\n', repr(text)
+    assert billed_length('a  b\n\nc ') == 5
+
+
+def test_years():
+    assert expand_numbers('In 1999 and 2024, not 1900 or 2005.') == \
+        'In nineteen ninety-nine and twenty twenty-four, not nineteen hundred or two thousand five.'
+    assert expand_numbers('Since 1805') == 'Since eighteen oh five'
+
+
+def test_cardinals():
+    assert expand_numbers('0 1 13 40 105') == 'zero one thirteen forty one hundred five'
+    assert expand_numbers('1,000 people and 2,500,017 more') == \
+        'one thousand people and two million five hundred thousand seventeen more'
+
+
+def test_decimals_and_codes_kept():
+    assert expand_numbers('A4 paper, 3.5 mm, version 2.0.1, item 7b') == 'A4 paper, 3.5 mm, version 2.0.1, item 7b'
+
+
+def test_currency_kept():
+    for text in ['$1,000', '$ 20', '€5', '100€', '20 £', 'costs ¥300']:
+        assert expand_numbers(text) == text, f'{text!r} -> {expand_numbers(text)!r}'
+
+
+def test_list_markers_kept():
+    text = expand_numbers('Steps:\n1. Take 3 cups\n2) Add 12 eggs\n  10. Serve')
+    assert text == 'Steps:\n1. Take three cups\n2) Add twelve eggs\n  10. Serve', repr(text)
+    # A number ending a sentence is not a list marker, nor is a year starting a line
+    assert expand_numbers('We had 3. Then more') == 'We had three. Then more'
+    assert expand_numbers('1999. It began') == 'nineteen ninety-nine. It began'
+
+
+def test_list_markers_kept_through_normalize():
+    text = normalize_pages(['Recipe\n1. Take 3 cups\n2. Add 2 eggs'], expand=('numbers',))
+    assert text == 'Recipe 1. Take three cups 2. Add two eggs\n', repr(text)
+
+
+def test_abbreviations():
+    text = expand_abbreviations('Dr. Smith vs. Mr. Jones, e.g. on p. 4, see Fig. 2 etc. Then i.e. approx. 5')
+    assert text == 'Doctor Smith versus Mister Jones, for example on page 4, see Figure 2 et cetera. Then that is approximately 5', repr(text)
+    # Only before a name or a number
+    assert expand_abbreviations('a dr. and no. more') == 'a dr. and no. more'
+
+
+def test_expansions_setting():
+    assert expansions('numbers, abbreviations', 'English') == ('numbers', 'abbreviations')
+    assert expansions('numbers,unknown', 'english') == ('numbers',)
+    assert expansions('numbers', 'arabic') == ()
+    assert expansions(None, 'english') == ()
+    assert normalize_pages(['Page has 3 items.'], expand=()) == 'Page has 3 items.\n'
+
+
+TESTS = [
+    test_running_headers_and_footers,
+    test_few_pages_keep_edge_lines,
+    test_bare_page_numbers,
+    test_body_line_with_header_text_kept,
+    test_hyphenation_across_lines_and_pages,
+    test_whitespace_collapsed,
+    test_years,
+    test_cardinals,
+    test_decimals_and_codes_kept,
+    test_currency_kept,
+    test_list_markers_kept,
+    test_list_markers_kept_through_normalize,
+    test_abbreviations,
+    test_expansions_setting
+]
+
+
+def main():
+    failed = 0
+    for test in TESTS:
+        try:
+            test()
+            print(f'✅ {test.__name__}')
+        except AssertionError as e:
+            failed += 1
+            print(f'❌ {test.__name__}: {e}')
+    print(f'\n{len(TESTS) - failed}/{len(TESTS)} passed')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+Fault-injection tests for the image-converter page checkpoints
+
+Runs the real image-converter handler against the local_aws fakes, breaks it
+at different points (Bedrock errors, a failed checkpoint write, the Lambda
+deadline, the job's last attempt, a duplicate message) and checks that the
+retry resumes from the first unfinished page, that no page already returned
+by Bedrock is sent again, and that the text comes out in page order.
+
+Usage:
+  python3 test-ocr-resume.py
+  python3 test-ocr-resume.py --pages 40
+"""
+
+import argparse
+import io
+import json
+import sys
+
+import local_aws
+from local_aws import FakeBedrock, FakePage, LambdaContext, LocalAWS, SQSEventSource, filler_text
+
+
+class FaultyBedrock(FakeBedrock):
+    """FakeBedrock that raises on chosen call numbers and counts the pages it returned"""
+
+    def __init__(self, fail_on=()):
+        super().__init__()
+        self.fail_on = set(fail_on)
+        self.calls = 0
+        self.pages = []
+
+    def invoke_model(self, modelId, body, **kwargs):
+        self.calls += 1
+        if self.calls in self.fail_on:
+            raise local_aws.Exceptions.ValidationException('Injected model error', 'InvokeModel')
+        response = super().invoke_model(modelId, body, **kwargs)
+        self.pages.append(self.calls)
+        return response
+
+
+class DeadlineContext(LambdaContext):
+    """Reports plenty of time left for the first pages checks, then almost none"""
+
+    def __init__(self, pages):
+        super().__init__('image-converter')
+        self.checks_left = pages
+
+    def get_remaining_time_in_millis(self):
+        self.checks_left -= 1
+        return 15 * 60 * 1000 if self.checks_left >= 0 else 1000
+
+
+def setup(pages, bedrock):
+    aws = LocalAWS(bedrock=bedrock).install()
+    handler = local_aws.load_handler('image-converter')
+    reference_key = 'resume-test'
+    aws.table.put_item(Item={'reference_key': reference_key, 'TaskStatus': 'pdf-to-images conversion is completed'})
+    for page in range(1, pages + 1):
+        image = io.BytesIO()
+        FakePage(f'[page {page}] ' + filler_text(200, seed=page)).save(image)
+        aws.s3.put_object(Bucket=aws.BUCKET, Key=f'images/{reference_key}/page_{page}.png', Body=image.getvalue())
+    return aws, handler, reference_key
+
+
+def sns_event(aws, reference_key):
+    message = json.dumps({'reference_key': reference_key, 'bucket': aws.BUCKET})
+    return {'Records': [{'EventSource': 'aws:sns', 'Sns': {'Message': message}}]}
+
+
+def invoke(handler, aws, reference_key, context=None):
+    try:
+        handler.lambda_handler(sns_event(aws, reference_key), context or LambdaContext('image-converter'))
+        return None
+    except Exception as e:
+        return e
+
+
+def status(aws, reference_key):
+    return aws.table.get_item(Key={'reference_key': reference_key})['Item']['TaskStatus']
+
+
+def output(aws, reference_key):
+    key = f'download/{reference_key}/formatted_output.txt'
+    return aws.s3.get_object(Bucket=aws.BUCKET, Key=key)['Body'].read().decode('utf-8')
+
+
+def checkpoints(aws, reference_key):
+    response = aws.s3.list_objects_v2(Bucket=aws.BUCKET, Prefix=f'ocr/{reference_key}/')
+    return len(response.get('Contents', []))
+
+
+def check_output(aws, reference_key, pages):
+    text = output(aws, reference_key)
+    positions = [text.find(f'[page {page}]') for page in range(1, pages + 1)]
+    assert -1 not in positions, 'a page is missing from the output'
+    assert positions == sorted(positions), 'pages are out of order'
+    assert text.count('[page ') == pages, 'a page appears twice in the output'
+
+
+def test_page_order(pages):
+    bedrock = FaultyBedrock()
+    aws, handler, reference_key = setup(pages, bedrock)
+    assert invoke(handler, aws, reference_key) is None
+    check_output(aws, reference_key, pages)
+    assert len(bedrock.pages) == pages
+
+
+def test_bedrock_error_resumes(pages):
+    fail_at = pages // 2
+    bedrock = FaultyBedrock(fail_on=[fail_at])
+    aws, handler, reference_key = setup(pages, bedrock)
+    assert invoke(handler, aws, reference_key) is not None
+    assert checkpoints(aws, reference_key) == fail_at - 1
+    assert status(aws, reference_key) == 'images-to-text conversion is failed'
+    assert invoke(handler, aws, reference_key) is None
+    assert len(bedrock.pages) == pages, f'{len(bedrock.pages)} pages sent to Bedrock for {pages}'
+    assert status(aws, reference_key) == 'images-to-text conversion is completed'
+    check_output(aws, reference_key, pages)
+
+
+def test_checkpoint_write_fails(pages):
+    bedrock = FaultyBedrock()
+    aws, handler, reference_key = setup(pages, bedrock)
+    put_object = aws.s3.put_object
+    writes = {'count': 0}
+
+    def failing_put(**kwargs):
+        if kwargs['Key'].startswith('ocr/'):
+            writes['count'] += 1
+            if writes['count'] == 3:
+                raise local_aws.ClientError('InternalError', 'Injected S3 error', 'PutObject')
+        return put_object(**kwargs)
+
+    aws.s3.put_object = failing_put
+    assert invoke(handler, aws, reference_key) is not None
+    assert invoke(handler, aws, reference_key) is None
+    # Only the page whose checkpoint was lost is paid for twice
+    assert len(bedrock.pages) == pages + 1, f'{len(bedrock.pages)} pages sent to Bedrock for {pages}'
+    check_output(aws, reference_key, pages)
+
+
+def test_deadline_continues_in_new_message(pages):
+    bedrock = FaultyBedrock()
+    aws, handler, reference_key = setup(pages, bedrock)
+    urls = aws.connect_stage_queues(visibility_timeout=1)
+    queue_url = urls[aws.OCR_QUEUE]
+    aws.sqs.send_message(QueueUrl=queue_url, MessageBody=json.dumps({'reference_key': reference_key, 'bucket': aws.BUCKET}))
+
+    source = SQSEventSource(aws.sqs, queue_url, handler, 'image-converter', batch_size=1, max_concurrency=1)
+    pages_per_invocation = max(1, pages // 4)
+    invocations = 0
+    while invocations < pages * 2:
+        messages = aws.sqs.receive_message(QueueUrl=queue_url, MaxNumberOfMessages=1, WaitTimeSeconds=0).get('Messages', [])
+        if not messages:
+            break
+        records = [source.to_record(message) for message in messages]
+        assert all(record['attributes']['ApproximateReceiveCount'] == '1' for record in records), 'continuation used up a receive'
+        result = handler.lambda_handler({'Records': records}, DeadlineContext(pages_per_invocation))
+        assert not result['batchItemFailures']
+        for message in messages:
+            aws.sqs.delete_message(QueueUrl=queue_url, ReceiptHandle=message['ReceiptHandle'])
+        invocations += 1
+
+    assert invocations > 1, 'the deadline never cut an invocation short'
+    assert len(bedrock.pages) == pages, f'{len(bedrock.pages)} pages sent to Bedrock for {pages}'
+    assert status(aws, reference_key) == 'images-to-text conversion is completed'
+    check_output(aws, reference_key, pages)
+
+
+def test_final_attempt_keeps_checkpoints(pages):
+    bedrock = FaultyBedrock(fail_on=range(3, pages * 10))
+    aws, handler, reference_key = setup(pages, bedrock)
+    assert invoke(handler, aws, reference_key) is not None
+    assert status(aws, reference_key) == 'images-to-text conversion is failed'
+    assert checkpoints(aws, reference_key) == 2
+    # A later retry (e.g. a DLQ redrive) picks up after page 2
+    bedrock.fail_on = set()
+    assert invoke(handler, aws, reference_key) is None
+    assert len(bedrock.pages) == pages
+    check_output(aws, reference_key, pages)
+
+
+def test_duplicate_message_after_completion(pages):
+    bedrock = FaultyBedrock()
+    aws, handler, reference_key = setup(pages, bedrock)
+    assert invoke(handler, aws, reference_key) is None
+    writes = []
+    aws.s3.add_notification(writes.append, prefix='download/')
+    assert invoke(handler, aws, reference_key) is None
+    assert len(bedrock.pages) == pages
+    assert not writes, 'a duplicate message rewrote the text and would start synthesis again'
+    assert status(aws, reference_key) == 'images-to-text conversion is completed'
+
+
+TESTS = [
+    test_page_order,
+    test_bedrock_error_resumes,
+    test_checkpoint_write_fails,
+    test_deadline_continues_in_new_message,
+    test_final_attempt_keeps_checkpoints,
+    test_duplicate_message_after_completion
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fault-injection tests for OCR checkpoint and resume')
+    parser.add_argument('--pages', type=int, default=12, help='pages per test document, more than 9 checks numeric ordering')
+    args = parser.parse_args()
+
+    failed = 0
+    for test in TESTS:
+        try:
+            test(args.pages)
+            print(f'✅ {test.__name__}')
+        except AssertionError as e:
+            failed += 1
+            print(f'❌ {test.__name__}: {e}')
+    print(f'\n{len(TESTS) - failed}/{len(TESTS)} passed')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
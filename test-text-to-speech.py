@@ -32,14 +32,14 @@ os.environ['S3_BUCKET'] = 'tts-bucket-1758567505'
 os.environ['SNS_TOPIC_NAME'] = 'tts-processing-topic'
 os.environ['AWS_REGION'] = 'us-east-1'
 
-# Import Lambda functions
-sys.path.append('lambda-functions/upload-execution')
-sys.path.append('lambda-functions/document-splitter')
-sys.path.append('lambda-functions/polly-invoker')
+# Import Lambda functions, each under its own module name
+sys.path.append('lambda-functions/common')
 
-import lambda_function as upload_lambda
-import lambda_function as splitter_lambda
-import lambda_function as polly_lambda
+from local_aws import load_handler
+
+upload_lambda = load_handler('upload-execution')
+splitter_lambda = load_handler('document-splitter')
+polly_lambda = load_handler('polly-invoker')
 
 def test_text_to_speech():
     """Test the complete text-to-speech flow"""
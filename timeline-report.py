@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Stage latency report from the per-job Timeline attribute
+
+Every pipeline stage appends an entry (start/finish time, duration, queue wait
+and the stage's sizes) to its job's Timeline. This tool reads those timelines
+and prints p50/p95/p99 per stage and input type, plus end to end for finished
+jobs.
+
+Usage:
+  python3 timeline-report.py --table tts-requests-local
+  python3 timeline-report.py --input timelines.json --since 2024-01-01T00:00:00
+  python3 timeline-report.py --table tts-requests-local --output timeline-report.json
+
+--input accepts a list of job items, a POST /track response with
+"include_timeline": true, or a get_timeline response.
+"""
+
+import argparse
+import json
+import sys
+from datetime import datetime
+
+FINAL_STATUS = 'Voice-is-Ready'
+FIELDS = ['duration_ms', 'QueueWait']
+
+
+def parse_time(value):
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * (len(ordered) - 1)))))]
+
+
+def load_items(args):
+    if args.input:
+        with open(args.input) as f:
+            data = json.load(f)
+        if isinstance(data, dict):
+            data = data.get('requests', [data])
+        return data
+
+    import boto3
+    table = boto3.resource('dynamodb', region_name=args.region).Table(args.table)
+    items = []
+    kwargs = {'ProjectionExpression': 'reference_key, InputType, TaskStatus, Timeline'}
+    while True:
+        response = table.scan(**kwargs)
+        items.extend(response['Items'])
+        if 'LastEvaluatedKey' not in response:
+            return items
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def collect(items, since=None):
+    samples = {}
+    jobs = 0
+    # Billed characters before text normalization and removed by it, summed over jobs
+    normalization = {'jobs': 0, 'chars_before': 0, 'chars_saved': 0}
+
+    def add(key, field, value):
+        samples.setdefault(key, {}).setdefault(field, []).append(float(value))
+
+    for item in items:
+        timeline = item.get('Timeline') or []
+        if not timeline:
+            continue
+        if since and parse_time(timeline[0]['started_at']).replace(tzinfo=None) < since:
+            continue
+        jobs += 1
+        input_type = item.get('InputType', timeline[0].get('input_type', 'PDF'))
+        for entry in timeline:
+            if 'CharsBeforeNormalization' in entry:
+                normalization['jobs'] += 1
+                normalization['chars_before'] += int(entry['CharsBeforeNormalization'])
+                normalization['chars_saved'] += int(entry.get('CharsSaved', 0))
+            for key in ((entry['stage'], input_type), (entry['stage'], 'ALL')):
+                for field in FIELDS:
+                    if field in entry:
+                        add(key, field, entry[field])
+        if timeline[-1]['status'] == FINAL_STATUS:
+            total = (parse_time(timeline[-1]['finished_at']) - parse_time(timeline[0]['started_at'])).total_seconds() * 1000
+            add(('end-to-end', input_type), 'duration_ms', total)
+            add(('end-to-end', 'ALL'), 'duration_ms', total)
+    return jobs, samples, normalization
+
+
+def summarize(samples):
+    rows = []
+    for (stage, input_type), fields in sorted(samples.items()):
+        for field, values in fields.items():
+            rows.append({
+                'stage': stage,
+                'input_type': input_type,
+                'metric': field,
+                'count': len(values),
+                'p50_ms': percentile(values, 0.50),
+                'p95_ms': percentile(values, 0.95),
+                'p99_ms': percentile(values, 0.99),
+                'max_ms': max(values)
+            })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Per-stage p50/p95/p99 from job timelines')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--table', help='DynamoDB table to scan')
+    source.add_argument('--input', help='JSON file with job items')
+    parser.add_argument('--region', default='us-east-1')
+    parser.add_argument('--since', type=datetime.fromisoformat, help='only jobs started at or after this UTC time')
+    parser.add_argument('--output', help='also write the report as JSON')
+    args = parser.parse_args()
+
+    jobs, samples, normalization = collect(load_items(args), args.since)
+    if not jobs:
+        print('No jobs with a Timeline found')
+        return 1
+
+    rows = summarize(samples)
+    print(f'📊 {jobs} jobs\n')
+    print(f"{'stage':20} {'input':6} {'metric':12} {'count':>6} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10}")
+    for row in rows:
+        print(f"{row['stage']:20} {row['input_type']:6} {row['metric']:12} {row['count']:6} "
+              f"{row['p50_ms']:10.0f} {row['p95_ms']:10.0f} {row['p99_ms']:10.0f}")
+    if normalization['chars_before']:
+        print(f"\n✂️  Normalization saved {normalization['chars_saved']} of {normalization['chars_before']} billed characters "
+              f"({normalization['chars_saved'] / normalization['chars_before']:.1%}) over {normalization['jobs']} jobs")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'jobs': jobs, 'stages': rows, 'normalization': normalization}, f, indent=2)
+        print(f'\n📄 Report written to {args.output}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())